@@ -137,7 +137,8 @@ class MainFormPancake3D(OrsAbstractWindow):
             self.worker_thread = pancake_worker.PancakeWorker(
                 self.selected_roi, visualize_steps, visualize_results, c_s, output_filepath,
                 self.ui.chk_compare_lindblad.isChecked(), self.ui.chk_compare_lewiner.isChecked(),
-                self.ui.chk_gen_dragonfly_mesh.isChecked(), vertex_threshold
+                self.ui.chk_gen_dragonfly_mesh.isChecked(), vertex_threshold,
+                max_workers=self.ui.spin_box_workers.value(), preview=self.ui.chk_preview.isChecked()
             )
     
             self.worker_thread.update_output_label.connect(self.update_output_label)
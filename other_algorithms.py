@@ -1,10 +1,7 @@
 from ORSModel import ors
 
-from skimage import measure
-
 from .processing import data
 import numpy as np
-import open3d as o3d
 
 
 def surface_area_lewiner_2012(roi_data: np.ndarray, scale: data.Scale):
@@ -18,6 +15,10 @@ def surface_area_lewiner_2012(roi_data: np.ndarray, scale: data.Scale):
                 dividing by 2.
     """
 
+    # imported on first use since skimage and Open3D slow down loading the plugin
+    from skimage import measure
+    import open3d as o3d
+
     # pad the ROI data to avoid topological inconsistencies near the edge
     try:
         roi_data = np.pad(roi_data, 1)
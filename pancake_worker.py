@@ -11,6 +11,8 @@ from ORSModel import ors
 
 import numpy as np
 from .processing import processing
+from .processing import batch
+from .processing import labels
 from . import other_algorithms
 
 from .log import logger
@@ -55,11 +57,29 @@ def mesh_to_ors(mesh: processing.mesh.Mesh, translations: list[np.ndarray], scal
     :return: The Dragonfly ORS mesh
     """
 
-    logger.info("Converting mesh to ORS mesh")
+    vertices, triangles = mesh.vertices_and_triangles()
+
+    return arrays_to_ors(vertices, triangles, translations, scale)
+
+
+def arrays_to_ors(
+        vertices: np.ndarray, triangles: np.ndarray, translations: list[np.ndarray], scale: data.Scale
+) -> ors.Mesh:
+    """
+    Converts mesh vertices and triangles to a Dragonfly ORS mesh. Used for meshes that come back from a batch worker
+    process, which only sends back the arrays.
+
+    :param vertices: The (N, 3) vertex array
+    :param triangles: The (M, 3) triangle array
+    :param translations: The translations made to the OBB and mesh when padding the data. Used to translate the vertices
+        back to the original when creating the output mesh to visualize in Dragonfly.
+    :param scale: The voxel spacing
+    :return: The Dragonfly ORS mesh
+    """
 
-    o3d_mesh = mesh.mesh
+    logger.info("Converting mesh to ORS mesh")
 
-    np_vertices = np.asarray(o3d_mesh.vertices)
+    np_vertices = np.array(vertices, dtype=np.float64)
 
     # translate all vertices by 1/2 * scale for the axis to center the mesh at the voxel center
     np_vertices += 0.5 * scale.xyz()
@@ -70,7 +90,7 @@ def mesh_to_ors(mesh: processing.mesh.Mesh, translations: list[np.ndarray], scal
 
     np_vertices = np_vertices.flatten()
 
-    np_triangles = np.asarray(o3d_mesh.triangles).flatten()
+    np_triangles = np.asarray(triangles).flatten()
 
     # divide vertices by 1e9 to get meters instead of nanometers
     np_vertices = np_vertices / 1e9
@@ -117,7 +137,8 @@ class PancakeWorker(QThread):
     def __init__(self, selected_roi: Union[None, ors.ROI, ors.MultiROI],
                  visualize_steps: bool, visualize_results: bool, c_s: float,
                  output_filepath: str, compare_lindblad: bool, compare_lewiner: bool, gen_dragonfly_mesh: bool,
-                 dist_threshold: typing.Optional[float] = None):
+                 dist_threshold: typing.Optional[float] = None, max_workers: typing.Optional[int] = None,
+                 collect_metrics: bool = False, preview: bool = False):
         """
         Initializes the Pancake Worker.
 
@@ -130,6 +151,14 @@ class PancakeWorker(QThread):
         :param compare_lewiner: Whether to compare the Lewiner 2012 algorithm in the output CSV
         :param gen_dragonfly_mesh: Whether to generate a Dragonfly mesh of the final result and publish it
         :param dist_threshold: The distance threshold to clip each vertex in the final step.
+        :param max_workers: The number of worker processes used for MultiROIs. If None or 1, the PSDs are processed one
+                            at a time in this process, which avoids starting a pool inside Dragonfly. Visualizing
+                            forces a single worker. See batch.BatchEngine
+        :param collect_metrics: Whether to record the time and memory used by each processing step and write them to
+                                the log. For MultiROIs, the metrics of every PSD are combined.
+        :param preview: Whether to show an approximate area of a single ROI, found on a downsampled copy of it, before
+                        refining it at full resolution. Skipped for c_s above processing.PREVIEW_MAX_C_S. See
+                        processing.get_area(preview_factor)
         """
 
         super().__init__()
@@ -143,6 +172,9 @@ class PancakeWorker(QThread):
         self._compare_lewiner = compare_lewiner
         self._gen_dragonfly_mesh = gen_dragonfly_mesh
         self._dist_threshold = dist_threshold
+        self._max_workers = max_workers
+        self._collect_metrics = collect_metrics
+        self._preview = preview
 
     def _write_to_csv(
             self, names: list[str], outputs: list[float],
@@ -176,12 +208,32 @@ class PancakeWorker(QThread):
         scale = scale_from_roi(self._selected_roi)
         cropped_roi_arr, original_translations = get_cropped_roi_arr(self._selected_roi, scale)
 
+        if self._preview and self._c_s > processing.PREVIEW_MAX_C_S:
+            # the preview is too far off at large c_s to be worth showing
+            self.update_output_label.emit(
+                f"No preview for cs above {processing.PREVIEW_MAX_C_S}. Calculating at full resolution..."
+            )
+        elif self._preview:
+            self.update_output_label.emit("Calculating preview...")
+            preview_output = processing.get_area(
+                raw_data=cropped_roi_arr, scale=scale, c_s=self._c_s, dist_threshold=self._dist_threshold,
+                preview_factor=processing.PREVIEW_FACTOR, outputs=()
+            )
+            self.update_output_label.emit(
+                f"Preview area: ~{preview_output.area_microns():.6f} μm², usually within 10% (often low). "
+                f"Refining at full resolution..."
+            )
+
         output = processing.get_area(
             raw_data=cropped_roi_arr, scale=scale, visualize=self._visualize_steps,
             visualize_end=self._visualize_results, c_s=self._c_s, visualize_signal=self.show_visualization,
-            dist_threshold=self._dist_threshold
+            dist_threshold=self._dist_threshold, collect_metrics=self._collect_metrics,
+            outputs=("psd_mesh",) if self._gen_dragonfly_mesh else ()
         )
 
+        if output.metrics is not None:
+            logger.info(f"Processing metrics:\n{output.metrics.summary()}")
+
         # todo: code cleanup: remove duplicate code between single ROI and multi ROI about generating dragonfly mesh
         if self._gen_dragonfly_mesh and output.psd_mesh is not None:
             ors_mesh = mesh_to_ors(output.psd_mesh, [original_translations, output.translations], scale)
@@ -206,63 +258,101 @@ class PancakeWorker(QThread):
 
         self._write_to_csv([self._selected_roi.getTitle()], [area_output], lindblad_2005, lewiner_2012)
 
+    def _report_batch_progress(self, completed: int, total: typing.Optional[int]) -> None:
+        """
+        Progress callback for the batch engine. Aggregates the progress of all worker processes into the output label.
+
+        :param completed: The number of completed PSDs
+        :param total: The total number of PSDs, or None if unknown
+        """
+
+        total = total if total is not None else self._selected_roi.getLabelCount()
+        self.update_output_label.emit(f"Processed {completed}/{total} PSDs")
+
+    def _load_multi_roi_labels(
+            self, original_translations: list[np.ndarray], scales: list[data.Scale],
+            lindblad_2005: typing.Optional[list[float]], lewiner_2012: typing.Optional[list[float]]
+    ) -> typing.Iterator[tuple[np.ndarray, data.Scale]]:
+        """
+        Loads each label of the selected MultiROI as a cropped array. The label volume is read once and split into the
+        labels lazily. The comparison algorithms are computed while the label is loaded.
+
+        :param original_translations: Filled with the translations of each cropped label
+        :param scales: Filled with the scale of each label
+        :param lindblad_2005: Filled with the Lindblad 2005 area of each label, if not None
+        :param lewiner_2012: Filled with the Lewiner 2012 area of each label, if not None
+        :return: An iterator of (cropped label array, scale) for each label
+        """
+
+        label_count = self._selected_roi.getLabelCount()
+        scale = scale_from_roi(self._selected_roi)
+
+        for label, cropped_roi_arr, translations in labels.iter_multi_roi_labels(self._selected_roi, scale):
+            logger.info(f"Loading PSD {label}/{label_count}...")
+
+            original_translations.append(translations)
+            scales.append(scale)
+
+            if lindblad_2005 is not None:
+                # The Lindblad 2005 area is computed by Dragonfly, so it still needs an ROI of the label
+                copy_roi: ors.ROI = ors.ROI()
+                copy_roi.copyShapeFromStructuredGrid(self._selected_roi)
+                self._selected_roi.addToVolumeROI(copy_roi, label)
+                lindblad_2005.append(other_algorithms.surface_area_lindblad_2005(copy_roi))
+                copy_roi.deleteObject()
+
+            if lewiner_2012 is not None:
+                lewiner_2012.append(other_algorithms.surface_area_lewiner_2012(cropped_roi_arr, scale))
+
+            yield cropped_roi_arr, scale
+
     def process_multi_roi(self):
         logger.info("Running pancake worker multiroi")
-        
-        labels = []
-        names = []
-        outputs = []
+
+        label_count = self._selected_roi.getLabelCount()
+        label_ids = list(range(1, label_count + 1))
+        names = [self._selected_roi.getLabelName(label) for label in label_ids]
+        original_translations = []
+        scales = []
         lindblad_2005 = [] if self._compare_lindblad else None
         lewiner_2012 = [] if self._compare_lewiner else None
 
-        for label in range(1, self._selected_roi.getLabelCount() + 1):
-            logger.info(f"Processing PSD {label}/{self._selected_roi.getLabelCount()}...")
-            
-            self.update_output_label.emit(f"Loading PSD {label}/{self._selected_roi.getLabelCount()}")
-
-            copy_roi: ors.ROI = ors.ROI()
-            copy_roi.copyShapeFromStructuredGrid(self._selected_roi)
-            self._selected_roi.addToVolumeROI(copy_roi, label)
-            labels.append(label)
-            names.append(self._selected_roi.getLabelName(label))
+        # Visualization signals cannot be sent to other processes
+        visualize = self._visualize_steps or self._visualize_results
+        engine = batch.BatchEngine(
+            max_workers=1 if visualize or self._max_workers is None else self._max_workers,
+            progress_callback=self._report_batch_progress,
+            visualize=self._visualize_steps, visualize_end=self._visualize_results, c_s=self._c_s,
+            visualize_signal=self.show_visualization if visualize else None, dist_threshold=self._dist_threshold,
+            collect_metrics=self._collect_metrics, outputs=("psd_mesh",) if self._gen_dragonfly_mesh else ()
+        )
 
-            self.update_output_label.emit(f"Processing PSD {label}/{self._selected_roi.getLabelCount()}")
+        self.update_output_label.emit(f"Processing {label_count} PSDs")
 
-            scale = scale_from_roi(copy_roi)
+        results = engine.map(self._load_multi_roi_labels(original_translations, scales, lindblad_2005, lewiner_2012))
+        outputs = [result.area_microns() for result in results]
 
-            cropped_roi_arr, original_translations = get_cropped_roi_arr(copy_roi, scale)
+        combined_metrics = batch.aggregate_metrics(results)
+        if combined_metrics is not None:
+            logger.info(f"Processing metrics for {label_count} PSDs:\n{combined_metrics.summary()}")
 
-            output = processing.get_area(
-                raw_data=cropped_roi_arr, scale=scale, visualize=self._visualize_steps,
-                visualize_end=self._visualize_results, c_s=self._c_s, visualize_signal=self.show_visualization,
-                dist_threshold=self._dist_threshold
-            )
+        if self._gen_dragonfly_mesh:
+            for label, result, translations, scale in zip(label_ids, results, original_translations, scales):
+                if result.vertices is None:
+                    continue
 
-            if self._gen_dragonfly_mesh and output.psd_mesh is not None:
-                ors_mesh = mesh_to_ors(output.psd_mesh, [original_translations, output.translations], scale)
+                ors_mesh = arrays_to_ors(
+                    result.vertices, result.triangles, [translations, result.translations], scale
+                )
                 ors_mesh.setTitle(f"3D Pancake Output Mesh: {label}")
                 ors_mesh.publish()
 
-            outputs.append(output.area_microns())
-
-            if self._compare_lindblad:
-                self.update_output_label.emit(
-                    f"Calculating Lindblad 2005 area for PSD {label}/{self._selected_roi.getLabelCount()}...")
-                lindblad_2005.append(other_algorithms.surface_area_lindblad_2005(copy_roi))
-
-            if self._compare_lewiner:
-                self.update_output_label.emit(
-                    f"Calculating Lewiner 2012 area for PSD {label}/{self._selected_roi.getLabelCount()}...")
-                lewiner_2012.append(other_algorithms.surface_area_lewiner_2012(cropped_roi_arr, scale))
-
-            copy_roi.deleteObject()
-
-        self.update_output_label.emit(f"Completed {self._selected_roi.getLabelCount()} PSDs.")
+        self.update_output_label.emit(f"Completed {label_count} PSDs.")
 
         if self._output_filepath == "":
             return
 
-        self._write_to_csv(names, outputs, labels, lindblad_2005, lewiner_2012)
+        self._write_to_csv(names, outputs, label_ids, lindblad_2005, lewiner_2012)
 
     def run(self):
         try:
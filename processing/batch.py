@@ -0,0 +1,370 @@
+import os
+import time
+from concurrent import futures
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+from multiprocessing import resource_tracker
+from multiprocessing import shared_memory
+from typing import Callable, Iterable, Iterator, Optional, Union
+
+import numpy as np
+
+from . import data
+from .metrics import PipelineMetrics
+from . import processing
+
+# Workaround since running Dragonfly with OrsMinimalStartupScript.py causes the package path to be different
+if __package__.count(".") == 0:
+    from log import logger
+else:
+    from ..log import logger
+
+
+@dataclass(frozen=True)
+class BatchResult:
+    """
+    The parts of a PancakeOutput that are sent back from a batch worker. The full PancakeOutput is not sent back since
+    it holds several volumes that are expensive to pickle and are not needed after processing.
+    """
+    area_nm: float
+
+    """
+    The vertices and triangles of the final mesh. None if the input data was empty or the mesh wasn't requested with
+    get_area(outputs).
+    """
+    vertices: Optional[np.ndarray]
+    triangles: Optional[np.ndarray]
+
+    """
+    The translations made to the OBB and mesh when padding the data. See PancakeOutput.translations.
+    """
+    translations: np.ndarray
+
+    """
+    The time and memory used by each step. None unless the batch engine was created with collect_metrics=True.
+    """
+    metrics: Optional[PipelineMetrics] = None
+
+    """
+    The estimated discretisation error of area_nm. See PancakeOutput.area_error_nm.
+    """
+    area_error_nm: Optional[float] = None
+
+    """
+    The wall time of processing.get_area in seconds, measured without collecting metrics.
+    """
+    wall_time: Optional[float] = None
+
+    def area_microns(self) -> float:
+        """
+        Gets the area in um^2
+
+        :return: The area in um^2
+        """
+
+        return self.area_nm / 1e6
+
+    @staticmethod
+    def from_output(output: processing.PancakeOutput, wall_time: Optional[float] = None) -> "BatchResult":
+        """
+        Creates a batch result from the output of the processing pipeline.
+
+        :param output: The output of processing.get_area
+        :param wall_time: The wall time of processing.get_area in seconds
+        :return: The batch result
+        """
+
+        if output.psd_mesh is None:
+            return BatchResult(
+                output.area_nm, None, None, output.translations, output.metrics, output.area_error_nm, wall_time
+            )
+
+        vertices, triangles = output.psd_mesh.vertices_and_triangles()
+
+        return BatchResult(
+            output.area_nm, vertices, triangles, output.translations, output.metrics, output.area_error_nm, wall_time
+        )
+
+
+def aggregate_metrics(results: Iterable[BatchResult]) -> Optional[PipelineMetrics]:
+    """
+    Combines the metrics of every result in a batch. See PipelineMetrics.aggregate.
+
+    :param results: The batch results
+    :return: The combined metrics, or None if no result has metrics
+    """
+
+    return PipelineMetrics.aggregate(result.metrics for result in results)
+
+
+@dataclass(frozen=True)
+class _SharedVolume:
+    """
+    A reference to a volume stored in shared memory, small enough to be pickled cheaply
+    """
+    name: str
+    shape: tuple[int, ...]
+    dtype: str
+
+
+def _process(raw_data: np.ndarray, scale: data.Scale, get_area_kwargs: dict) -> BatchResult:
+    """
+    Runs the processing pipeline on a volume and times it.
+
+    :param raw_data: The volume to process
+    :param scale: The voxel spacing
+    :param get_area_kwargs: Keyword arguments passed to processing.get_area
+    :return: The batch result
+    """
+
+    start = time.perf_counter()
+    output = processing.get_area(raw_data, scale, **get_area_kwargs)
+
+    return BatchResult.from_output(output, time.perf_counter() - start)
+
+
+def _process_shared(volume: _SharedVolume, scale: data.Scale, get_area_kwargs: dict) -> BatchResult:
+    """
+    Runs the processing pipeline on a volume stored in shared memory. Runs in a worker process.
+
+    :param volume: The shared volume to process
+    :param scale: The voxel spacing
+    :param get_area_kwargs: Keyword arguments passed to processing.get_area
+    :return: The batch result
+    """
+
+    shm = shared_memory.SharedMemory(name=volume.name)
+    # On POSIX, attaching registers the block with a resource tracker, which would report it as leaked, or unlink it
+    # when the worker exits. The main process owns the block
+    if os.name == "posix":
+        resource_tracker.unregister(shm._name, "shared_memory")
+
+    try:
+        raw_data = np.ndarray(volume.shape, dtype=volume.dtype, buffer=shm.buf)
+        result = _process(raw_data, scale, get_area_kwargs)
+        del raw_data
+
+        return result
+    finally:
+        shm.close()
+
+
+# Raised when the worker processes can't be started, e.g. when the interpreter is embedded in another program that
+# can't be launched as a Python process
+_POOL_STARTUP_ERRORS = (OSError, NotImplementedError, BrokenProcessPool)
+
+
+class BatchEngine:
+    """
+    Runs processing.get_area over many PSDs using a pool of worker processes. Volumes are handed to the workers through
+    shared memory instead of being pickled. If the pool can't be started, the PSDs are processed in this process.
+    """
+
+    def __init__(
+            self, max_workers: Optional[int] = None, progress_callback: Optional[Callable[[int, int], None]] = None,
+            progress_interval: float = 0.5, return_exceptions: bool = False, **get_area_kwargs
+    ):
+        """
+        :param max_workers: The number of worker processes. If None, the number of CPUs is used. If 1, the PSDs are
+                            processed in this process, which is required for visualization.
+        :param progress_callback: Called with (completed, total) as PSDs finish. total is None until all PSDs have
+                                  been submitted.
+        :param progress_interval: The minimum number of seconds between two progress callbacks. The final callback is
+                                  always made.
+        :param return_exceptions: Whether the exception raised while processing a PSD is returned as its result instead
+                                  of being raised, so the other PSDs are still processed
+        :param get_area_kwargs: Keyword arguments passed to processing.get_area for every PSD. Unless outputs is given,
+                                only the mesh is requested, since the other optional outputs aren't sent back
+        """
+
+        # the points and vector fields would only be built to be dropped by BatchResult.from_output
+        get_area_kwargs.setdefault("outputs", ("psd_mesh",))
+
+        self.max_workers = max_workers if max_workers is not None else (os.cpu_count() or 1)
+        self.progress_callback = progress_callback
+        self.progress_interval = progress_interval
+        self.return_exceptions = return_exceptions
+        self.get_area_kwargs = get_area_kwargs
+
+        if self.max_workers < 1:
+            raise ValueError("max_workers must be at least 1")
+
+        if self.max_workers > 1 and get_area_kwargs.get("visualize_signal") is not None:
+            raise ValueError("visualize_signal cannot be sent to worker processes. Use max_workers=1 instead")
+
+        self._last_progress = -np.inf
+
+    def _report_progress(self, completed: int, total: Optional[int], force: bool = False) -> None:
+        """
+        Calls the progress callback if enough time has passed since the last call.
+
+        :param completed: The number of completed PSDs
+        :param total: The total number of PSDs, or None if unknown
+        :param force: Whether to call the callback regardless of the time since the last call
+        """
+
+        if self.progress_callback is None:
+            return
+
+        now = time.perf_counter()
+        if not force and now - self._last_progress < self.progress_interval:
+            return
+
+        self._last_progress = now
+        self.progress_callback(completed, total)
+
+    def imap_unordered(
+            self, items: Iterable[tuple[np.ndarray, data.Scale]]
+    ) -> Iterator[tuple[int, Union[BatchResult, Exception]]]:
+        """
+        Processes the items, yielding results as soon as they are complete. Items are pulled from the iterable lazily
+        so at most a few volumes are held in shared memory at once.
+
+        :param items: (volume, scale) pairs to process
+        :return: An iterator of (index of the item, result). The result is the exception raised while processing the
+                 item if it failed and return_exceptions is set
+        """
+
+        self._last_progress = -np.inf
+
+        executor = self._start_pool() if self.max_workers > 1 else None
+
+        if executor is None:
+            yield from self._imap_in_process(items)
+            return
+
+        yield from self._imap_pool(executor, items)
+
+    def map(self, items: Iterable[tuple[np.ndarray, data.Scale]]) -> list[Union[BatchResult, Exception]]:
+        """
+        Processes the items and returns the results in the same order as the items.
+
+        :param items: (volume, scale) pairs to process
+        :return: The results, in the same order as the items. See imap_unordered
+        """
+
+        results = {}
+
+        for index, result in self.imap_unordered(items):
+            results[index] = result
+
+        return [results[index] for index in range(len(results))]
+
+    def _imap_in_process(
+            self, items: Iterable[tuple[np.ndarray, data.Scale]]
+    ) -> Iterator[tuple[int, Union[BatchResult, Exception]]]:
+        completed = 0
+
+        for index, (volume, scale) in enumerate(items):
+            try:
+                result = _process(volume, scale, self.get_area_kwargs)
+            except Exception as e:
+                if not self.return_exceptions:
+                    raise
+
+                result = e
+
+            completed += 1
+
+            self._report_progress(completed, None)
+            yield index, result
+
+        self._report_progress(completed, completed, force=True)
+
+    def _start_pool(self) -> Optional[futures.ProcessPoolExecutor]:
+        """
+        Starts the pool of worker processes and waits for one of them to run a task, so startup errors are found before
+        any PSD is handed to the pool.
+
+        :return: The pool, or None if the worker processes can't be started
+        """
+
+        logger.info(f"Starting batch with {self.max_workers} worker processes")
+
+        executor = None
+
+        try:
+            executor = futures.ProcessPoolExecutor(max_workers=self.max_workers)
+            executor.submit(os.getpid).result()
+        except _POOL_STARTUP_ERRORS as e:
+            logger.warning(f"Could not start the worker processes, processing in this process instead: {e!r}")
+
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+
+            return None
+
+        return executor
+
+    def _imap_pool(
+            self, executor: futures.ProcessPoolExecutor, items: Iterable[tuple[np.ndarray, data.Scale]]
+    ) -> Iterator[tuple[int, Union[BatchResult, Exception]]]:
+        max_pending = 2 * self.max_workers
+        pending: dict[futures.Future, tuple[int, shared_memory.SharedMemory]] = {}
+        items = enumerate(items)
+        exhausted = False
+        completed = 0
+
+        with executor:
+            try:
+                while pending or not exhausted:
+                    # Keep the pool saturated without copying every volume into shared memory at once
+                    while not exhausted and len(pending) < max_pending:
+                        try:
+                            index, (volume, scale) = next(items)
+                        except StopIteration:
+                            exhausted = True
+                            break
+
+                        shm, shared_volume = self._to_shared(volume)
+                        future = executor.submit(_process_shared, shared_volume, scale, self.get_area_kwargs)
+                        pending[future] = (index, shm)
+
+                    if not pending:
+                        break
+
+                    done, _ = futures.wait(pending, return_when=futures.FIRST_COMPLETED)
+
+                    for future in done:
+                        index, shm = pending.pop(future)
+                        shm.close()
+                        shm.unlink()
+
+                        try:
+                            result = future.result()
+                        except Exception as e:
+                            if not self.return_exceptions:
+                                raise
+
+                            result = e
+
+                        completed += 1
+
+                        self._report_progress(completed, None if not exhausted else completed + len(pending))
+                        yield index, result
+            finally:
+                for future in pending:
+                    future.cancel()
+
+                futures.wait(pending)
+
+                for _, shm in pending.values():
+                    shm.close()
+                    shm.unlink()
+
+        self._report_progress(completed, completed, force=True)
+
+    @staticmethod
+    def _to_shared(volume: np.ndarray) -> tuple[shared_memory.SharedMemory, _SharedVolume]:
+        """
+        Copies a volume into a new shared memory block.
+
+        :param volume: The volume to copy
+        :return: (The shared memory block, a picklable reference to the volume)
+        """
+
+        volume = np.asarray(volume)
+        shm = shared_memory.SharedMemory(create=True, size=max(volume.nbytes, 1))
+        np.ndarray(volume.shape, dtype=volume.dtype, buffer=shm.buf)[...] = volume
+
+        return shm, _SharedVolume(shm.name, volume.shape, volume.dtype.str)
@@ -1,53 +1,274 @@
-import open3d as o3d
+from typing import TYPE_CHECKING, Iterable
+
 import numpy as np
+from scipy import ndimage
+from scipy import spatial
 
+from .data import dataformat
 from .data import meta
 
 from scipy.spatial.transform import Rotation
 
+if TYPE_CHECKING:
+    import open3d as o3d
+
 
 class Obb:
+    """
+    The oriented bounding box of a PSD. Found the same way as Open3D's OrientedBoundingBox.create_from_points: the axes
+    are the principal axes of the vertices of the convex hull of the points, and the box is the tightest box along
+    those axes. The extents are sorted from largest to smallest, and the axes are right-handed.
+    """
+
+    # the number of z layers of the data whose hull is found at once
+    _CHUNK_LAYERS = 16
+
+    # the number of voxel coordinates whose hull is found at once
+    _CHUNK_VOXELS = 2 ** 18
+
     def __init__(self, bool_data: np.ndarray, scale: meta.Scale):
-        self.o3d_obb: o3d.geometry.OrientedBoundingBox = self._gen(bool_data, scale)
-        self.vertices = np.array(self.o3d_obb.get_box_points())
-        self.rotation = Rotation.from_matrix(np.array(self.o3d_obb.R))
+        self.center, self.extent, self.rotation_matrix = self._gen(bool_data, scale)
+        self._update()
+
+    @classmethod
+    def from_box(cls, center: np.ndarray, extent: np.ndarray, rotation: np.ndarray) -> "Obb":
+        """
+        Creates an OBB from its box instead of from data.
+
+        :param center: The XYZ center of the box
+        :param extent: The side lengths of the box along each of its axes
+        :param rotation: (3, 3) rotation matrix whose columns are the axes of the box
+        :return: The OBB
+        """
+
+        obb = cls.__new__(cls)
+        obb.center = np.array(center, dtype=np.float64)
+        obb.extent = np.array(extent, dtype=np.float64)
+        obb.rotation_matrix = np.array(rotation, dtype=np.float64)
+        obb._update()
+
+        return obb
+
+    @classmethod
+    def from_points(cls, chunks: Iterable[np.ndarray]) -> "Obb":
+        """
+        Creates an OBB around points given in chunks, e.g. sparse coordinates read in pieces. Only the convex hull of
+        each chunk is kept, so the points never have to be in memory at once.
+
+        :param chunks: (N, 3) XYZ points in any number of chunks
+        :return: The OBB
+        """
+
+        obb = cls.__new__(cls)
+        obb.center, obb.extent, obb.rotation_matrix = cls._fit(cls._merge_hulls(chunks))
+        obb._update()
+
+        return obb
+
+    @classmethod
+    def from_voxels(cls, coordinates: np.ndarray, scale: meta.Scale) -> "Obb":
+        """
+        Creates the same OBB as Obb(bool_data, scale) from the coordinates of the foreground voxels of bool_data,
+        without building the volume.
+
+        :param coordinates: (N, 3) ZYX indices of the foreground voxels
+        :param scale: The scale of the data
+        :return: The OBB
+        """
+
+        def chunks() -> Iterable[np.ndarray]:
+            for start in range(0, len(coordinates), cls._CHUNK_VOXELS):
+                points = coordinates[start:start + cls._CHUNK_VOXELS, ::-1] * scale.xyz()
+
+                # include the points 1 z-layer down to make sure the last voxel is fully included in the OBB
+                yield np.vstack((points, points - [0, 0, scale.z]))
+
+        return cls.from_points(chunks())
+
+    def _update(self) -> None:
+        """
+        Updates the corners and rotation after the box changed
+        """
+
+        # the same corner order as Open3D's OrientedBoundingBox.get_box_points
+        x, y, z = (self.rotation_matrix * self.extent / 2).T
+        self.vertices = self.center + np.array([
+            -x - y - z, x - y - z, -x + y - z, -x - y + z, x + y + z, -x + y + z, x - y + z, x + y - z
+        ])
+        self.rotation = Rotation.from_matrix(self.rotation_matrix)
 
     @staticmethod
-    def _gen(bool_data: np.ndarray, scale: meta.Scale) -> o3d.geometry.OrientedBoundingBox:
+    def _hull_vertices(points: np.ndarray) -> np.ndarray:
+        """
+        :param points: (N, 3) points
+        :return: The vertices of the convex hull of the points, or all points if they are flat
+        """
+
+        if len(points) < 4:
+            return points
+
+        try:
+            return points[spatial.ConvexHull(points).vertices]
+        except spatial.QhullError:
+            return points
+
+    @classmethod
+    def _merge_hulls(cls, chunks: Iterable[np.ndarray]) -> np.ndarray:
+        """
+        The hull of a union of point sets is the hull of the union of their hulls, so the hull of each chunk is found
+        and merged.
+
+        :param chunks: (N, 3) points in chunks
+        :return: The vertices of the convex hull of all points
+        """
+
+        hulls = [cls._hull_vertices(np.asarray(chunk, dtype=np.float64)) for chunk in chunks]
+        hulls = [hull for hull in hulls if len(hull) > 0]
+
+        if not hulls:
+            raise ValueError("Cannot fit an OBB to no points")
+
+        return cls._hull_vertices(np.vstack(hulls))
+
+    @staticmethod
+    def _fit(hull_vertices: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Fits the box along the principal axes of the hull vertices.
+
+        :param hull_vertices: (N, 3) vertices of the convex hull of the points
+        :return: (center, extent, rotation matrix whose columns are the axes)
+        """
+
+        mean = np.mean(hull_vertices, axis=0)
+        centered = hull_vertices - mean
+        covariance = centered.T @ centered / len(hull_vertices)
+
+        # eigh sorts the eigenvalues in ascending order, so reverse them to put the largest extent first
+        _, axes = np.linalg.eigh(covariance)
+        axes = axes[:, ::-1]
+
+        if np.linalg.det(axes) < 0:
+            axes[:, 2] *= -1
+
+        local = centered @ axes
+        local_min = np.min(local, axis=0)
+        local_max = np.max(local, axis=0)
+
+        return mean + axes @ ((local_min + local_max) / 2), local_max - local_min, axes
+
+    @classmethod
+    def _gen(cls, bool_data: np.ndarray, scale: meta.Scale) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
         """
         Generates the OBB from the data.
 
         :param bool_data: The 3D boolean data to generate the OBB from
         :param scale: The scale of the data
-        :return: The OBB
+        :return: (center, extent, rotation matrix)
         """
 
-        points = np.argwhere(bool_data)[:, ::-1] * scale.xyz()
+        def chunks() -> Iterable[np.ndarray]:
+            # interior voxels can't be vertices of the hull, so only the surface voxels of each chunk of z layers are
+            # used. The layers next to the chunk are included so the chunk's first and last layers aren't all surface
+            for z_start in range(0, bool_data.shape[0], cls._CHUNK_LAYERS):
+                z_stop = min(z_start + cls._CHUNK_LAYERS, bool_data.shape[0])
+                padded_start = max(z_start - 1, 0)
+                padded = bool_data[padded_start:min(z_stop + 1, bool_data.shape[0])]
+
+                surface = padded & ~ndimage.binary_erosion(padded, border_value=0)
+                surface = surface[z_start - padded_start:z_stop - padded_start]
+
+                points = (np.argwhere(surface) + [z_start, 0, 0])[:, ::-1] * scale.xyz()
+
+                # include the points 1 z-layer down to make sure the last voxel is fully included in the OBB
+                yield np.vstack((points, points - [0, 0, scale.z]))
+
+        return cls._fit(cls._merge_hulls(chunks()))
+
+    def to_o3d(self) -> "o3d.geometry.OrientedBoundingBox":
+        """
+        :return: The OBB as an Open3D OrientedBoundingBox, for visualization
+        """
 
-        # duplicate points 1 z-layer down to make sure the last voxel is fully included in the OBB
-        points = np.vstack((points, points - [0, 0, scale.z]))
+        import open3d as o3d
 
-        pcd = o3d.geometry.PointCloud(o3d.utility.Vector3dVector(points))
-        return pcd.get_oriented_bounding_box()
+        return o3d.geometry.OrientedBoundingBox(self.center, self.rotation_matrix, self.extent)
 
-    def get_mesh(self) -> o3d.geometry.TriangleMesh:
+    def get_mesh(self) -> "o3d.geometry.TriangleMesh":
         """
         :return: The mesh of the OBB
         """
 
+        import open3d as o3d
+
         mesh_box = o3d.geometry.TriangleMesh.create_box(width=1.0, height=1.0, depth=1.0)
         mesh_box.translate([-0.5, -0.5, -0.5])  # Center the box at the origin
 
         # Create a scaling transformation matrix to scale the box to the size of the OBB
-        scaling_matrix = np.diag([*self.o3d_obb.extent, 1])
+        scaling_matrix = np.diag([*self.extent, 1])
         mesh_box.transform(scaling_matrix)
 
         # Rotate and translate the box to match the OBB
-        mesh_box.rotate(self.o3d_obb.R, center=(0, 0, 0))
-        mesh_box.translate(self.o3d_obb.center)
+        mesh_box.rotate(self.rotation_matrix, center=(0, 0, 0))
+        mesh_box.translate(self.center)
 
         return mesh_box
 
+    def ray_intervals(self, origins: np.ndarray, direction: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Intersects the lines origin + t * direction with the OBB using an analytic ray-slab intersection.
+
+        :param origins: The (N, 3) line origins
+        :param direction: The normalized line direction as an XYZ vector
+        :return: (t where each line enters the OBB, t where it exits). t_enter > t_exit if the line misses
+        """
+
+        # Move into the frame of the OBB, where it is an axis-aligned box centered at the origin
+        local_origins = (origins - self.center) @ self.rotation_matrix
+        local_direction = direction @ self.rotation_matrix
+        half_extent = self.extent / 2
+
+        t_enter = np.full(len(origins), -np.inf)
+        t_exit = np.full(len(origins), np.inf)
+
+        for axis in range(3):
+            if abs(local_direction[axis]) < 1e-12:
+                # The ray is parallel to the slab, so it either always or never lies between the two planes
+                outside = np.abs(local_origins[:, axis]) > half_extent[axis]
+                t_enter[outside] = np.inf
+                t_exit[outside] = -np.inf
+                continue
+
+            t1 = (-half_extent[axis] - local_origins[:, axis]) / local_direction[axis]
+            t2 = (half_extent[axis] - local_origins[:, axis]) / local_direction[axis]
+
+            t_enter = np.maximum(t_enter, np.minimum(t1, t2))
+            t_exit = np.minimum(t_exit, np.maximum(t1, t2))
+
+        return t_enter, t_exit
+
+    def ray_hit_distances(self, origins: np.ndarray, direction: np.ndarray) -> np.ndarray:
+        """
+        Casts two rays from each origin, one along direction and one against it, and finds the distance to the first
+        face of the OBB each ray hits. Uses an analytic ray-slab intersection, giving the same result as casting the
+        rays against get_mesh() with Open3D.
+
+        :param origins: The (N, 3) ray origins
+        :param direction: The normalized ray direction as an XYZ vector
+        :return: (N, 2) array of the hit distances along direction and against direction. np.inf if the ray misses
+        """
+
+        t_enter, t_exit = self.ray_intervals(origins, direction)
+        hits = t_enter <= t_exit
+
+        # The first hit along the ray is where it enters the box, or where it exits if it starts inside
+        forward = np.where(t_enter >= 0, t_enter, t_exit)
+        forward[~hits | (t_exit < 0)] = np.inf
+
+        backward = np.where(t_exit <= 0, -t_exit, -t_enter)
+        backward[~hits | (t_enter > 0)] = np.inf
+
+        return np.column_stack((forward, backward))
+
     def get_rotation_vec(self) -> np.ndarray:
         """
         :return: A normalized 3D vector representing the rotation of the OBB in 3D space
@@ -99,13 +320,47 @@ class Obb:
         #  3. Pad the data
         #  4. Translate the OBB to contain the padded data
 
+        padding_voxels = self._padding(scale, data.shape)
+
+        # Pad the data
+        padded_data = np.pad(data, padding_voxels[::-1], mode="constant")
+
+        return padded_data, self._translate(scale, padding_voxels)
+
+    def expand_coordinates(
+            self, scale: meta.Scale, coordinates: np.ndarray, shape: tuple[int, int, int]
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        The same as expand_data for the coordinates of the foreground voxels of the data. Only the padded volume is
+        built, so the unpadded volume is never in memory.
+
+        :param scale: The scale of the data.
+        :param coordinates: (N, 3) ZYX indices of the foreground voxels of the data
+        :param shape: The shape of the data
+        :return: (The expanded data, the OBB transformations). Also mutates the vertices of this OBB
+        """
+
+        padding_voxels = self._padding(scale, shape)
+        padded_shape = np.array(shape) + np.sum(padding_voxels[::-1], axis=1)
+
+        padded_data = dataformat.densify(coordinates, tuple(padded_shape), padding_voxels[::-1, 0])
+
+        return padded_data, self._translate(scale, padding_voxels)
+
+    def _padding(self, scale: meta.Scale, shape: tuple[int, ...]) -> np.ndarray:
+        """
+        :param scale: The scale of the data
+        :param shape: The ZYX shape of the data
+        :return: (3, 2) number of voxels to pad before and after the data along each of X, Y and Z
+        """
+
         # Get the min and max of the OBB's vertices' AABB
         min_obb_xyz = np.min(self.vertices, axis=0)
         max_obb_xyz = np.max(self.vertices, axis=0)
 
         # Get the min and max of the data
         min_data_xyz = (0, 0, 0)
-        max_data_xyz = data.shape[::-1] * scale.xyz()
+        max_data_xyz = shape[::-1] * scale.xyz()
 
         padding_world_coords = np.array([
             [max(-(min_obb_xyz[0] - min_data_xyz[0]), 0), max(max_obb_xyz[0] - max_data_xyz[0], 0)],
@@ -117,12 +372,19 @@ class Obb:
         padding_voxels = (padding_world_coords / scale.xyz().reshape(-1, 1)).astype(int)
         padding_voxels += 1  # Add 1 to make sure everything is fully included after casting to int
 
-        # Pad the data
-        padded_data = np.pad(data, padding_voxels[::-1], mode="constant")
+        return padding_voxels
+
+    def _translate(self, scale: meta.Scale, padding_voxels: np.ndarray) -> np.ndarray:
+        """
+        Translates the OBB to contain the padded data
+
+        :param scale: The scale of the data
+        :param padding_voxels: See _padding
+        :return: The translation
+        """
 
-        # Translate the OBB to contain the padded data
         translation_arr = (padding_voxels[:, 0] * scale.xyz()).astype(np.float64)
-        self.o3d_obb.translate(translation_arr, relative=True)
-        self.vertices = np.array(self.o3d_obb.get_box_points())
+        self.center = self.center + translation_arr
+        self._update()
 
-        return padded_data, translation_arr
+        return translation_arr
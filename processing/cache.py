@@ -0,0 +1,276 @@
+import hashlib
+import os
+import shutil
+import tempfile
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+
+from . import bounding_box
+from . import data
+
+# Workaround since running Dragonfly with OrsMinimalStartupScript.py causes the package path to be different
+if __package__.count(".") == 0:
+    from log import logger
+else:
+    from ..log import logger
+
+
+# Part of every key, so entries written by an older pipeline are never reused. Bump it whenever the OBB, the distance
+# map or the center found for the same data changes
+PIPELINE_VERSION = 1
+
+# the default size cap of a cache, in bytes
+MAX_BYTES = 2 ** 30
+
+_OBB_FILE = "obb.npz"
+
+
+@dataclass(frozen=True)
+class CacheStats:
+    """
+    Statistics about a PipelineCache. The counts are those of this PipelineCache object, so lookups made in other
+    processes, e.g. the workers of a BatchEngine, are not included. Those are recorded in the cache_hits and
+    cache_misses counters of the PipelineMetrics of each PSD instead.
+    :param hits: The number of lookups that found everything they needed
+    :param misses: The number of lookups that had to run the steps again
+    :param evictions: The number of entries removed to stay below the size cap
+    :param entries: The number of entries on disk
+    :param size_bytes: The size of the entries on disk
+    """
+
+    hits: int
+    misses: int
+    evictions: int
+    entries: int
+    size_bytes: int
+
+
+@dataclass(frozen=True)
+class CachedSteps:
+    """
+    The results of steps B to D of the pipeline for one PSD, read from a PipelineCache
+    """
+    obb: bounding_box.Obb
+
+    """
+    The distance map of the padded grid and the center found from it. None if only the OBB was needed.
+    """
+    distance_map: Optional[np.ndarray]
+    center: Optional[np.ndarray]
+
+
+class PipelineCache:
+    """
+    An on-disk cache of the steps of the pipeline that only depend on the cropped PSD and the voxel spacing: the OBB,
+    the distance map of the padded grid and the center. Entries are keyed by a SHA-256 hash of the foreground voxels of
+    the cropped PSD, its shape, the scale and PIPELINE_VERSION, so the same PSD is found again whether it is given as a
+    volume or as coordinates and wherever it was cropped from.
+
+    Each entry is a directory holding the OBB and a .npy distance map and center per precision, so distance maps can be
+    memory-mapped for out-of-core runs. Once the entries are larger than max_bytes, the least recently used ones are
+    removed. Entries are written to a temporary directory first and moved into place, so several processes can share a
+    cache.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = MAX_BYTES):
+        """
+        :param directory: The directory of the cache. Created if it doesn't exist
+        :param max_bytes: The size cap of the entries on disk
+        """
+
+        if max_bytes < 0:
+            raise ValueError(f"max_bytes must not be negative, not {max_bytes}")
+
+        os.makedirs(directory, exist_ok=True)
+
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    @staticmethod
+    def key(cropped: np.ndarray, scale: data.Scale, shape: Optional[tuple[int, int, int]] = None) -> str:
+        """
+        :param cropped: The cropped PSD, as returned by data.format_data, or the coordinates of its foreground voxels,
+                        as returned by data.format_coordinates
+        :param scale: The voxel spacing
+        :param shape: The shape of the cropped PSD. Required for coordinates
+        :return: The key of the PSD
+        """
+
+        if data.is_coordinates(cropped):
+            if shape is None:
+                raise ValueError("shape is required for coordinates")
+
+            indices = np.unique(np.ravel_multi_index(tuple(np.asarray(cropped).T), shape))
+        else:
+            shape = cropped.shape
+            indices = np.flatnonzero(cropped)
+
+        digest = hashlib.sha256()
+        digest.update(f"{PIPELINE_VERSION}|{scale.xy!r}|{scale.z!r}|{tuple(int(size) for size in shape)}|".encode())
+        digest.update(indices.astype("<i8").tobytes())
+
+        return digest.hexdigest()
+
+    def _entry(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    @staticmethod
+    def _map_files(dtype: np.dtype) -> tuple[str, str]:
+        """
+        :return: The file names of the distance map and the center of a precision
+        """
+
+        name = np.dtype(dtype).name
+        return f"distance_map_{name}.npy", f"center_{name}.npy"
+
+    def load(self, key: str, dtype: Optional[np.dtype] = None, mmap: bool = False) -> Optional[CachedSteps]:
+        """
+        Looks up a PSD. Counts as a hit if everything that is needed was found, and as a miss otherwise.
+
+        :param key: The key of the PSD. See key
+        :param dtype: The precision of the distance map that is needed. If None, only the OBB is needed
+        :param mmap: Whether to memory-map the distance map read-only instead of reading it into memory
+        :return: The cached steps, or None on a miss
+        """
+
+        entry = self._entry(key)
+
+        try:
+            with np.load(os.path.join(entry, _OBB_FILE)) as obb_file:
+                obb = bounding_box.Obb.from_box(obb_file["center"], obb_file["extent"], obb_file["rotation"])
+
+            distance_map = None
+            center = None
+
+            if dtype is not None:
+                map_file, center_file = self._map_files(dtype)
+                distance_map = np.load(os.path.join(entry, map_file), mmap_mode="r" if mmap else None)
+                center = np.load(os.path.join(entry, center_file))
+
+            # the modification time of the entry orders the entries for eviction
+            os.utime(entry)
+        except (FileNotFoundError, NotADirectoryError):
+            self._misses += 1
+            return None
+
+        self._hits += 1
+        logger.info(f"Found cached steps {key[:12]}")
+
+        return CachedSteps(obb, distance_map, center)
+
+    def store(
+            self, key: str, obb: bounding_box.Obb, distance_map: Optional[np.ndarray] = None,
+            center: Optional[np.ndarray] = None
+    ) -> None:
+        """
+        Stores the steps of a PSD, adding to its entry if it exists. Removes the least recently used entries afterwards
+        if the cache is larger than max_bytes.
+
+        :param key: The key of the PSD. See key
+        :param obb: The OBB
+        :param distance_map: The distance map of the padded grid. Stored under its precision. If None, only the OBB is
+                             stored
+        :param center: The center found from the distance map. Required with distance_map
+        """
+
+        entry = self._entry(key)
+
+        if not os.path.isdir(entry):
+            staging = tempfile.mkdtemp(prefix=".staging-", dir=self.directory)
+            np.savez(
+                os.path.join(staging, _OBB_FILE), center=obb.center, extent=obb.extent, rotation=obb.rotation_matrix
+            )
+
+            try:
+                os.rename(staging, entry)
+            except OSError:
+                # another process stored the same PSD first
+                shutil.rmtree(staging, ignore_errors=True)
+
+        if distance_map is not None:
+            if center is None:
+                raise ValueError("center is required with distance_map")
+
+            for file, array in zip(self._map_files(distance_map.dtype), (distance_map, center)):
+                path = os.path.join(entry, file)
+
+                if os.path.exists(path):
+                    continue
+
+                staging_file, staging = tempfile.mkstemp(prefix=".staging-", suffix=".npy", dir=entry)
+                with os.fdopen(staging_file, "wb") as f:
+                    np.save(f, array)
+
+                os.replace(staging, path)
+
+        os.utime(entry)
+        self._evict()
+
+    def _entries(self) -> list[tuple[float, int, str]]:
+        """
+        :return: (last use, size in bytes, path) of each entry
+        """
+
+        entries = []
+
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+
+            # only touch the directories named by a key, so nothing else in the directory is ever removed
+            if len(name) != 64 or name.strip("0123456789abcdef") or not os.path.isdir(path):
+                continue
+
+            try:
+                size = sum(file.stat().st_size for file in os.scandir(path) if file.is_file())
+                entries.append((os.stat(path).st_mtime, size, path))
+            except FileNotFoundError:
+                # evicted by another process
+                continue
+
+        return entries
+
+    def _evict(self) -> None:
+        """
+        Removes the least recently used entries until the cache is at most max_bytes
+        """
+
+        entries = sorted(self._entries())
+        size = sum(entry_size for _, entry_size, _ in entries)
+
+        for _, entry_size, path in entries:
+            if size <= self.max_bytes:
+                break
+
+            try:
+                shutil.rmtree(path)
+            except OSError:
+                # still memory-mapped on Windows, or evicted by another process
+                continue
+
+            size -= entry_size
+            self._evictions += 1
+            logger.info(f"Evicted cached steps {os.path.basename(path)[:12]}")
+
+    def stats(self) -> CacheStats:
+        """
+        :return: The statistics of the cache
+        """
+
+        entries = self._entries()
+
+        return CacheStats(
+            self._hits, self._misses, self._evictions, len(entries), sum(size for _, size, _ in entries)
+        )
+
+    def clear(self) -> None:
+        """
+        Removes every entry
+        """
+
+        for _, _, path in self._entries():
+            shutil.rmtree(path, ignore_errors=True)
@@ -1,17 +1,26 @@
+import math
+from typing import Optional
+
 import numpy as np
 
+from . import scratch
 from .data import meta
 
 
-def geom_center(dist_map: np.array, scale: meta.Scale) -> np.ndarray:
+def geom_center(dist_map: np.array, scale: meta.Scale, chunk_layers: Optional[int] = None) -> np.ndarray:
     """
     Finds the geometric center of the PSD using the geometric center of the top 1% of the PSD distance map
 
     :param dist_map: The distance map
     :param scale: The scale of a voxel
+    :param chunk_layers: If not None, the distance map is read in chunks of this many z layers, e.g. when it is
+                         memory-mapped. See _geom_center_chunked
     :return: A 3-element float array containing the geometric center in XYZ coordinates
     """
 
+    if chunk_layers is not None:
+        return _geom_center_chunked(dist_map, scale, chunk_layers)
+
     # Find the top 1% of the PSD
     top_vertices = np.percentile(dist_map, 99)
     top_indices = np.where(dist_map >= top_vertices)
@@ -21,3 +30,51 @@ def geom_center(dist_map: np.array, scale: meta.Scale) -> np.ndarray:
     center = center * scale.zyx()
 
     return center[::-1]
+
+
+def _geom_center_chunked(dist_map: np.ndarray, scale: meta.Scale, chunk_layers: int) -> np.ndarray:
+    """
+    The same as geom_center, reading the distance map one chunk of z layers at a time. Only the largest 1% of the
+    values are kept in memory to find the percentile, and the indices of the top 1% are summed chunk by chunk. The
+    sums are exact integers, so the result is bit-identical.
+    """
+
+    size = dist_map.size
+
+    # np.percentile's linear interpolation between the values at ranks lower_rank and lower_rank + 1
+    position = 0.99 * (size - 1)
+    lower_rank = math.floor(position)
+    kept = size - lower_rank
+    top = np.empty(0, dtype=dist_map.dtype)
+
+    for chunk, _, _ in scratch.z_chunks(dist_map.shape[0], chunk_layers):
+        top = np.concatenate((top, np.asarray(dist_map[chunk]).ravel()))
+
+        if len(top) > kept:
+            top = np.partition(top, len(top) - kept)[len(top) - kept:]
+
+    top = np.partition(top, min(1, len(top) - 1))
+    lower = top[0]
+    upper = top[min(1, len(top) - 1)]
+
+    # the same arithmetic as np.percentile
+    fraction = np.float64(position - lower_rank)
+    difference = np.subtract(upper, lower)
+    if fraction >= 0.5:
+        top_vertices = upper - difference * (1 - fraction)
+    else:
+        top_vertices = lower + difference * fraction
+
+    index_sums = np.zeros(3, dtype=np.int64)
+    count = 0
+
+    for chunk, _, _ in scratch.z_chunks(dist_map.shape[0], chunk_layers):
+        z, y, x = np.nonzero(np.asarray(dist_map[chunk]) >= top_vertices)
+        index_sums += [np.sum(z + chunk.start), np.sum(y), np.sum(x)]
+        count += len(z)
+
+    # Compute the center
+    center = index_sums / count
+    center = center * scale.zyx()
+
+    return center[::-1]
@@ -0,0 +1,433 @@
+"""
+Runs the processing pipeline over files of PSDs without Dragonfly. Run with python -m processing --help from the root
+of the repository.
+"""
+
+import argparse
+import csv
+import glob
+import json
+import os
+import sys
+from typing import Iterable, Iterator, Optional, TextIO, Union
+
+import numpy as np
+
+from . import batch
+from . import cache
+from . import components
+from . import gaussian
+from . import data
+
+# Workaround since running Dragonfly with OrsMinimalStartupScript.py causes the package path to be different
+if __package__.count(".") == 0:
+    from log import logger
+else:
+    from ..log import logger
+
+
+SUPPORTED_EXTENSIONS = (".npy", ".npz", ".tif", ".tiff")
+
+COLUMNS = ("file", "area_um2", "area_nm2", "area_error_nm2", "scale_xy", "scale_z", "wall_time_s", "error")
+
+# the columns added when each file is split into its connected components
+COMPONENT_COLUMNS = ("component", "voxel_count", "bbox_min_zyx", "bbox_max_zyx")
+
+
+def load_psd(path: str) -> np.ndarray:
+    """
+    Loads a PSD as a 3D boolean volume in ZYX order, or as the coordinates of its voxels.
+
+    .npy files hold the volume itself. .npz files hold the (N, 3) ZYX indices of the PSD's voxels in "arr", as written
+    by scripts/roi_to_npz.py, which processing.get_area takes without building the volume. .tif files hold one z layer
+    per page, as read by scripts/tif_to_npy.py.
+
+    :param path: The path to the file
+    :return: The volume, or the coordinates for .npz files
+    """
+
+    extension = os.path.splitext(path)[1].lower()
+
+    if extension == ".npz":
+        with np.load(path) as npz:
+            if "arr" not in npz:
+                raise ValueError(f"{path} has no 'arr' array of voxel coordinates")
+
+            coordinates = np.asarray(npz["arr"])
+
+        if coordinates.ndim != 2 or coordinates.shape[1] != 3:
+            raise ValueError(f"The coordinates in {path} must have shape (N, 3), not {coordinates.shape}")
+
+        return coordinates
+
+    if extension == ".npy":
+        volume = np.load(path)
+    elif extension in (".tif", ".tiff"):
+        # imported on first use since skimage is slow to import and only needed for tifs
+        from skimage import io
+
+        volume = io.imread(path)
+    else:
+        raise ValueError(f"Unsupported file type {extension!r}. Supported: {', '.join(SUPPORTED_EXTENSIONS)}")
+
+    if volume.ndim != 3:
+        raise ValueError(f"{path} must hold a 3D volume, not {volume.ndim}D")
+
+    return volume.astype(bool, copy=False)
+
+
+def open_stack(path: str):
+    """
+    Opens a binary stack to split into connected components. .npy files are memory-mapped so the stack is read one
+    slab at a time.
+
+    :param path: The path to the file
+    :return: The stack
+    """
+
+    if os.path.splitext(path)[1].lower() == ".npy":
+        stack = np.load(path, mmap_mode="r")
+    else:
+        stack = load_psd(path)
+
+    if stack.ndim != 3:
+        raise ValueError(f"{path} must hold a 3D volume to be split into components, not {stack.ndim}D")
+
+    return stack
+
+
+def find_inputs(patterns: Iterable[str]) -> list[str]:
+    """
+    Expands directories and glob patterns into the supported files they contain.
+
+    :param patterns: Files, directories or glob patterns. "**" matches any number of directories
+    :return: The sorted, unique paths of the files
+    """
+
+    paths = set()
+
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            matches = [os.path.join(pattern, name) for name in os.listdir(pattern)]
+        else:
+            matches = glob.glob(pattern, recursive=True)
+
+            if not matches and not glob.has_magic(pattern):
+                raise ValueError(f"{pattern} does not exist")
+
+        paths.update(
+            os.path.normpath(match) for match in matches
+            if os.path.isfile(match) and os.path.splitext(match)[1].lower() in SUPPORTED_EXTENSIONS
+        )
+
+    return sorted(paths)
+
+
+def read_scale_overrides(path: str) -> dict[str, data.Scale]:
+    """
+    Reads the voxel spacing of some files from a CSV file with the columns file, xy and z. The file column is either
+    the path or the name of the file.
+
+    :param path: The path to the CSV file
+    :return: Key: the path or name of the file, Value: its scale
+    """
+
+    overrides = {}
+
+    with open(path, newline="") as f:
+        reader = csv.DictReader(f)
+
+        missing = {"file", "xy", "z"} - set(reader.fieldnames or ())
+        if missing:
+            raise ValueError(f"{path} is missing the columns {', '.join(sorted(missing))}")
+
+        for row in reader:
+            overrides[os.path.normpath(row["file"])] = data.Scale(float(row["xy"]), float(row["z"]))
+
+    return overrides
+
+
+def scale_for(path: str, default_scale: data.Scale, overrides: dict[str, data.Scale]) -> data.Scale:
+    """
+    :param path: The path to the file
+    :param default_scale: The scale of files without an override
+    :param overrides: See read_scale_overrides
+    :return: The scale of the file. An override of the path takes precedence over an override of the name
+    """
+
+    return overrides.get(os.path.normpath(path), overrides.get(os.path.basename(path), default_scale))
+
+
+class ResultWriter:
+    """
+    Writes one row per PSD to CSV or JSON Lines as soon as it is complete, so partial results survive an interrupted
+    batch.
+    """
+
+    def __init__(self, stream: TextIO, output_format: str, columns: tuple[str, ...] = COLUMNS):
+        """
+        :param stream: The stream to write to
+        :param output_format: "csv" or "jsonl"
+        :param columns: The columns of each row
+        """
+
+        if output_format not in ("csv", "jsonl"):
+            raise ValueError(f"output_format must be 'csv' or 'jsonl', not {output_format!r}")
+
+        self.stream = stream
+        self.output_format = output_format
+        self.columns = columns
+        self._csv_writer = None
+
+        if output_format == "csv":
+            self._csv_writer = csv.DictWriter(stream, fieldnames=columns, lineterminator="\n")
+            self._csv_writer.writeheader()
+            stream.flush()
+
+    def write(self, row: dict) -> None:
+        """
+        :param row: The values of the columns. Missing columns are left empty. Tuples are written as JSON lists, or
+                    separated by spaces in CSV
+        """
+
+        row = {column: row.get(column) for column in self.columns}
+
+        if self._csv_writer is not None:
+            self._csv_writer.writerow({column: self._csv_value(value) for column, value in row.items()})
+        else:
+            self.stream.write(json.dumps(row) + "\n")
+
+        self.stream.flush()
+
+    @staticmethod
+    def _csv_value(value) -> str:
+        if value is None:
+            return ""
+
+        if isinstance(value, tuple):
+            return " ".join(str(v) for v in value)
+
+        return value
+
+
+def run_batch(
+        paths: list[str], default_scale: data.Scale, overrides: dict[str, data.Scale], writer: ResultWriter,
+        jobs: Optional[int], component_options: Optional[dict] = None, **get_area_kwargs
+) -> int:
+    """
+    Processes files and writes each result as it completes, in the order they complete.
+
+    :param paths: The files to process
+    :param default_scale: The scale of files without an override
+    :param overrides: Per-file scales. See read_scale_overrides
+    :param writer: Where to write the results
+    :param jobs: The number of worker processes. If None, the number of CPUs is used
+    :param component_options: If not None, each file is a stack that is split into its connected components, and each
+                              component is processed and written separately. Keyword arguments passed to
+                              components.find_components
+    :param get_area_kwargs: Keyword arguments passed to processing.get_area
+    :return: The number of files that failed to load and PSDs that failed to process
+    """
+
+    # the files and components of the items the engine was given, in order, so a result's index can be mapped back
+    submitted: list[tuple[str, data.Scale, Optional[components.Component]]] = []
+    failures = 0
+
+    def items() -> Iterator[tuple[np.ndarray, data.Scale]]:
+        nonlocal failures
+
+        for path in paths:
+            scale = scale_for(path, default_scale, overrides)
+
+            try:
+                if component_options is not None:
+                    stack = open_stack(path)
+                    stack_components = components.find_components(stack, **component_options)
+                else:
+                    psd = load_psd(path)
+            except (OSError, ValueError) as e:
+                logger.error(f"Could not load {path}: {e}")
+                writer.write({"file": path, "scale_xy": scale.xy, "scale_z": scale.z, "error": str(e)})
+                failures += 1
+                continue
+
+            if component_options is None:
+                submitted.append((path, scale, None))
+                yield psd, scale
+                continue
+
+            logger.info(f"Found {len(stack_components)} components in {path}")
+
+            for component in stack_components:
+                submitted.append((path, scale, component))
+                yield components.extract_component(stack, component, component_options["connectivity"]), scale
+
+    def report_progress(completed: int, total: Optional[int]) -> None:
+        logger.info(f"Processed {completed}/{total if total is not None else '?'} PSDs")
+
+    engine = batch.BatchEngine(
+        max_workers=jobs, progress_callback=report_progress, return_exceptions=True, **get_area_kwargs
+    )
+
+    for index, result in engine.imap_unordered(items()):
+        path, scale, component = submitted[index]
+
+        if isinstance(result, Exception):
+            # the row still gets the component columns below, so the failed component can be found
+            logger.error(f"Could not process {path}: {result!r}")
+            row = {"file": path, "scale_xy": scale.xy, "scale_z": scale.z, "error": str(result) or repr(result)}
+            failures += 1
+        else:
+            row = {
+                "file": path,
+                "area_um2": result.area_microns(),
+                "area_nm2": result.area_nm,
+                "area_error_nm2": result.area_error_nm,
+                "scale_xy": scale.xy,
+                "scale_z": scale.z,
+                "wall_time_s": result.wall_time
+            }
+
+        if component is not None:
+            bbox_min, bbox_max = component.bounding_box()
+            row.update(component=component.label, voxel_count=component.voxel_count, bbox_min_zyx=bbox_min,
+                       bbox_max_zyx=bbox_max)
+
+        writer.write(row)
+
+    return failures
+
+
+def _mesh_spacing(value: str) -> Union[float, str]:
+    """
+    Parses --mesh-spacing, which is a number or "auto"
+    """
+
+    if value == "auto":
+        return value
+
+    try:
+        spacing = float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"must be a number or 'auto', not {value!r}")
+
+    if spacing <= 0:
+        raise argparse.ArgumentTypeError("must be positive")
+
+    return spacing
+
+
+def _parse_args(argv: Optional[list[str]]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="python -m processing",
+        description="Finds the surface area of PSDs stored in .npy, .npz (voxel coordinates, as written by "
+                    "scripts/roi_to_npz.py) or multi-page .tif files, and writes one row per PSD as it completes."
+    )
+    parser.add_argument("inputs", nargs="+", help="Files, directories or glob patterns (quote them, ** is recursive)")
+    parser.add_argument("--scale", nargs=2, type=float, metavar=("XY", "Z"), required=True,
+                        help="The voxel spacing in nanometers of every file without an override")
+    parser.add_argument("--scale-overrides", metavar="CSV",
+                        help="CSV file with the columns file, xy and z giving the spacing of specific files. file is "
+                             "either the path or the name of the file")
+    parser.add_argument("--output", "-o", metavar="PATH", help="The file to write the results to. Default: stdout")
+    parser.add_argument("--format", choices=("csv", "jsonl"),
+                        help="The output format. Default: jsonl if the output ends with .jsonl or .json, csv otherwise")
+    parser.add_argument("--jobs", "-j", type=int, help="The number of worker processes. Default: the number of CPUs")
+    parser.add_argument("--c-s", type=float, default=0.67, help="The constant for the sigma formula. Default: 0.67")
+    parser.add_argument("--dist-threshold", type=float,
+                        help="The distance threshold to clip vertices by. Default: max(scale.xy, scale.z) / 2")
+    parser.add_argument("--precision", choices=("float64", "float32"), default="float64")
+    parser.add_argument("--blur-method", choices=gaussian.METHODS, default="direct")
+    parser.add_argument("--scratch-dir", metavar="DIR",
+                        help="Memory-map the volumes of each PSD to temporary files in this directory, for PSDs that "
+                             "don't fit in memory")
+    parser.add_argument("--mesh-spacing", type=_mesh_spacing, metavar="NM",
+                        help="The distance between neighboring mesh vertices in nm, or 'auto' to refine the mesh until "
+                             "its area converges and write the estimated error. Default: the smallest voxel side")
+    parser.add_argument("--mesh-tolerance", type=float, default=0.005,
+                        help="With --mesh-spacing auto, the relative area tolerance. Default: 0.005")
+    parser.add_argument("--preview-factor", type=int, default=1, metavar="N",
+                        help="Find approximate areas quickly on the PSDs downsampled by N along x and y. Default: 1")
+    parser.add_argument("--cache-dir", metavar="DIR",
+                        help="Cache the OBB, distance map and center of each PSD in this directory, so runs on the same "
+                             "PSDs with other options skip those steps")
+    parser.add_argument("--cache-size", type=float, default=cache.MAX_BYTES / 2 ** 20, metavar="MB",
+                        help="With --cache-dir, the size the cache is kept under by removing the least recently used "
+                             f"PSDs. Default: {cache.MAX_BYTES // 2 ** 20}")
+    parser.add_argument("--components", action="store_true",
+                        help="Treat each file as a stack of many PSDs, split it into its 3D connected components and "
+                             "write one row per component with its bounding box")
+    parser.add_argument("--connectivity", type=int, choices=(1, 2, 3), default=3,
+                        help="With --components, 1 connects face neighbors, 2 also edge and 3 also corner neighbors. "
+                             "Default: 3")
+    parser.add_argument("--min-voxels", type=int, default=1,
+                        help="With --components, skip components with fewer voxels. Default: 1")
+    parser.add_argument("--slab-layers", type=int, default=64,
+                        help="With --components, the number of z layers labelled at once. Default: 64")
+
+    args = parser.parse_args(argv)
+
+    if args.jobs is not None and args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+
+    if args.preview_factor < 1:
+        parser.error("--preview-factor must be at least 1")
+
+    if args.cache_size < 0:
+        parser.error("--cache-size must not be negative")
+
+    if args.format is None:
+        is_json = args.output is not None and args.output.lower().endswith((".jsonl", ".json"))
+        args.format = "jsonl" if is_json else "csv"
+
+    return args
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    """
+    Runs the command line interface.
+
+    :param argv: The command line arguments. If None, sys.argv is used
+    :return: The exit code, 1 if any file could not be loaded
+    """
+
+    args = _parse_args(argv)
+
+    default_scale = data.Scale(*args.scale)
+    overrides = read_scale_overrides(args.scale_overrides) if args.scale_overrides is not None else {}
+    paths = find_inputs(args.inputs)
+
+    if not paths:
+        logger.error("No .npy, .npz or .tif files found")
+        return 1
+
+    logger.info(f"Processing {len(paths)} files")
+
+    output = open(args.output, "w", newline="") if args.output is not None else sys.stdout
+
+    component_options = None
+    columns = COLUMNS
+
+    if args.components:
+        component_options = dict(
+            connectivity=args.connectivity, slab_layers=args.slab_layers, min_voxels=args.min_voxels
+        )
+        columns = COLUMNS[:1] + COMPONENT_COLUMNS + COLUMNS[1:]
+
+    pipeline_cache = None
+
+    if args.cache_dir is not None:
+        pipeline_cache = cache.PipelineCache(args.cache_dir, int(args.cache_size * 2 ** 20))
+
+    try:
+        failures = run_batch(
+            paths, default_scale, overrides, ResultWriter(output, args.format, columns), args.jobs, component_options,
+            c_s=args.c_s, dist_threshold=args.dist_threshold, precision=args.precision, blur_method=args.blur_method,
+            scratch_dir=args.scratch_dir, mesh_spacing=args.mesh_spacing, mesh_tolerance=args.mesh_tolerance,
+            preview_factor=args.preview_factor, cache=pipeline_cache, outputs=()
+        )
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+    return 1 if failures > 0 else 0
@@ -0,0 +1,280 @@
+from dataclasses import dataclass
+from typing import Callable, Iterator, Optional
+
+import numpy as np
+from scipy import ndimage
+
+from . import batch
+from . import data
+
+# Workaround since running Dragonfly with OrsMinimalStartupScript.py causes the package path to be different
+if __package__.count(".") == 0:
+    from log import logger
+else:
+    from ..log import logger
+
+
+@dataclass(frozen=True)
+class Component:
+    """
+    A 3D connected component of a binary stack
+    """
+
+    """
+    Components are numbered from 1 in the order of their first voxel in ZYX raster order.
+    """
+    label: int
+    voxel_count: int
+
+    """
+    The ZYX index of the component's first voxel in raster order, and the ZYX slices of its bounding box in the stack.
+    """
+    seed: tuple[int, int, int]
+    bounding_slice: tuple[slice, slice, slice]
+
+    def bounding_box(self) -> tuple[tuple[int, int, int], tuple[int, int, int]]:
+        """
+        :return: (the ZYX index of the first voxel of the bounding box, the ZYX index of the last voxel)
+        """
+
+        return (
+            tuple(s.start for s in self.bounding_slice),
+            tuple(s.stop - 1 for s in self.bounding_slice)
+        )
+
+
+@dataclass(frozen=True)
+class ComponentResult:
+    """
+    The area of one component of a stack. The vertices of the result are relative to the component's bounding box.
+    """
+    component: Component
+    result: batch.BatchResult
+
+    def area_microns(self) -> float:
+        """
+        Gets the area in um^2
+
+        :return: The area in um^2
+        """
+
+        return self.result.area_microns()
+
+
+class _UnionFind:
+    """
+    Disjoint sets of provisional labels, used to merge the labels of one component that were split across slabs
+    """
+
+    def __init__(self):
+        self.parent: list[int] = [0]
+
+    def add(self, count: int) -> None:
+        """
+        Adds the next count labels, each in its own set
+        """
+
+        self.parent.extend(range(len(self.parent), len(self.parent) + count))
+
+    def find(self, label: int) -> int:
+        root = label
+        while self.parent[root] != root:
+            root = self.parent[root]
+
+        # path compression
+        while self.parent[label] != root:
+            self.parent[label], label = root, self.parent[label]
+
+        return root
+
+    def union(self, a: int, b: int) -> None:
+        root_a = self.find(a)
+        root_b = self.find(b)
+
+        # keep the smaller label as the root so the roots are the first labels seen
+        if root_a < root_b:
+            self.parent[root_b] = root_a
+        elif root_b < root_a:
+            self.parent[root_a] = root_b
+
+
+def _boundary_pairs(previous: np.ndarray, current: np.ndarray, structure: np.ndarray) -> np.ndarray:
+    """
+    Finds the labels that touch across the boundary between two slabs.
+
+    :param previous: The labels of the last layer of the previous slab
+    :param current: The labels of the first layer of the current slab
+    :param structure: The 3x3x3 connectivity structure
+    :return: (N, 2) unique pairs of (previous label, current label) that are connected
+    """
+
+    pairs = []
+    height, width = previous.shape
+
+    # the neighbors of a voxel in the next layer are given by the last plane of the structure
+    for dy, dx in np.argwhere(structure[2]) - 1:
+        previous_part = previous[max(-dy, 0):height - max(dy, 0), max(-dx, 0):width - max(dx, 0)]
+        current_part = current[max(dy, 0):height - max(-dy, 0), max(dx, 0):width - max(-dx, 0)]
+
+        touching = (previous_part > 0) & (current_part > 0)
+        pairs.append(np.stack((previous_part[touching], current_part[touching]), axis=1))
+
+    if not pairs:
+        return np.zeros((0, 2), dtype=np.int64)
+
+    return np.unique(np.vstack(pairs), axis=0)
+
+
+def find_components(
+        stack, connectivity: int = 3, slab_layers: int = 64, min_voxels: int = 1
+) -> list[Component]:
+    """
+    Finds the 3D connected components of a binary stack. The stack is labelled in slabs of z layers, and labels that
+    touch across the boundary of two slabs are merged, so only one slab is in memory at once. The stack can be a
+    memory-mapped array, e.g. from np.load(path, mmap_mode="r"), to process stacks larger than the memory.
+
+    :param stack: A 3D array where nonzero voxels are foreground. Anything that can be sliced along z into arrays works
+    :param connectivity: Which neighbors are connected. 1 connects the 6 face neighbors, 2 also the 12 edge neighbors
+                         and 3 also the 8 corner neighbors. See ndimage.generate_binary_structure
+    :param slab_layers: The number of z layers labelled at once
+    :param min_voxels: Components with fewer voxels are left out, e.g. to skip noise
+    :return: The components, ordered by label
+    """
+
+    if len(stack.shape) != 3:
+        raise ValueError(f"The stack must be 3D, not {len(stack.shape)}D")
+
+    if connectivity not in (1, 2, 3):
+        raise ValueError(f"connectivity must be 1, 2 or 3, not {connectivity}")
+
+    if slab_layers < 1:
+        raise ValueError("slab_layers must be at least 1")
+
+    structure = ndimage.generate_binary_structure(3, connectivity)
+    depth, height, width = stack.shape
+
+    sets = _UnionFind()
+    # per provisional label, starting at 1
+    counts = [0]
+    seeds = [-1]
+    starts = [None]
+    stops = [None]
+
+    previous_layer = None
+
+    for z_start in range(0, depth, slab_layers):
+        z_stop = min(z_start + slab_layers, depth)
+        slab = np.asarray(stack[z_start:z_stop]) != 0
+
+        slab_labels, slab_count = ndimage.label(slab, structure=structure)
+        del slab
+
+        offset = len(sets.parent) - 1
+        sets.add(slab_count)
+
+        # the first voxel and the number of voxels of each label, in label order
+        flat = slab_labels.ravel()
+        foreground = np.flatnonzero(flat)
+        _, first, label_counts = np.unique(flat[foreground], return_index=True, return_counts=True)
+
+        counts.extend(label_counts.tolist())
+        seeds.extend((foreground[first] + z_start * height * width).tolist())
+
+        for bounding_slice in ndimage.find_objects(slab_labels):
+            starts.append((bounding_slice[0].start + z_start, bounding_slice[1].start, bounding_slice[2].start))
+            stops.append((bounding_slice[0].stop + z_start, bounding_slice[1].stop, bounding_slice[2].stop))
+
+        slab_labels[slab_labels > 0] += offset
+
+        if previous_layer is not None:
+            for previous_label, current_label in _boundary_pairs(previous_layer, slab_labels[0], structure):
+                sets.union(int(previous_label), int(current_label))
+
+        previous_layer = slab_labels[-1].copy()
+        del slab_labels
+
+    # merge the provisional labels of each component. Roots are the first label of their component, so sorting by
+    # root sorts the components by their first voxel
+    merged: dict[int, list] = {}
+
+    for label in range(1, len(sets.parent)):
+        root = sets.find(label)
+
+        if root not in merged:
+            merged[root] = [counts[label], seeds[label], list(starts[label]), list(stops[label])]
+            continue
+
+        component = merged[root]
+        component[0] += counts[label]
+        component[1] = min(component[1], seeds[label])
+        component[2] = [min(a, b) for a, b in zip(component[2], starts[label])]
+        component[3] = [max(a, b) for a, b in zip(component[3], stops[label])]
+
+    components = []
+
+    for root in sorted(merged, key=lambda root: merged[root][1]):
+        voxel_count, seed, start, stop = merged[root]
+
+        if voxel_count < min_voxels:
+            continue
+
+        components.append(Component(
+            len(components) + 1,
+            voxel_count,
+            tuple(int(i) for i in np.unravel_index(seed, stack.shape)),
+            tuple(slice(int(a), int(b)) for a, b in zip(start, stop))
+        ))
+
+    logger.info(f"Found {len(components)} components in {len(sets.parent) - 1} provisional labels")
+
+    return components
+
+
+def extract_component(stack, component: Component, connectivity: int = 3) -> np.ndarray:
+    """
+    Reads the voxels of one component from the stack. Other components can reach into its bounding box, so the box is
+    labelled again and only the part connected to the component's seed is kept.
+
+    :param stack: The stack the component was found in
+    :param component: The component
+    :param connectivity: The connectivity the component was found with
+    :return: The boolean volume of the component's bounding box
+    """
+
+    crop = np.asarray(stack[component.bounding_slice]) != 0
+    crop_labels, _ = ndimage.label(crop, structure=ndimage.generate_binary_structure(3, connectivity))
+
+    seed = tuple(i - s.start for i, s in zip(component.seed, component.bounding_slice))
+
+    return crop_labels == crop_labels[seed]
+
+
+def get_component_areas(
+        stack, scale: data.Scale, connectivity: int = 3, slab_layers: int = 64, min_voxels: int = 1,
+        max_workers: Optional[int] = None, progress_callback: Optional[Callable[[int, Optional[int]], None]] = None,
+        **get_area_kwargs
+) -> list[ComponentResult]:
+    """
+    Finds the surface area of every connected component of a binary stack, e.g. all PSDs of an EM volume segmented
+    at once. The components are found with find_components and their cropped volumes are processed in parallel with a
+    BatchEngine. A component's volume is only read from the stack when a worker is ready for it.
+
+    :param stack: A 3D array where nonzero voxels are foreground. See find_components
+    :param scale: The voxel spacing
+    :param connectivity: Which neighbors are connected. See find_components
+    :param slab_layers: The number of z layers labelled at once
+    :param min_voxels: Components with fewer voxels are left out
+    :param max_workers: The number of worker processes. See batch.BatchEngine
+    :param progress_callback: Called with (completed, total) as components finish. See batch.BatchEngine
+    :param get_area_kwargs: Keyword arguments passed to processing.get_area for every component
+    :return: The area of each component, ordered by label
+    """
+
+    components = find_components(stack, connectivity, slab_layers, min_voxels)
+
+    engine = batch.BatchEngine(max_workers=max_workers, progress_callback=progress_callback, **get_area_kwargs)
+    items = ((extract_component(stack, component, connectivity), scale) for component in components)
+
+    return [
+        ComponentResult(component, result) for component, result in zip(components, engine.map(items))
+    ]
@@ -24,3 +24,82 @@ def format_data(data: np.ndarray, scale: meta.Scale) -> tuple[np.ndarray, np.nda
     translations = min_xyz * scale.xyz()
 
     return data[min_xyz[0]:max_xyz[0] + 1, min_xyz[1]:max_xyz[1] + 1, min_xyz[2]:max_xyz[2] + 1], translations
+
+
+def is_coordinates(data: np.ndarray) -> bool:
+    """
+    :param data: A 3D volume or the coordinates of its foreground voxels
+    :return: Whether data holds coordinates, i.e. is 2D
+    """
+
+    return np.ndim(data) == 2
+
+
+def format_coordinates(
+        coordinates: np.ndarray, scale: meta.Scale
+) -> tuple[np.ndarray, tuple[int, int, int], np.ndarray]:
+    """
+    The same as format_data for the coordinates of the foreground voxels, without building the volume.
+
+    :param coordinates: (N, 3) integer ZYX indices of the foreground voxels, as written by scripts/roi_to_npz.py.
+                        Duplicates are allowed
+    :param scale: The voxel scale
+    :return: (The coordinates in the cropped volume, the shape of the cropped volume, translations applied when
+             cropping)
+    """
+
+    coordinates = np.asarray(coordinates)
+
+    if coordinates.ndim != 2 or coordinates.shape[1] != 3:
+        raise ValueError(f"Coordinates must have shape (N, 3), not {coordinates.shape}")
+
+    if not np.issubdtype(coordinates.dtype, np.integer):
+        raise ValueError(f"Coordinates must be integer voxel indices, not {coordinates.dtype}")
+
+    if len(coordinates) == 0:
+        return coordinates.astype(np.intp), (0, 0, 0), np.array([0, 0, 0])
+
+    min_xyz = np.min(coordinates, axis=0)
+    max_xyz = np.max(coordinates, axis=0)
+
+    translations = min_xyz * scale.xyz()
+
+    return (coordinates - min_xyz).astype(np.intp), tuple(int(size) for size in max_xyz - min_xyz + 1), translations
+
+
+def densify(coordinates: np.ndarray, shape: tuple[int, ...], offset=(0, 0, 0)) -> np.ndarray:
+    """
+    :param coordinates: (N, 3) ZYX indices of the foreground voxels
+    :param shape: The shape of the volume
+    :param offset: The ZYX index of the voxel at coordinate 0 in the volume
+    :return: The 3D boolean volume
+    """
+
+    volume = np.zeros(shape, dtype=bool)
+    volume[tuple((coordinates + np.asarray(offset, dtype=np.intp)).T)] = True
+
+    return volume
+
+
+def downsample_xy(data: np.ndarray, factor: int) -> np.ndarray:
+    """
+    Downsamples a PSD along x and y. Each block of factor x factor voxels of a z layer becomes one voxel, which is
+    foreground if any voxel of the block is, so thin parts of the PSD are not lost.
+
+    :param data: A 3D volume or the (N, 3) integer ZYX indices of its foreground voxels
+    :param factor: The number of voxels along x and y that become one voxel
+    :return: The downsampled volume, or the unique indices of its foreground voxels if data holds indices
+    """
+
+    if factor < 1:
+        raise ValueError(f"factor must be at least 1, not {factor}")
+
+    if is_coordinates(data):
+        return np.unique(np.asarray(data) // np.array([1, factor, factor]), axis=0)
+
+    depth, height, width = data.shape
+
+    padded = np.zeros((depth, -(-height // factor) * factor, -(-width // factor) * factor), dtype=bool)
+    padded[:, :height, :width] = data
+
+    return padded.reshape(depth, padded.shape[1] // factor, factor, padded.shape[2] // factor, factor).any(axis=(2, 4))
@@ -1,34 +1,164 @@
+import os
+from concurrent import futures
+from typing import Callable, Optional
+
 import numpy as np
 from scipy import ndimage
 
+from . import gaussian
 from .data import meta
 
 
-def gen_dist_map(data: np.ndarray, scale: meta.Scale) -> np.ndarray:
-    # add padding around data to prevent edges not counting as 0
-    data = np.pad(data, 1, mode="constant")
+# the number of voxels each thread turns from feature indices into distances at once
+_SLAB_VOXELS = 2 ** 20
 
-    # TODO: instead of a 3D distance map, try using a 2D distance map for each slice
-    #  and then combine them to get a 3D distance map
 
-    dist_map_positives = ndimage.distance_transform_edt(
-        data, sampling=scale.zyx()
-    )
+def _feature_transform(
+        data: np.ndarray, sampling: np.ndarray, allocate: Optional[Callable[[tuple, np.dtype], np.ndarray]] = None
+) -> np.ndarray:
+    """
+    :param data: The 3D boolean data in ZYX order
+    :param sampling: The ZYX voxel spacing
+    :param allocate: Creates the array of the indices from its shape and dtype. If None, a new array is created
+    :return: (3, Z, Y, X) int32 indices of the nearest False voxel of each voxel, as distance_transform_edt finds them
+    """
+
+    if allocate is None:
+        return ndimage.distance_transform_edt(data, sampling=sampling, return_distances=False, return_indices=True)
 
-    dist_map_negatives = ndimage.distance_transform_edt(
-        ~data, sampling=scale.zyx()  # ~data is bitwise NOT, flipping booleans
+    indices = allocate((data.ndim,) + data.shape, np.int32)
+    ndimage.distance_transform_edt(
+        data, sampling=sampling, return_distances=False, return_indices=True, indices=indices
     )
 
-    # remove padding from the distance maps
-    dist_map_positives = dist_map_positives[1:-1, 1:-1, 1:-1]
-    dist_map_negatives = dist_map_negatives[1:-1, 1:-1, 1:-1]
+    return indices
+
+
+def _feature_distances(features: np.ndarray, start: tuple[int, int, int], sampling: np.ndarray) -> np.ndarray:
+    """
+    Finds the distance from each voxel of a block of a feature transform to its feature. Uses the same arithmetic as
+    distance_transform_edt, so the distances are bit-identical.
+
+    :param features: (3, Z, Y, X) block of a feature transform
+    :param start: The ZYX index of the first voxel of the block in the feature transform
+    :param sampling: The ZYX voxel spacing
+    :return: The distances in float64
+    """
+
+    indices = np.indices(features.shape[1:], dtype=features.dtype)
+    for axis in range(3):
+        indices[axis] += start[axis]
+
+    distances = (features - indices).astype(np.float64)
+    for axis in range(3):
+        distances[axis] *= sampling[axis]
+
+    np.multiply(distances, distances, distances)
+
+    return np.sqrt(np.add.reduce(distances, axis=0))
+
+
+def gen_dist_map(
+        data: np.ndarray, scale: meta.Scale, dtype: np.dtype = np.float64, out: Optional[np.ndarray] = None,
+        workers: Optional[int] = None, allocate: Optional[Callable[[tuple, np.dtype], np.ndarray]] = None
+) -> np.ndarray:
+    """
+    Creates the signed distance map of the data: the distance from each voxel of the data to the nearest background
+    voxel, and minus the distance from each background voxel to the nearest voxel of the data. Voxels outside the grid
+    count as background.
+
+    The inside feature transform only runs on the bounding box of the data, and the outside one on the data itself.
+    Both run at the same time, and the distances are filled in slabs of z layers by a pool of threads. The result is
+    bit-identical to subtracting the distance transforms of the padded data and its inverse.
+
+    :param data: The 3D boolean data in ZYX order
+    :param scale: The voxel spacing
+    :param dtype: The dtype of the distance map. The distances are found in float64 and rounded as they are written
+    :param out: The array to write the distance map into. Must have the shape of data and dtype. If None, a new array
+                is created
+    :param workers: The number of threads. If None, the number of CPUs is used
+    :param allocate: Creates the arrays of the feature transforms, which take 12 bytes per voxel, from their shape and
+                     dtype, e.g. ScratchSpace.empty to memory-map them. If None, they are created in memory
+    :return: The distance map. Background voxels are -inf if there is no data at all
+    """
+
+    dtype = np.dtype(dtype)
+    workers = workers if workers is not None else (os.cpu_count() or 1)
+
+    if workers < 1:
+        raise ValueError("workers must be at least 1")
+
+    if out is None:
+        out = np.empty(data.shape, dtype=dtype)
+    elif out.shape != data.shape or out.dtype != dtype:
+        raise ValueError(f"out must have shape {data.shape} and dtype {dtype}")
+
+    objects = ndimage.find_objects(data.view(np.uint8))
+    if not objects:
+        out[...] = -np.inf
+        return out
+
+    sampling = scale.zyx()
+
+    # every voxel of the data is in its bounding box, and the bounding box expanded by one voxel is background on all
+    # sides (padding adds the background outside the grid), so the nearest background voxel is always inside it
+    box = tuple(slice(max(s.start - 1, 0), min(s.stop + 1, n)) for s, n in zip(objects[0], data.shape))
+    box_start = tuple(s.start for s in box)
+    box_data = np.pad(data[box], 1, mode="constant")
 
-    return dist_map_positives - dist_map_negatives
+    with futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        inside_future = executor.submit(_feature_transform, box_data, sampling, allocate)
+        outside_features = _feature_transform(~data, sampling, allocate)  # ~data is bitwise NOT, flipping booleans
+        inside_features = inside_future.result()
 
+        def fill(z_start: int, z_stop: int) -> None:
+            # background voxels are 0 in the inside distance map and data voxels are 0 in the outside one, so the
+            # signed distance is either the inside distance or minus the outside distance
+            signed = _feature_distances(outside_features[:, z_start:z_stop], (z_start, 0, 0), sampling)
+            np.negative(signed, out=signed)
+
+            box_z_start = max(z_start, box[0].start)
+            box_z_stop = min(z_stop, box[0].stop)
+
+            if box_z_start < box_z_stop:
+                # indices of the padded bounding box
+                padded_z = slice(box_z_start - box_start[0] + 1, box_z_stop - box_start[0] + 1)
+                padded_y = slice(1, box[1].stop - box_start[1] + 1)
+                padded_x = slice(1, box[2].stop - box_start[2] + 1)
+
+                inside = _feature_distances(
+                    inside_features[:, padded_z, padded_y, padded_x], (padded_z.start, 1, 1), sampling
+                )
+
+                region = (slice(box_z_start - z_start, box_z_stop - z_start), box[1], box[2])
+                signed[region] = np.where(data[box_z_start:box_z_stop, box[1], box[2]], inside, signed[region])
+
+            np.copyto(out[z_start:z_stop], signed, casting="same_kind")
+
+        layers = max(_SLAB_VOXELS // (data.shape[1] * data.shape[2]), 1)
+        slabs = [
+            executor.submit(fill, z_start, min(z_start + layers, data.shape[0]))
+            for z_start in range(0, data.shape[0], layers)
+        ]
+
+        for slab in slabs:
+            slab.result()
+
+    return out
+
+
+def gen_sigmas(c_s: float, max_distance: float, scale: meta.Scale) -> tuple[float, float, float]:
+    """
+    Gets the standard deviations of the Gaussian blur along each axis.
+
+    :param c_s: The constant for the sigma formula
+    :param max_distance: The largest value of the distance map
+    :param scale: The voxel spacing
+    :return: The ZYX standard deviations in voxels
+    """
 
-def blur(dist_map: np.ndarray, c_s: float, scale: meta.Scale) -> np.ndarray:
     # Sigma formula from paper
-    sigma = c_s * np.max(dist_map.flatten())
+    sigma = c_s * max_distance
 
     # if there's any weird problems, try changing the sigma ratio to scale_z / scale_xy or change sigma to
     # sigma_xy, sigma_xy, sigma_z
@@ -37,5 +167,46 @@ def blur(dist_map: np.ndarray, c_s: float, scale: meta.Scale) -> np.ndarray:
     sigma_xy = sigma * (scale.xy / scale.xy)
     sigma_z = sigma * (scale.xy / scale.z)
 
-    # Apply anisotropic Gaussian blur
-    return ndimage.gaussian_filter(dist_map, sigma=(sigma_z, sigma_xy, sigma_xy), mode="nearest")
+    return sigma_z, sigma_xy, sigma_xy
+
+
+def blur(
+        dist_map: np.ndarray, c_s: float, scale: meta.Scale, max_distance: Optional[float] = None,
+        method: str = "direct", workers: Optional[int] = None, out: Optional[np.ndarray] = None,
+        chunk_layers: Optional[int] = None
+) -> np.ndarray:
+    """
+    Blurs the distance map with the Gaussian from the paper.
+
+    :param dist_map: The distance map
+    :param c_s: The constant for the sigma formula
+    :param scale: The voxel spacing
+    :param max_distance: The largest value of the whole distance map. If None, the largest value of dist_map is used.
+                         Needed when dist_map is only a block of the distance map
+    :param method: The blur method, see gaussian.gaussian_blur. "direct" is the exact truncated Gaussian
+    :param workers: The number of threads. If None, the number of CPUs is used
+    :param out: The array to write the blurred distance map into, e.g. a memory-mapped one. Must have the shape and
+                dtype of dist_map. Requires chunk_layers
+    :param chunk_layers: If not None, the distance map is blurred in chunks of this many z layers, see
+                         gaussian.gaussian_blur_chunked
+    :return: The blurred distance map, with the same dtype as dist_map
+    """
+
+    if max_distance is None:
+        max_distance = np.max(dist_map)
+
+    sigmas = gen_sigmas(c_s, max_distance, scale)
+
+    if chunk_layers is not None:
+        if out is None:
+            out = np.empty(dist_map.shape, dtype=dist_map.dtype)
+        elif out.dtype != dist_map.dtype:
+            raise ValueError(f"out must have dtype {dist_map.dtype}")
+
+        return gaussian.gaussian_blur_chunked(dist_map, sigmas, out, chunk_layers, method, workers)
+
+    if out is not None:
+        raise ValueError("out requires chunk_layers")
+
+    # Apply anisotropic Gaussian blur. The output keeps the dtype of the distance map
+    return gaussian.gaussian_blur(dist_map, sigmas, method, workers)
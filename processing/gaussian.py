@@ -0,0 +1,222 @@
+import contextlib
+import math
+import os
+from concurrent import futures
+from typing import Callable, Optional
+
+import numpy as np
+from scipy import ndimage
+
+from . import scratch
+
+
+METHODS = ("auto", "direct", "box")
+
+# gaussian_filter's default kernel radius, in standard deviations
+TRUNCATE = 4.0
+
+# the number of box filters the box method stacks for each axis. Their sum approximates a Gaussian
+BOX_PASSES = 4
+
+# the auto method uses box filters along axes with at least this sigma in voxels. Below it, the truncated kernel of
+# gaussian_filter is shorter than the running sums of the box filters, so it is as fast and exact
+BOX_MIN_SIGMA = 8.0
+
+
+def box_sizes(sigma: float, passes: int = BOX_PASSES) -> list[int]:
+    """
+    Finds the widths of box filters whose cascade has a variance close to sigma², using two odd widths that differ by
+    2 as described by Kovesi, "Fast Almost-Gaussian Filtering" (2010).
+
+    :param sigma: The standard deviation in voxels
+    :param passes: The number of box filters
+    :return: The odd width of each box filter
+    """
+
+    ideal = math.sqrt(12 * sigma ** 2 / passes + 1)
+
+    lower = int(math.floor(ideal))
+    if lower % 2 == 0:
+        lower -= 1
+    lower = max(lower, 1)
+
+    # the number of passes that use the lower width so the variances add up to sigma²
+    lower_passes = round((12 * sigma ** 2 - passes * lower ** 2 - 4 * passes * lower - 3 * passes) / (-4 * lower - 4))
+    lower_passes = min(max(lower_passes, 0), passes)
+
+    return [lower] * lower_passes + [lower + 2] * (passes - lower_passes)
+
+
+def select_method(sigma: float, method: str) -> str:
+    """
+    :param sigma: The standard deviation in voxels along an axis
+    :param method: "auto", "direct" or "box"
+    :return: The method used along the axis, "direct" or "box"
+    """
+
+    if method not in METHODS:
+        raise ValueError(f"method must be one of {', '.join(METHODS)}")
+
+    if method == "auto":
+        return "box" if sigma >= BOX_MIN_SIGMA else "direct"
+
+    return method
+
+
+def kernel_radius(sigma: float, method: str) -> int:
+    """
+    :param sigma: The standard deviation in voxels along an axis
+    :param method: "auto", "direct" or "box"
+    :return: The number of voxels on each side of a voxel that its blurred value depends on
+    """
+
+    if sigma <= 1e-15:
+        return 0
+
+    if select_method(sigma, method) == "box":
+        return sum(size // 2 for size in box_sizes(sigma))
+
+    return int(TRUNCATE * sigma + 0.5)
+
+
+def _filter_axis(volume: np.ndarray, output: np.ndarray, sigma: float, axis: int, method: str) -> None:
+    """
+    Blurs volume along one axis into output. volume and output may be the same array.
+    """
+
+    if method == "direct":
+        ndimage.gaussian_filter1d(volume, sigma, axis=axis, output=output, mode="nearest", truncate=TRUNCATE)
+        return
+
+    # gaussian_filter extends the input with its edge values. Each box filter would extend its own output instead, so
+    # the input is extended once by the radius of the whole cascade
+    sizes = box_sizes(sigma)
+    radius = sum(size // 2 for size in sizes)
+    padding = [(0, 0)] * volume.ndim
+    padding[axis] = (radius, radius)
+    padded = np.pad(volume, padding, mode="edge").astype(output.dtype, copy=False)
+
+    for size in sizes:
+        ndimage.uniform_filter1d(padded, size, axis=axis, output=padded, mode="nearest")
+
+    crop = [slice(None)] * volume.ndim
+    crop[axis] = slice(radius, radius + volume.shape[axis])
+    output[...] = padded[tuple(crop)]
+
+
+def _run_chunked(
+        function: Callable[[tuple[slice, ...]], None], shape: tuple[int, ...], axis: int,
+        executor: Optional[futures.Executor], chunks: int
+) -> None:
+    """
+    Calls a function on chunks of a volume split along an axis the function doesn't filter along.
+
+    :param function: The function taking the slices of a chunk
+    :param shape: The shape of the volume
+    :param axis: The axis being filtered
+    :param executor: The executor to run the chunks on. If None, the whole volume is one chunk
+    :param chunks: The number of chunks
+    """
+
+    split_axis = 1 if axis == 0 else 0
+
+    if executor is None or shape[split_axis] < 2:
+        function(tuple(slice(None) for _ in shape))
+        return
+
+    bounds = np.linspace(0, shape[split_axis], min(chunks, shape[split_axis]) + 1).astype(int)
+    pending = []
+
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        chunk = [slice(None)] * len(shape)
+        chunk[split_axis] = slice(int(start), int(stop))
+        pending.append(executor.submit(function, tuple(chunk)))
+
+    for chunk_future in pending:
+        chunk_future.result()
+
+
+def gaussian_blur(
+        volume: np.ndarray, sigmas: tuple[float, ...], method: str = "auto", workers: Optional[int] = None
+) -> np.ndarray:
+    """
+    Blurs a volume with an anisotropic Gaussian, extending the edges with their nearest values.
+
+    The "direct" method gives the same result as ndimage.gaussian_filter, and its cost grows with sigma. The "box"
+    method stacks box filters made of running sums, so its cost doesn't depend on sigma, but it only approximates the
+    Gaussian. See test/blur_accuracy.py. The "auto" method picks one of them for each axis by its sigma.
+
+    Each axis is filtered in chunks split along another axis, so the lines of a chunk are independent of the other
+    chunks and the chunks run on a pool of threads.
+
+    :param volume: The volume to blur
+    :param sigmas: The standard deviation in voxels along each axis
+    :param method: "auto", "direct" or "box"
+    :param workers: The number of threads. If None, the number of CPUs is used
+    :return: The blurred volume, with the same dtype as volume
+    """
+
+    if len(sigmas) != volume.ndim:
+        raise ValueError("There must be one sigma for each axis")
+
+    workers = workers if workers is not None else (os.cpu_count() or 1)
+
+    if workers < 1:
+        raise ValueError("workers must be at least 1")
+
+    output = np.empty(volume.shape, dtype=volume.dtype)
+    source = volume
+
+    with futures.ThreadPoolExecutor(max_workers=workers) if workers > 1 else contextlib.nullcontext() as executor:
+        for axis, sigma in enumerate(sigmas):
+            # like gaussian_filter, skip axes that aren't blurred
+            if sigma <= 1e-15:
+                continue
+
+            axis_method = select_method(sigma, method)
+
+            def filter_chunk(chunk: tuple[slice, ...]) -> None:
+                _filter_axis(source[chunk], output[chunk], sigma, axis, axis_method)
+
+            _run_chunked(filter_chunk, volume.shape, axis, executor, workers)
+
+            # the first axis reads the input, the others are filtered in place
+            source = output
+
+    if source is volume:
+        output[...] = volume
+
+    return output
+
+
+def gaussian_blur_chunked(
+        volume: np.ndarray, sigmas: tuple[float, ...], out: np.ndarray, chunk_layers: int, method: str = "auto",
+        workers: Optional[int] = None
+) -> np.ndarray:
+    """
+    Blurs a volume like gaussian_blur, one chunk of z layers at a time. Each chunk is read with a halo of as many layers
+    as the kernel's radius along z, so the result is the same as gaussian_blur's while only one chunk and its halo are
+    in memory. Box filters along z start their running sums at the halo instead of the edge of the volume, so they
+    differ by rounding. Used when volume and out are memory-mapped.
+
+    :param volume: The volume to blur
+    :param sigmas: The standard deviation in voxels along each axis
+    :param out: The array to write the blurred volume into. Must have the shape of volume
+    :param chunk_layers: The number of z layers blurred at once
+    :param method: "auto", "direct" or "box"
+    :param workers: The number of threads. If None, the number of CPUs is used
+    :return: out
+    """
+
+    if out.shape != volume.shape:
+        raise ValueError(f"out must have shape {volume.shape}")
+
+    if len(sigmas) != volume.ndim:
+        raise ValueError("There must be one sigma for each axis")
+
+    halo = kernel_radius(sigmas[0], method)
+
+    for chunk, read, core in scratch.z_chunks(volume.shape[0], chunk_layers, halo):
+        out[chunk] = gaussian_blur(np.asarray(volume[read]), sigmas, method, workers)[core]
+
+    return out
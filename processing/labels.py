@@ -0,0 +1,56 @@
+from typing import Iterator, Optional
+
+import numpy as np
+from scipy import ndimage
+
+from . import data
+
+
+def iter_labels(
+        label_data: np.ndarray, scale: data.Scale, label_count: Optional[int] = None
+) -> Iterator[tuple[int, np.ndarray, np.ndarray]]:
+    """
+    Splits a label volume into one cropped boolean volume per label. The bounding slices of every label are found in a
+    single pass over the volume, and each cropped volume is only created when it is requested.
+
+    :param label_data: A 3D integer array where each voxel holds its label. 0 is the background
+    :param scale: The voxel spacing
+    :param label_count: The number of labels. Labels are numbered 1 to label_count. If None, the largest label in
+                        label_data is used
+    :return: An iterator of (label, cropped boolean volume, translations). The translations are the same as the ones
+             returned by pancake_worker.get_cropped_roi_arr, translating the vertices back to the original in world
+             space. A label with no voxels yields an empty volume.
+    """
+
+    bounding_slices = ndimage.find_objects(label_data, max_label=label_count if label_count is not None else 0)
+
+    if label_count is not None:
+        # find_objects returns fewer slices if the highest labels are not present in the volume
+        bounding_slices += [None] * (label_count - len(bounding_slices))
+
+    for label, bounding_slice in enumerate(bounding_slices, start=1):
+        if bounding_slice is None:
+            yield label, np.zeros((1, 1, 1), dtype=bool), np.array([0, 0, 0], dtype=np.float64)
+            continue
+
+        min_indices = np.array([s.start for s in bounding_slice[::-1]])  # zyx -> xyz
+
+        yield label, label_data[bounding_slice] == label, -1 * min_indices * scale.xyz()
+
+
+def iter_multi_roi_labels(multi_roi, scale: data.Scale) -> Iterator[tuple[int, np.ndarray, np.ndarray]]:
+    """
+    Splits a Dragonfly MultiROI into one cropped boolean volume per label. The label volume is only read from the
+    MultiROI once.
+
+    Only getAsNDArray() and getLabelCount() are called on the MultiROI, so any object providing these methods can be
+    used in place of an ORS MultiROI.
+
+    :param multi_roi: The MultiROI to split
+    :param scale: The voxel spacing
+    :return: An iterator of (label, cropped boolean volume, translations). See iter_labels.
+    """
+
+    label_data = np.asarray(multi_roi.getAsNDArray())
+
+    return iter_labels(label_data, scale, multi_roi.getLabelCount())
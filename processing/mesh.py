@@ -1,36 +1,136 @@
-import itertools
-from typing import Optional
+import math
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Optional, Sequence, Union
 
 from . import bounding_box
 from . import data
+from .roots import find_roots, RootStats
+from .sampling import GridSampler, grid_step
 
-import open3d as o3d
 import numpy as np
+from scipy import ndimage
+
+if TYPE_CHECKING:
+    import open3d as o3d
+
+
+@dataclass(frozen=True)
+class RefinementStats:
+    """
+    Statistics about a mesh built by Mesh.adaptive
+    :param spacings: The vertex spacing of each level, from the coarsest to the finest
+    :param areas: The area of each level after clipping
+    :param bent_vertices: The number of vertices that were bent, over all levels
+    :param interpolated_vertices: The number of vertices whose heights were interpolated from the previous level instead
+                                  of being bent, over all levels
+    :param converged: Whether area_error met the tolerance. If not, the mesh was refined down to the finest spacing
+                      without meeting it, so it took longer to build than a mesh with a fixed spacing
+    """
+
+    spacings: tuple[float, ...]
+    areas: tuple[float, ...]
+    bent_vertices: int
+    interpolated_vertices: int
+    converged: bool
+
+    @property
+    def area_error(self) -> float:
+        """
+        :return: The estimated discretisation error of the area of the last level. See extrapolated_error
+        """
+
+        return extrapolated_error(self.areas)
+
+
+def extrapolated_error(areas: Sequence[float]) -> float:
+    """
+    Estimates the discretisation error of the last of a sequence of areas found with halving spacings using Richardson
+    extrapolation. The error of the area with spacing h is about |A_h - A_2h| / (2 ** p - 1), where p is the order of
+    convergence observed over the last three areas. p is 1 with only two areas or when the changes do not shrink, which
+    is the order of the clipped edge of the surface moving by up to a spacing, and at most 2, the order of the
+    piecewise linear surface, so an area that happens to change very little doesn't give a tiny estimate.
+
+    :param areas: The areas, from the coarsest spacing to the finest. At least two
+    :return: The estimated absolute error of the last area
+    """
+
+    last_change = abs(areas[-1] - areas[-2])
+    order = 1.0
+
+    if len(areas) > 2 and 0 < last_change < abs(areas[-2] - areas[-3]):
+        order = min(math.log2(abs(areas[-2] - areas[-3]) / last_change), 2.0)
 
-from scipy import interpolate
+    return last_change / (2 ** order - 1)
 
 
 class Mesh:
-    MAX_PREV_VERTICES = 10
+    """
+    The PSD surface, stored as a heightfield. The vertices lie on a regular 2D grid across the OBB's mid-plane and are
+    displaced along the OBB normal. A validity mask marks the vertices that are part of the surface.
+    """
+
+    # the number of z layers of the data projected at once by cull
+    _CULL_LAYERS = 16
+
+    # the least number of cells across the shorter side of the coarsest level of Mesh.adaptive
+    _COARSE_CELLS = 16
+
+    def __init__(
+            self, obb: bounding_box.Obb, geom_center: np.ndarray, scale: data.Scale, spacing: Optional[float] = None
+    ):
+        """
+        :param obb: The OBB of the PSD
+        :param geom_center: The geometric center of the PSD, which the mid-plane goes through
+        :param scale: The voxel spacing
+        :param spacing: The distance between neighboring vertices along the grid axes. If None, the smallest voxel side
+                        length. Bending costs grow with the number of vertices, so with the inverse square of the
+                        spacing
+        """
+
+        if spacing is None:
+            spacing = min(scale.xy, scale.z)
+        elif spacing <= 0:
+            raise ValueError(f"spacing must be positive, not {spacing}")
 
-    def __init__(self, obb: bounding_box.Obb, geom_center: np.ndarray, scale: data.Scale):
         self.bounding_box = obb
-        self.mesh, self.min_extent_idx_rotated = self._gen(obb, geom_center, scale)
-        self.prev_vertices = []
+        self.normal = obb.get_normal()
+
+        # base_vertices: (rows, columns, 3) vertex positions on the mid-plane
+        # valid: (rows, columns) mask of the vertices that are part of the surface
+        # heights: (rows, columns) displacement of each vertex along the normal
+        self.base_vertices, self.valid, self.min_extent_idx_rotated = self._gen(obb, geom_center, spacing)
+        self.spacing = spacing  # the distance between neighboring vertices along the grid axes
+        self.heights = np.zeros(self.valid.shape)
+        self.bend_stats: Optional[RootStats] = None
+        self.refinement_stats: Optional[RefinementStats] = None
+
+    def copy(self) -> "Mesh":
+        """
+        Copies the mesh. The copy shares the bounding box and base vertices, which are never modified, but has its own
+        heights and validity mask, so it can be bent and clipped independently.
+
+        :return: The copy
+        """
+
+        copied = object.__new__(Mesh)
+        copied.__dict__.update(self.__dict__)
+        copied.heights = self.heights.copy()
+        copied.valid = self.valid.copy()
+
+        return copied
 
     @staticmethod
-    def _gen(obb: bounding_box.Obb, geom_center: np.ndarray, scale: data.Scale):
-        # Generate the quads for the mesh based off the smallest voxel size
-        scale = data.Scale(min(scale.xy, scale.z), min(scale.xy, scale.z))
+    def _gen(obb: bounding_box.Obb, geom_center: np.ndarray, spacing: float):
+        # Generate the quads for the mesh based off the vertex spacing
+        scale = data.Scale(spacing, spacing)
 
         # get some preliminary data
         rotation_matrix = obb.rotation.as_matrix()
-        center = obb.o3d_obb.center
+        center = obb.center
         vertices = obb.vertices
 
         # rotate mesh vertices to be aligned with the axes
-        vertices -= center
-        vertices = obb.vertices @ rotation_matrix
+        vertices = (vertices - center) @ rotation_matrix
         vertices += center
 
         # rotate geom center to be aligned with the axes
@@ -44,11 +144,11 @@ class Mesh:
 
         # starting_vertex = min_vertex but the shortest extent axis is set to the value of the geom center at that axis
         starting_vertex = min_vertex
-        min_extent_index = np.argmin(obb.o3d_obb.extent)
+        min_extent_index = np.argmin(obb.extent)
         starting_vertex[min_extent_index] = geom_center_rotated[min_extent_index]
 
         # opposite_vertex = starting_vertex + extent of all but the shortest axis
-        opposite_extent = np.copy(obb.o3d_obb.extent)
+        opposite_extent = np.copy(obb.extent)
         opposite_extent[min_extent_index] = 0
         opposite_vertex = starting_vertex + opposite_extent
 
@@ -82,168 +182,491 @@ class Mesh:
         min_extent_index_rotated = np.argmin(extent_rotated)
 
         # -- Create the vertices --
-        # go from min_x to max_x, min_y to max_y, min_z to max_z
-        x_range = np.arange(np.min(plane_vertices[:, 0]), np.max(plane_vertices[:, 0]) + scale.xy, scale.xy)
-        y_range = np.arange(np.min(plane_vertices[:, 1]), np.max(plane_vertices[:, 1]) + scale.xy, scale.xy)
-        z_range = np.arange(np.min(plane_vertices[:, 2]), np.max(plane_vertices[:, 2]) + scale.z, scale.z)
-
-        x_range = x_range if min_extent_index_rotated != 0 else np.array([0])
-        y_range = y_range if min_extent_index_rotated != 1 else np.array([0])
-        z_range = z_range if min_extent_index_rotated != 2 else np.array([0])
-
-        # Create the [[x, y, z], ...] array
-        x, y, z = np.meshgrid(x_range, y_range, z_range, indexing="ij")
-        vertices = np.stack((x, y, z), axis=-1).reshape(-1, 3)
-
-        # -- Create mesh edges --
-        # loop over the two axes that are variable
-        loop_and_loop_next = [
-            x_range.shape[0],
-            y_range.shape[0],
-            z_range.shape[0]
+        # go from min to max along the two axes that vary across the heightfield
+        grid_axes = tuple(axis for axis in range(3) if axis != min_extent_index_rotated)
+        steps = scale.xyz()
+        axis_ranges = [
+            np.arange(np.min(plane_vertices[:, axis]), np.max(plane_vertices[:, axis]) + steps[axis], steps[axis])
+            for axis in grid_axes
         ]
 
-        loop_and_loop_next.pop(min_extent_index_rotated)
-        loop, loop_next = loop_and_loop_next
-
-        indices = []
-        for i, j in itertools.product(range(loop - 1), range(loop_next - 1)):
-            indices.extend((
-                [
-                    i * loop_next + j,
-                    i * loop_next + j + 1,
-                    (i + 1) * loop_next + j,
-                ],
-                [
-                    i * loop_next + j + 1,
-                    (i + 1) * loop_next + j + 1,
-                    (i + 1) * loop_next + j,
-                ],
-            ))
-        
-        # -- Create the mesh --
-        mesh = o3d.geometry.TriangleMesh()
-        mesh.vertices = o3d.utility.Vector3dVector(vertices)
-        mesh.triangles = o3d.utility.Vector3iVector(indices)
+        grid_a, grid_b = np.meshgrid(*axis_ranges, indexing="ij")
+        base_vertices = np.zeros((*grid_a.shape, 3))
+        base_vertices[..., grid_axes[0]] = grid_a
+        base_vertices[..., grid_axes[1]] = grid_b
 
-        # -- Linear Interpolation --
-        plane_points = np.delete(plane_vertices, min_extent_index_rotated, axis=1)
+        # -- Evaluate the plane --
+        # the plane through the four plane vertices, as the min extent axis as a function of the other two axes
+        plane_points = plane_vertices[:, grid_axes]
         plane_values = plane_vertices[:, min_extent_index_rotated]
 
-        interp = interpolate.LinearNDInterpolator(plane_points, plane_values)
+        coefficients, *_ = np.linalg.lstsq(
+            np.column_stack((plane_points, np.ones(len(plane_points)))), plane_values, rcond=None
+        )
+        base_vertices[..., min_extent_index_rotated] = (
+            coefficients[0] * grid_a + coefficients[1] * grid_b + coefficients[2]
+        )
 
-        interp_values = interp(np.delete(vertices, min_extent_index_rotated, axis=1))
-        vertices[:, min_extent_index_rotated] = interp_values
-        mesh.vertices = o3d.utility.Vector3dVector(vertices)
+        # -- Only keep the vertices inside the plane's rectangle --
+        valid = Mesh._inside_convex_polygon(np.stack((grid_a, grid_b), axis=-1), plane_points)
+
+        return base_vertices, valid, min_extent_index_rotated
+
+    @staticmethod
+    def _inside_convex_polygon(points: np.ndarray, polygon_points: np.ndarray) -> np.ndarray:
+        """
+        Finds which points are inside (or on the border of) the convex hull of a few polygon points.
+
+        :param points: (..., 2) points to test
+        :param polygon_points: (N, 2) points whose convex hull is the polygon
+        :return: (...) boolean array, True if the point is inside the polygon
+        """
 
-        # -- Remove any vertices which has nan values at the min_extent_index_rotated index --
-        remove_vertex_indices = np.isnan(vertices[:, min_extent_index_rotated]).nonzero()[0]
-        mesh.remove_vertices_by_index(remove_vertex_indices)
+        # order the polygon points counter-clockwise around their centroid
+        centroid = np.mean(polygon_points, axis=0)
+        angles = np.arctan2(polygon_points[:, 1] - centroid[1], polygon_points[:, 0] - centroid[0])
+        polygon_points = polygon_points[np.argsort(angles)]
 
-        return mesh, min_extent_index_rotated
+        # small tolerance so points on the border are kept despite rounding errors
+        tolerance = 1e-9 * max(np.ptp(polygon_points, axis=0).max(), 1)
 
-    def clip_vertices(self, dist_map: np.ndarray, scale: data.Scale, dist_threshold: Optional[float] = None) -> None:
+        inside = np.ones(points.shape[:-1], dtype=bool)
+        for start, end in zip(polygon_points, np.roll(polygon_points, -1, axis=0)):
+            edge = end - start
+            edge_length = np.linalg.norm(edge)
+
+            if edge_length == 0:
+                continue
+
+            # signed distance from the edge, positive on the inside of a counter-clockwise polygon
+            cross = edge[0] * (points[..., 1] - start[1]) - edge[1] * (points[..., 0] - start[0])
+            inside &= cross / edge_length >= -tolerance
+
+        return inside
+
+    def vertices(self) -> np.ndarray:
+        """
+        :return: The (rows, columns, 3) positions of every vertex in the heightfield, including invalid ones
+        """
+
+        return self.base_vertices + self.heights[..., np.newaxis] * self.normal
+
+    def vertices_and_triangles(self) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Converts the valid part of the heightfield to an indexed triangle mesh. Each grid cell is split into two
+        triangles, and triangles with an invalid vertex are dropped.
+
+        :return: ((N, 3) vertex array, (M, 3) triangle index array)
+        """
+
+        rows, columns = self.valid.shape
+
+        # the index of each valid vertex in the output vertex array
+        vertex_indices = np.full(self.valid.shape, -1, dtype=np.int64)
+        vertex_indices[self.valid] = np.arange(np.count_nonzero(self.valid))
+
+        top_left = vertex_indices[:-1, :-1]
+        top_right = vertex_indices[:-1, 1:]
+        bottom_left = vertex_indices[1:, :-1]
+        bottom_right = vertex_indices[1:, 1:]
+
+        # interleave the two triangles of each cell
+        triangles = np.stack((
+            np.stack((top_left, top_right, bottom_left), axis=-1),
+            np.stack((top_right, bottom_right, bottom_left), axis=-1)
+        ), axis=2).reshape(-1, 3)
+
+        triangles = triangles[np.all(triangles >= 0, axis=1)]
+
+        return self.vertices()[self.valid], triangles
+
+    def to_o3d(self) -> "o3d.geometry.TriangleMesh":
+        """
+        Converts the heightfield to an Open3D triangle mesh. Only used to export or visualize the mesh.
+
+        :return: The Open3D triangle mesh
+        """
+
+        import open3d as o3d
+
+        vertices, triangles = self.vertices_and_triangles()
+
+        mesh = o3d.geometry.TriangleMesh()
+        mesh.vertices = o3d.utility.Vector3dVector(vertices)
+        mesh.triangles = o3d.utility.Vector3iVector(triangles)
+
+        return mesh
+
+    def clip_vertices(
+            self, dist_map: Union[np.ndarray, GridSampler], scale: data.Scale, dist_threshold: Optional[float] = None
+    ) -> None:
         """
         Clips all vertices that are outside the boolean data by a certain distance threshold.
 
-        :param dist_map: The distance map to clip the vertices by. Note that this should be the not-projected dist map.
+        :param dist_map: The distance map to clip the vertices by, or a GridSampler of it. Note that this should be the
+                         not-projected dist map.
         :param scale: The voxel spacing
         :param dist_threshold: The distance threshold to clip each vertex in the final step. If None, the threshold is
                                  equal to max(scale.xy, scale.z) / 2
         :return: None
         """
 
-        dist_map_rgi = self._get_rgi(dist_map, scale)
-        vertices = np.asarray(self.mesh.vertices)
+        dist_map_sampler = self._get_sampler(dist_map, scale)
+        vertices = self.vertices()[self.valid]
 
         # Find the distances of each vertex
-        distances = dist_map_rgi(vertices[:, ::-1])  # Reverse the order for z, y, x indexing
+        distances = dist_map_sampler(vertices[:, ::-1])  # Reverse the order for z, y, x indexing
 
         if dist_threshold is None:
             dist_threshold = max(scale.xy, scale.z) / 2
 
         # less than negative distance threshold since outside values are negative in the dist map
-        indices_to_remove = np.where(distances < -dist_threshold)[0]
+        valid_indices = np.nonzero(self.valid)
+        to_remove = distances < -dist_threshold
+
+        self.valid[valid_indices[0][to_remove], valid_indices[1][to_remove]] = False
+
+    def cull(self, bool_data: np.ndarray, scale: data.Scale, dist_threshold: Optional[float] = None) -> None:
+        """
+        Removes the vertices that clip_vertices would remove at any height bend could give them, so bend skips them.
+        Only removes vertices that are certain to be clipped, so the final area is the same.
 
-        self.mesh.remove_vertices_by_index(indices_to_remove)
+        A vertex is kept by clip_vertices if the distance map sampled at the vertex is at least -dist_threshold. The
+        sample is a weighted average of the 8 corners of its grid cell, so one of the corners is within dist_threshold
+        of a voxel of the PSD. The vertex moves along the normal, so projected along the normal onto the mesh plane it
+        is within dist_threshold and the projected size of a cell of the projection of that voxel. The voxels of the PSD are
+        projected onto the grid of the heightfield and the vertices further than that from every projected voxel are
+        removed. Vertices that could be moved outside the distance map's grid are kept since they are never clipped.
+
+        :param bool_data: The boolean data the distance map was created from
+        :param scale: The voxel spacing
+        :param dist_threshold: The distance threshold clip_vertices will be called with. If None, the threshold is
+                               equal to max(scale.xy, scale.z) / 2
+        """
+
+        if dist_threshold is None:
+            dist_threshold = max(scale.xy, scale.z) / 2
+
+        shape = np.array(bool_data.shape)
+        step = grid_step(shape, scale)
+        spans = shape > 1
+
+        # the samples of the distance map are further apart than the voxel spacing its distances are measured with
+        stretch = np.max(np.where(spans, step / scale.zyx(), 1))
+
+        # the longest projection of the vector from a point to a corner of its cell onto the mesh plane
+        cell = np.where(spans, step, 0)[::-1] * np.array([[x, y, z] for z in (-1, 1) for y in (-1, 1) for x in (-1, 1)])
+        cell_reach = np.max(np.linalg.norm(cell - np.outer(cell @ self.normal, self.normal), axis=1))
+
+        reach = dist_threshold * stretch + cell_reach
+
+        rows, columns = self.valid.shape
+        grid_axes = [axis for axis in range(3) if axis != self.min_extent_idx_rotated]
+        plane_origin = self.base_vertices[0, 0]
+
+        # rasterize the projected voxels onto the heightfield grid, extended so voxels projecting outside the mesh
+        # but within reach of it are kept
+        margin = math.ceil(reach / self.spacing) + 1
+        footprint = np.zeros((rows + 2 * margin, columns + 2 * margin), dtype=bool)
+
+        for z_start in range(0, bool_data.shape[0], self._CULL_LAYERS):
+            z, y, x = np.nonzero(bool_data[z_start:z_start + self._CULL_LAYERS])
+
+            # positions on the grid of GridSampler
+            points = np.column_stack((x * step[2], y * step[1], (z + z_start) * step[0])) - scale.xyz() / 2
+            points -= ((points - plane_origin) @ self.normal)[:, np.newaxis] * self.normal
+
+            indices = np.rint((points[:, grid_axes] - plane_origin[grid_axes]) / self.spacing).astype(np.intp)
+            indices += margin
+            inside = np.all((indices >= 0) & (indices < footprint.shape), axis=1)
+            footprint[indices[inside, 0], indices[inside, 1]] = True
+
+        if np.any(footprint):
+            # rounding to the nearest grid point moves a projected voxel by up to half a grid diagonal
+            distances = ndimage.distance_transform_edt(~footprint, sampling=self.spacing)[
+                margin:margin + rows, margin:margin + columns
+            ]
+            reachable = distances <= reach + self.spacing * math.sqrt(2) / 2
+        else:
+            reachable = np.zeros(self.valid.shape, dtype=bool)
+
+        # the furthest bend can move each vertex along the normal is the OBB, so the ray through the OBB tells whether
+        # the vertex could be sampled outside the grid
+        vertices = self.vertices()[self.valid]
+        hit_distances = self.bounding_box.ray_hit_distances(vertices, self.normal)
+        hit_distances[~np.all(hit_distances != np.inf, axis=1)] = 0  # bend doesn't move vertices that miss the OBB
+
+        grid_min = -scale.zyx()[::-1] / 2
+        grid_max = grid_min + (shape - 1)[::-1] * step[::-1]
+        tolerance = 1e-6 * step[::-1]
+
+        leaves_grid = np.zeros(len(vertices), dtype=bool)
+        for end in (vertices + hit_distances[:, :1] * self.normal, vertices - hit_distances[:, 1:] * self.normal):
+            leaves_grid |= np.any((end < grid_min + tolerance) | (end > grid_max - tolerance), axis=1)
+
+        valid_indices = np.nonzero(self.valid)
+        to_remove = ~reachable[valid_indices] & ~leaves_grid
+
+        self.valid[valid_indices[0][to_remove], valid_indices[1][to_remove]] = False
 
     @staticmethod
-    def _get_rgi(gradient: np.array, scale: data.Scale) -> interpolate.RegularGridInterpolator:
+    def _get_sampler(volume: Union[np.ndarray, GridSampler], scale: data.Scale) -> GridSampler:
         """
-        Gets the regular grid interpolator for the gradient. Helper function for bend.
-        
-        :param gradient: The gradient to interpolate.
+        Gets the trilinear sampler for a volume. Helper function for bend and clip_vertices.
+
+        :param volume: The volume to sample, or a sampler that was already created for it.
         :param scale: The voxel spacing.
-        :return: The regular grid interpolator.
-        """
-        
-        x = np.linspace(0, gradient.shape[2] * scale.xy, gradient.shape[2]) - scale.xy / 2
-        y = np.linspace(0, gradient.shape[1] * scale.xy, gradient.shape[1]) - scale.xy / 2
-        z = np.linspace(0, gradient.shape[0] * scale.z, gradient.shape[0]) - scale.z / 2
-
-        return interpolate.RegularGridInterpolator(
-            (z, y, x),
-            gradient,
-            bounds_error=False,
-            fill_value=np.nan,
-            method="linear"
-        )
+        :return: The sampler.
+        """
 
-    def bend(self, projected_gradient: np.array, scale: data.Scale) -> None:
+        if isinstance(volume, GridSampler):
+            return volume
+
+        return GridSampler(volume, scale)
+
+    def bend(
+            self, derivative: Union[np.ndarray, GridSampler], scale: data.Scale, rel_tolerance: float = 0.01,
+            method: str = "illinois", mask: Optional[np.ndarray] = None
+    ) -> None:
         """
         Bends the mesh so the vertices are set where the gradient converges.
-        :param projected_gradient: The projected gradient
+        :param derivative: The derivative of the blurred distance map along the OBB normal (see
+                           vectors.gen_directional_derivative), or a GridSampler of it. A projected gradient vector
+                           field is also accepted
         :param scale: The voxel spacing
+        :param rel_tolerance: The precision each vertex is found to, relative to the smallest voxel side length
+        :param method: The root finding method. See roots.find_roots
+        :param mask: If not None, only the valid vertices where mask is True are bent and the others keep their heights
         """
 
-        gradient_dir = self.bounding_box.get_normal()
-        new_vertices = np.asarray(self.mesh.vertices)  # the vertices to update
-
-        # get the dot products of all vectors in projected gradient with the gradient direction vector, returning a 1D
-        # value for each vertex determining the direction of the gradient
-        magnitudes = np.dot(projected_gradient, gradient_dir)
-        rgi = self._get_rgi(magnitudes, scale)
-
-        scene = o3d.t.geometry.RaycastingScene()
-        scene.add_triangles(o3d.t.geometry.TriangleMesh().from_legacy(mesh_legacy=self.bounding_box.get_mesh()))
+        gradient_dir = self.normal
+        to_bend = self.valid if mask is None else self.valid & mask
+        new_vertices = self.vertices()[to_bend]  # the vertices to update
 
-        # Duplicate each vertex for two rays (positive and negative gradient)
-        ray_origins = np.repeat(new_vertices, 2, axis=0)
-        ray_directions = np.tile([gradient_dir, -gradient_dir], (len(new_vertices), 1))
+        if isinstance(derivative, np.ndarray) and derivative.ndim == 4:
+            # get the dot products of all vectors in projected gradient with the gradient direction vector, returning a
+            # 1D value for each vertex determining the direction of the gradient
+            derivative = np.dot(derivative, gradient_dir.astype(derivative.dtype))
 
-        # Combine origins and directions to form rays
-        rays = np.hstack([ray_origins, ray_directions])
-        rays = o3d.core.Tensor(rays, dtype=o3d.core.Dtype.Float32)
+        sampler = self._get_sampler(derivative, scale)
 
-        # Perform batch raycasting
-        hit_results = scene.cast_rays(rays)
-        hit_distances = hit_results["t_hit"].numpy().reshape(-1, 2)
+        # Find where the rays in the positive and negative gradient directions leave the OBB
+        hit_distances = self.bounding_box.ray_hit_distances(new_vertices, gradient_dir)
 
         # Filter out rays that didn't hit anything
         valid_hits = np.all(hit_distances != np.inf, axis=1)
         valid_vertices = new_vertices[valid_hits]
         valid_hit_distances = hit_distances[valid_hits]
 
-        # Compute hit points
-        hit_points_neg = valid_vertices - gradient_dir * valid_hit_distances[:, 1].reshape(-1, 1)
-        hit_points_pos = valid_vertices + gradient_dir * valid_hit_distances[:, 0].reshape(-1, 1)
+        # Parametrize each vertex's ray as vertex + t * gradient_dir. The negative side of the bracket is where the
+        # derivative is positive
+        lower = -valid_hit_distances[:, 1]
+        upper = valid_hit_distances[:, 0]
+
+        def derivative_at(t: np.ndarray, indices: np.ndarray) -> np.ndarray:
+            points = valid_vertices[indices] + gradient_dir * t.reshape(-1, 1)
+            return sampler(points[:, ::-1])  # Reverse the order for z, y, x indexing
+
+        # Search for zero gradient across all valid vertices, dropping each vertex once it has converged
+        tolerance = rel_tolerance * min(scale.xy, scale.z)
+        # The derivative is interpolated trilinearly, so a ray can only cross several sheets of the surface over more
+        # than a voxel. Bisecting down to a voxel finds the same sheet as bisection with any method
+        roots, self.bend_stats = find_roots(
+            derivative_at, lower, upper, tolerance, method=method, isolation_width=min(scale.xy, scale.z)
+        )
+
+        # Update only the bent vertices. The rays go along the normal, so moving a vertex only changes its height
+        heights = self.heights[to_bend]
+        heights[valid_hits] += roots
+        self.heights[to_bend] = heights
+
+    def _refine_from(
+            self, coarse: "Mesh", coarse_kept: np.ndarray, tolerance: float, height_tolerance: float
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Sets the heights of the vertices that can be found from the previous level of Mesh.adaptive without bending
+        them. The coarse mesh spans the same plane with twice the spacing, so its vertices are every second vertex of
+        this mesh. Their heights are copied. The heights of the vertices between them are interpolated linearly where
+        the coarse surface is flat enough for the interpolation error to stay below the tolerance and far enough from
+        the clipped edge of the surface for the edge not to move.
+
+        The error of interpolating linearly between two vertices is an eighth of the second difference of the heights
+        over them, and the error in the middle of a cell is at most twice that. Changing a height by d changes the area
+        of the cells next to it by less than d / spacing relative to their area, so the error is kept below
+        tolerance * spacing. Bending only finds each height to height_tolerance, so the second differences of bent
+        heights are up to four times that even where the surface is flat. An error below height_tolerance is as good as
+        bending, so it is accepted too.
+
+        :param coarse: The bent mesh with twice the spacing
+        :param coarse_kept: The vertices of the coarse mesh that clip_vertices keeps
+        :param tolerance: The relative area tolerance
+        :param height_tolerance: The precision the heights of bent vertices are found to
+        :return: (the vertices whose heights were copied, the vertices whose heights were interpolated)
+        """
+
+        rows, columns = coarse.valid.shape
+        heights = coarse.heights
+
+        # the second differences along both grid axes, which can only be found between three kept vertices
+        curvature = np.full((rows, columns), np.inf)
+        curvature[1:-1, :] = np.where(
+            coarse_kept[:-2] & coarse_kept[1:-1] & coarse_kept[2:],
+            np.abs(heights[:-2] - 2 * heights[1:-1] + heights[2:]), np.inf
+        )
+        curvature[:, 1:-1] = np.maximum(curvature[:, 1:-1], np.where(
+            coarse_kept[:, :-2] & coarse_kept[:, 1:-1] & coarse_kept[:, 2:],
+            np.abs(heights[:, :-2] - 2 * heights[:, 1:-1] + heights[:, 2:]), np.inf
+        ))
+        curvature[:, [0, -1]] = np.inf
+
+        # the coarse mesh upsampled to every vertex it has on both sides
+        fine_heights = np.zeros((2 * rows - 1, 2 * columns - 1))
+        copied = np.zeros(fine_heights.shape, dtype=bool)
+        interpolated = np.zeros(fine_heights.shape, dtype=bool)
+
+        fine_heights[::2, ::2] = heights
+        copied[::2, ::2] = coarse.valid
+
+        # the vertices between two coarse vertices along each axis, and in the middle of each coarse cell
+        for row_offset, column_offset in ((1, 0), (0, 1), (1, 1)):
+            corners = [
+                (slice(i, rows - row_offset + i), slice(j, columns - column_offset + j))
+                for i in range(row_offset + 1) for j in range(column_offset + 1)
+            ]
+            error = np.max([curvature[corner] for corner in corners], axis=0) * (row_offset + column_offset) / 8
+
+            fine = slice(row_offset, None, 2), slice(column_offset, None, 2)
+            fine_heights[fine] = np.mean([heights[corner] for corner in corners], axis=0)
+            interpolated[fine] = np.all([coarse_kept[corner] for corner in corners], axis=0) & (
+                error <= max(tolerance * self.spacing, height_tolerance)
+            )
+
+        # this mesh can end a vertex before or after the upsampled one
+        overlap = slice(0, min(self.valid.shape[0], fine_heights.shape[0])), slice(
+            0, min(self.valid.shape[1], fine_heights.shape[1])
+        )
+        self.heights[overlap] = fine_heights[overlap]
+
+        copied_mask = np.zeros(self.valid.shape, dtype=bool)
+        interpolated_mask = np.zeros(self.valid.shape, dtype=bool)
+        copied_mask[overlap] = copied[overlap]
+        interpolated_mask[overlap] = interpolated[overlap]
+
+        return copied_mask, interpolated_mask
+
+    @classmethod
+    def adaptive(
+            cls, obb: bounding_box.Obb, geom_center: np.ndarray, scale: data.Scale,
+            derivative: Union[np.ndarray, GridSampler], dist_map: Union[np.ndarray, GridSampler],
+            dist_threshold: Optional[float] = None, spacing: Optional[float] = None, tolerance: float = 0.005,
+            cull_data: Optional[np.ndarray] = None, rel_tolerance: float = 0.01, method: str = "illinois"
+    ) -> "Mesh":
+        """
+        Builds and bends a mesh whose spacing is refined until its area converges. The first level is a few cells
+        across, and each level halves the spacing of the previous one down to the finest spacing. A level only bends
+        its new vertices near curved parts of the surface, near the clipped edge or next to vertices that were not bent,
+        and interpolates the others (see _refine_from), so most of the bending is only done where the surface needs the
+        finer spacing. Refinement stops once the estimated discretisation error of the clipped area (see
+        extrapolated_error) is at most tolerance relative to the area. If it never is, every level down to the finest
+        spacing is bent, which takes longer than bending a mesh with the finest spacing, and refinement_stats.converged
+        is False.
+
+        The returned mesh is bent but not clipped, like after bend. Its refinement_stats holds the area of each level
+        and the estimated error of the last level.
+
+        :param obb: The OBB of the PSD
+        :param geom_center: The geometric center of the PSD
+        :param scale: The voxel spacing
+        :param derivative: The derivative of the blurred distance map along the OBB normal, or a GridSampler of it. See
+                           bend
+        :param dist_map: The distance map to clip the vertices of each level by, or a GridSampler of it. See
+                         clip_vertices
+        :param dist_threshold: The distance threshold to clip the vertices by. See clip_vertices
+        :param spacing: The finest spacing. If None, the smallest voxel side length
+        :param tolerance: The relative area tolerance. See above
+        :param cull_data: If not None, the vertices are culled by this boolean data before bending. See cull
+        :param rel_tolerance: The precision each vertex is found to. See bend
+        :param method: The root finding method. See bend
+        :return: The bent mesh of the last level
+        """
+
+        if tolerance <= 0:
+            raise ValueError(f"tolerance must be positive, not {tolerance}")
+
+        if spacing is None:
+            spacing = min(scale.xy, scale.z)
+
+        derivative = cls._get_sampler(derivative, scale)
+        dist_map = cls._get_sampler(dist_map, scale)
+
+        # the mesh spans the two longest sides of the OBB. There are always at least two levels so the error can be
+        # estimated
+        shorter_side = np.sort(obb.extent)[1]
+        levels = max(int(math.log2(max(shorter_side / (cls._COARSE_CELLS * spacing), 1))), 1)
+
+        spacings = []
+        areas = []
+        bent_vertices = 0
+        interpolated_vertices = 0
+        iterations = 0
+        evaluations = 0
+
+        previous = None
+        previous_kept = None
+        converged = False
+
+        # every vertex of a level is a vertex of the finest level, so the finest level is only culled once
+        finest = cls(obb, geom_center, scale, spacing)
 
-        # Binary search for zero gradient across all valid vertices
-        # Initialize midpoints to hit_points_pos. Avoids the very unlikely case that the loop will not run, and an
-        #  error will be thrown due to the uninitialized variable "midpoints"
-        midpoints = hit_points_pos
-        
-        while np.linalg.norm(hit_points_neg - hit_points_pos, axis=1).max() > 0.05:  # 0.05 nm threshold
-            midpoints = (hit_points_neg + hit_points_pos) / 2
-            mid_values = rgi(midpoints[:, ::-1])  # Reverse the order for z, y, x indexing
+        if cull_data is not None:
+            finest.cull(cull_data, scale, dist_threshold)
 
-            # Vectorized update for binary search
-            mask = mid_values < 0
-            hit_points_pos[mask] = midpoints[mask]
-            hit_points_neg[~mask] = midpoints[~mask]
+        for level in range(levels, -1, -1):
+            if level == 0:
+                current = finest
+            else:
+                current = cls(obb, geom_center, scale, spacing * 2 ** level)
 
-        # Update only the valid vertices
-        new_vertices[valid_hits] = midpoints
+                # a coarse level can end a vertex after the finest level, whose vertices are kept
+                culled = finest.valid[::2 ** level, ::2 ** level][:current.valid.shape[0], :current.valid.shape[1]]
+                current.valid[:culled.shape[0], :culled.shape[1]] &= culled
+
+            to_bend = current.valid.copy()
+
+            if previous is not None:
+                copied, interpolated = current._refine_from(
+                    previous, previous_kept, tolerance, rel_tolerance * min(scale.xy, scale.z)
+                )
+                to_bend &= ~(copied | interpolated)
+                interpolated_vertices += np.count_nonzero(current.valid & interpolated)
+
+                # bend from the mid-plane, like the vertices of a mesh with a fixed spacing
+                current.heights[to_bend] = 0
+
+            current.bend(derivative, scale, rel_tolerance, method, mask=to_bend)
+            bent_vertices += np.count_nonzero(to_bend)
+            iterations += current.bend_stats.iterations
+            evaluations += current.bend_stats.evaluations
+
+            clipped = current.copy()
+            clipped.clip_vertices(dist_map, scale, dist_threshold)
+
+            spacings.append(current.spacing)
+            areas.append(clipped.area())
+
+            previous = current
+            previous_kept = clipped.valid
+
+            if len(areas) > 1 and extrapolated_error(areas) <= tolerance * areas[-1]:
+                converged = True
+                break
+
+        current.bend_stats = RootStats(iterations, evaluations)
+        current.refinement_stats = RefinementStats(
+            tuple(spacings), tuple(areas), int(bent_vertices), int(interpolated_vertices), converged
+        )
+
+        return current
 
     def area(self) -> float:
         """
@@ -252,4 +675,19 @@ class Mesh:
         :return: The surface area of the mesh
         """
 
-        return self.mesh.get_surface_area()
+        vertices = self.vertices()
+
+        top_left = vertices[:-1, :-1]
+        top_right = vertices[:-1, 1:]
+        bottom_left = vertices[1:, :-1]
+        bottom_right = vertices[1:, 1:]
+
+        # the area of each of the two triangles in every grid cell
+        upper_areas = np.linalg.norm(np.cross(top_right - top_left, bottom_left - top_left), axis=-1) / 2
+        lower_areas = np.linalg.norm(np.cross(bottom_right - top_right, bottom_left - top_right), axis=-1) / 2
+
+        # only count triangles where all three vertices are part of the surface
+        upper_valid = self.valid[:-1, :-1] & self.valid[:-1, 1:] & self.valid[1:, :-1]
+        lower_valid = self.valid[:-1, 1:] & self.valid[1:, 1:] & self.valid[1:, :-1]
+
+        return float(np.sum(upper_areas[upper_valid]) + np.sum(lower_areas[lower_valid]))
@@ -0,0 +1,209 @@
+import contextlib
+import time
+import tracemalloc
+from dataclasses import dataclass, field
+from typing import Iterable, Iterator, Optional
+
+
+@dataclass(frozen=True)
+class StageMetrics:
+    """
+    The resources used by one step of the processing pipeline
+    :param name: The name of the step
+    :param wall_time: The elapsed time in seconds
+    :param cpu_time: The CPU time of this process in seconds. Can exceed the wall time when multithreaded
+    :param peak_memory: The peak memory allocated during the step in bytes, as traced by tracemalloc. Only includes
+                        Python and NumPy allocations, not memory allocated by C++ libraries such as Open3D
+    :param calls: The number of times the step ran. More than 1 for aggregated metrics
+    """
+
+    name: str
+    wall_time: float
+    cpu_time: float
+    peak_memory: int
+    calls: int = 1
+
+
+@dataclass(frozen=True)
+class PipelineMetrics:
+    """
+    The resources used by each step of the processing pipeline, in the order the steps ran, and counters such as the
+    number of root finding iterations while bending the mesh.
+    """
+
+    stages: tuple[StageMetrics, ...]
+    counters: dict[str, int] = field(default_factory=dict)
+
+    def stage(self, name: str) -> Optional[StageMetrics]:
+        """
+        Gets the metrics of a step
+
+        :param name: The name of the step
+        :return: The metrics of the step, or None if the step did not run
+        """
+
+        for stage in self.stages:
+            if stage.name == name:
+                return stage
+
+        return None
+
+    def total_wall_time(self) -> float:
+        """
+        :return: The total wall time of all steps in seconds
+        """
+
+        return sum(stage.wall_time for stage in self.stages)
+
+    def bottleneck(self) -> Optional[StageMetrics]:
+        """
+        :return: The step with the longest wall time, or None if no steps ran
+        """
+
+        return max(self.stages, key=lambda stage: stage.wall_time, default=None)
+
+    def summary(self) -> str:
+        """
+        Formats the metrics as a human-readable table
+
+        :return: The formatted metrics
+        """
+
+        total_wall_time = self.total_wall_time()
+        lines = [f"{'Step':<16}{'Calls':>8}{'Wall (s)':>12}{'CPU (s)':>12}{'Wall %':>9}{'Peak (MiB)':>13}"]
+
+        for stage in self.stages:
+            percent = stage.wall_time / total_wall_time * 100 if total_wall_time > 0 else 0
+            lines.append(
+                f"{stage.name:<16}{stage.calls:>8}{stage.wall_time:>12.4f}{stage.cpu_time:>12.4f}{percent:>8.1f}%"
+                f"{stage.peak_memory / 2 ** 20:>13.2f}"
+            )
+
+        lines.extend(f"{name}: {value}" for name, value in self.counters.items())
+
+        return "\n".join(lines)
+
+    @staticmethod
+    def aggregate(metrics: Iterable[Optional["PipelineMetrics"]]) -> Optional["PipelineMetrics"]:
+        """
+        Combines the metrics of many pipeline runs, e.g. every PSD of a MultiROI. Times, calls and counters are summed,
+        and the peak memory is the largest peak of any run.
+
+        :param metrics: The metrics to combine. None values (runs without metrics) are skipped
+        :return: The combined metrics, or None if there were no metrics to combine
+        """
+
+        stages: dict[str, StageMetrics] = {}
+        counters: dict[str, int] = {}
+        found = False
+
+        for pipeline_metrics in metrics:
+            if pipeline_metrics is None:
+                continue
+
+            found = True
+
+            for stage in pipeline_metrics.stages:
+                previous = stages.get(stage.name)
+
+                if previous is None:
+                    stages[stage.name] = stage
+                    continue
+
+                stages[stage.name] = StageMetrics(
+                    stage.name,
+                    previous.wall_time + stage.wall_time,
+                    previous.cpu_time + stage.cpu_time,
+                    max(previous.peak_memory, stage.peak_memory),
+                    previous.calls + stage.calls
+                )
+
+            for name, value in pipeline_metrics.counters.items():
+                counters[name] = counters.get(name, 0) + value
+
+        if not found:
+            return None
+
+        return PipelineMetrics(tuple(stages.values()), counters)
+
+
+class MetricsRecorder:
+    """
+    Records PipelineMetrics while the processing pipeline runs. Does nothing if disabled, so the pipeline can always
+    call it.
+    """
+
+    def __init__(self, enabled: bool, trace_memory: bool = True):
+        """
+        :param enabled: Whether to record anything
+        :param trace_memory: Whether to trace the peak memory of each step with tracemalloc. Tracing slows down
+                             allocation-heavy Python code, but has little effect on the NumPy-heavy steps
+        """
+
+        self.enabled = enabled
+        self.trace_memory = trace_memory
+        self._stages: list[StageMetrics] = []
+        self._counters: dict[str, int] = {}
+
+    @contextlib.contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """
+        Context manager recording the resources used by a step of the pipeline
+
+        :param name: The name of the step
+        """
+
+        if not self.enabled:
+            yield
+            return
+
+        # only stop tracing afterwards if it was started here, so tracing started by the caller is left alone
+        started_tracing = False
+        baseline_memory = 0
+
+        if self.trace_memory:
+            if tracemalloc.is_tracing():
+                tracemalloc.reset_peak()
+                baseline_memory = tracemalloc.get_traced_memory()[0]
+            else:
+                tracemalloc.start()
+                started_tracing = True
+
+        start_wall = time.perf_counter()
+        start_cpu = time.process_time()
+
+        try:
+            yield
+        finally:
+            wall_time = time.perf_counter() - start_wall
+            cpu_time = time.process_time() - start_cpu
+            peak_memory = 0
+
+            if self.trace_memory:
+                peak_memory = max(tracemalloc.get_traced_memory()[1] - baseline_memory, 0)
+
+                if started_tracing:
+                    tracemalloc.stop()
+
+            self._stages.append(StageMetrics(name, wall_time, cpu_time, peak_memory))
+
+    def count(self, name: str, value: int) -> None:
+        """
+        Adds to a counter
+
+        :param name: The name of the counter
+        :param value: The value to add
+        """
+
+        if self.enabled:
+            self._counters[name] = self._counters.get(name, 0) + int(value)
+
+    def result(self) -> Optional[PipelineMetrics]:
+        """
+        :return: The recorded metrics, or None if disabled
+        """
+
+        if not self.enabled:
+            return None
+
+        return PipelineMetrics(tuple(self._stages), dict(self._counters))
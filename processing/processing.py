@@ -1,9 +1,8 @@
 import functools
 from dataclasses import dataclass
-from typing import Optional
+from typing import Iterable, Optional, Union
 
 import numpy as np
-import open3d as o3d
 
 from . import data
 from . import bounding_box
@@ -11,15 +10,43 @@ from . import dist
 from . import center
 from . import mesh
 from . import vectors
+from . import gaussian
+from . import scratch
+from .cache import PipelineCache
+from .metrics import MetricsRecorder, PipelineMetrics
+from .sampling import GridSampler
 
 # Workaround since running Dragonfly with OrsMinimalStartupScript.py causes the package path to be different
 if __package__.count(".") == 0:
-    import visual
     from log import logger
 else:
-    from .. import visual
     from ..log import logger
 
+# the xy downsampling factor of a preview. See get_area and test/preview_accuracy.py
+PREVIEW_FACTOR = 4
+# the largest c_s a preview is reliable for. On data/test, the preview underestimates the area by up to 9% for c_s up to
+# this and by 14% to 22% at c_s 0.67
+PREVIEW_MAX_C_S = 0.3
+
+# the optional fields of a PancakeOutput that get_area can be asked for. See get_area(outputs)
+OUTPUTS = ("points", "psd_mesh", "vector_fields")
+
+
+def _visual():
+    """
+    Imports the visualization module on first use, since it loads matplotlib and Open3D, which slow down loading the
+    plugin even if nothing is visualized
+
+    :return: The visual module
+    """
+
+    if __package__.count(".") == 0:
+        import visual
+    else:
+        from .. import visual
+
+    return visual
+
 
 @dataclass(frozen=True)
 class PancakeOutput:
@@ -29,10 +56,19 @@ class PancakeOutput:
     area_nm: float
     center: np.ndarray
     obb: bounding_box.Obb
-    points: np.ndarray
+
+    """
+    The foreground voxels of the padded data in nm, and the final mesh. None unless requested with get_area(outputs).
+    """
+    points: Optional[np.ndarray]
     psd_mesh: Optional[mesh.Mesh]
-    gradient: np.ndarray
-    projected_gradient: np.ndarray
+
+    """
+    The gradient and projected gradient vector fields. Only built when visualizing or requested with
+    get_area(outputs), None otherwise.
+    """
+    gradient: Optional[np.ndarray]
+    projected_gradient: Optional[np.ndarray]
 
     """
     The translations made to the OBB and mesh when padding the data. Used to translate the vertices back to the original
@@ -40,6 +76,18 @@ class PancakeOutput:
     """
     translations: np.ndarray
 
+    """
+    The time and memory used by each step. Only recorded when get_area is called with collect_metrics=True, None
+    otherwise.
+    """
+    metrics: Optional[PipelineMetrics] = None
+
+    """
+    The estimated discretisation error of area_nm in nm^2. Only estimated when get_area is called with
+    mesh_spacing="auto", None otherwise.
+    """
+    area_error_nm: Optional[float] = None
+
     def area_microns(self) -> float:
         """
         Gets the area in um^2
@@ -50,6 +98,29 @@ class PancakeOutput:
         return self.area_nm / 1e6
 
 
+@dataclass(frozen=True)
+class SweepOutput:
+    """
+    Dataclass to hold the output of get_area_sweep
+    """
+    c_s_values: np.ndarray
+    dist_thresholds: list[Optional[float]]
+
+    """
+    The area in nm^2 for each pair of parameters, indexed as areas_nm[c_s index, dist_threshold index]
+    """
+    areas_nm: np.ndarray
+
+    def area_microns(self) -> np.ndarray:
+        """
+        Gets the areas in um^2
+
+        :return: The areas in um^2, indexed the same as areas_nm
+        """
+
+        return self.areas_nm / 1e6
+
+
 def visualize_step(
         visualize: bool, visualize_signal, step_name: str, psd_data: np.ndarray, scale: data.Scale,
         obb=None, center_point=None, psd_mesh=None, vectors_arr=None, vector=None):
@@ -75,7 +146,7 @@ def visualize_step(
     if visualize_signal:
         logger.info(f"Visualizing {step_name} via signal")
         visualize_signal.emit(functools.partial(
-            visual.vis_3d,
+            _visual().vis_3d,
             psd_data, scale, step_name,
             obb=obb,
             center=center_point,
@@ -85,7 +156,7 @@ def visualize_step(
         ))
     else:
         logger.info(f"Visualizing {step_name} directly")
-        visual.vis_3d(
+        _visual().vis_3d(
             psd_data, scale, step_name,
             obb=obb,
             center=center_point,
@@ -98,104 +169,413 @@ def visualize_step(
 def get_area(
         raw_data: np.ndarray, scale: data.Scale, visualize: bool = False, c_s: float = 0.67,
         visualize_end: bool = False, visualize_unclipped: bool = False,
-        dist_threshold: Optional[float] = None, visualize_signal=None
+        dist_threshold: Optional[float] = None, visualize_signal=None, precision: str = "float64",
+        collect_metrics: bool = False, blur_method: str = "direct", scratch_dir: Optional[str] = None,
+        cull: bool = True, mesh_spacing: Union[float, str, None] = None, mesh_tolerance: float = 0.005,
+        preview_factor: int = 1, cache: Optional[PipelineCache] = None, outputs: Optional[Iterable[str]] = None
 ) -> PancakeOutput:
     """
     Processes the data
     
-    :param raw_data: The raw data to find the surface area of
+    :param raw_data: The raw data to find the surface area of. Either a 3D volume or the (N, 3) integer ZYX indices of
+                     its foreground voxels, as written by scripts/roi_to_npz.py. For coordinates, the crop and the OBB
+                     are found from the coordinates and only the padded volume the distance map needs is built, so the
+                     memory used grows with the size of the PSD instead of the size of the volume it was labelled in
     :param scale: The scale bar
     :param visualize: Whether to visualize the data
     :param c_s: The constant for the sigma formula
     :param visualize_unclipped: Whether to visualize the second to last step
     :param visualize_end: Whether to visualize the final result
     :param dist_threshold: The distance threshold to clip each vertex in the final step. If None, the threshold is
-                           equal to max(scale.xy, scale.z)
+                           equal to max(scale.xy, scale.z) / 2
     :param visualize_signal: The signal to emit the visualization to. Used for PyQt
+    :param precision: The floating point precision of every volumetric intermediate, "float64" or "float32". float32
+                      halves the size of the stored distance map, blur and gradient volumes, which lowers the peak
+                      memory at the cost of a small area error. It saves memory only, not time: the distance transform
+                      still finds the distances in float64, and scipy's filters compute in float64 internally, so on
+                      data/test float32 takes about as long as float64 (see test/precision_report.py)
+    :param collect_metrics: Whether to record the wall time, CPU time and peak traced memory of each step in
+                            PancakeOutput.metrics. Visualization is not included in the recorded times
+    :param blur_method: How the distance map is blurred, "direct", "box" or "auto". "direct" is the exact truncated
+                        Gaussian, whose cost grows with sigma. "auto" uses box filters along axes with large sigmas,
+                        which is faster for large c_s at the cost of a small area error (see test/blur_accuracy.py)
+    :param scratch_dir: If not None, runs out of core for PSDs whose volumes don't fit in memory. The distance map,
+                        blur, derivative and the feature transforms of the distance map are memory-mapped to temporary
+                        files in this directory, each deleted as soon as no later step needs it. The blur, derivative
+                        and center are streamed in chunks of z layers. The area is the same as in memory, up to rounding
+                        for the box blur. The boolean grid stays in memory. Cannot be combined with visualization
+    :param cull: Whether to remove the vertices that are certain to be clipped in step I before bending the mesh (see
+                 Mesh.cull). Doesn't change the area, but bending is faster for PSDs that only cover part of their OBB
+    :param mesh_spacing: The distance between neighboring vertices of the mesh in nm. If None, the smallest voxel side
+                         length. If "auto", the mesh is refined from a coarse spacing down to the smallest voxel side
+                         length until its area converges to within mesh_tolerance, and only the parts of it that need
+                         the finer spacing are bent (see Mesh.adaptive). The estimated discretisation error is returned
+                         in PancakeOutput.area_error_nm. If the area doesn't converge before the smallest voxel side
+                         length, as on every PSD of data/test at the default mesh_tolerance, a warning is logged and
+                         the mesh takes about as long as one with a fixed spacing. Cannot be combined with visualize or
+                         visualize_unclipped, since the mesh only exists once it is bent. See
+                         test/mesh_spacing_benchmark.py
+    :param mesh_tolerance: The relative area tolerance of mesh_spacing="auto"
+    :param preview_factor: If greater than 1, finds an approximate area quickly by running the pipeline on the PSD
+                           downsampled by this factor along x and y (see data.downsample_xy), keeping the physical blur
+                           width and clipping threshold. The mesh is as coarse as the downsampled voxels. On
+                           data/test, PREVIEW_FACTOR is about 6 times faster and underestimates the full resolution area
+                           by 3% on average and at most 10% for c_s up to 0.3. Large c_s are much more sensitive to the
+                           shape of the PSD, so the preview is less reliable (see test/preview_accuracy.py)
+    :param cache: If not None, the OBB, distance map and center are reused from this cache when the same cropped data
+                  was processed before with the same scale, and stored in it otherwise. The area is the same. Hits and
+                  misses are counted in the cache_hits and cache_misses metrics. See cache.PipelineCache
+    :param outputs: The optional fields of the PancakeOutput to fill, any of OUTPUTS. The others are None, so callers
+                    that only need the area don't build the point array or hold on to the mesh. "vector_fields"
+                    builds the gradient and projected gradient even without visualizing. If None, the points and the
+                    mesh are filled, and the vector fields when visualizing
     :return: A PancakeOutput class, containing surface area and a bunch of other data. Returns with zeros/filler data if the input data is empty
     """
 
-    if len(np.argwhere(raw_data)) == 0:
+    if precision not in ("float64", "float32"):
+        raise ValueError(f"precision must be 'float64' or 'float32', not {precision!r}")
+
+    if blur_method not in gaussian.METHODS:
+        raise ValueError(f"blur_method must be one of {', '.join(gaussian.METHODS)}, not {blur_method!r}")
+
+    if scratch_dir is not None and (visualize or visualize_unclipped or visualize_end):
+        raise ValueError("scratch_dir cannot be combined with visualization")
+
+    adaptive = isinstance(mesh_spacing, str)
+
+    if adaptive and mesh_spacing != "auto":
+        raise ValueError(f"mesh_spacing must be a number, None or 'auto', not {mesh_spacing!r}")
+
+    if adaptive and (visualize or visualize_unclipped):
+        raise ValueError("mesh_spacing='auto' cannot be combined with visualize or visualize_unclipped")
+
+    if preview_factor < 1:
+        raise ValueError(f"preview_factor must be at least 1, not {preview_factor}")
+
+    if outputs is None:
+        outputs = ("points", "psd_mesh") + (("vector_fields",) if visualize or visualize_unclipped else ())
+
+    outputs = set(outputs)
+
+    if not outputs <= set(OUTPUTS):
+        raise ValueError(f"outputs must be some of {', '.join(OUTPUTS)}, not {', '.join(sorted(outputs))}")
+
+    dtype = np.dtype(precision)
+    recorder = MetricsRecorder(collect_metrics)
+    space = scratch.ScratchSpace(scratch_dir)
+
+    # the vertices of a preview are moved from the first voxel of each downsampled block to its center
+    preview_offset = np.zeros(3)
+
+    if preview_factor > 1:
+        logger.info(f"Downsampling data by {preview_factor} along x and y for a preview")
+        with recorder.stage("downsample"):
+            raw_data = data.downsample_xy(raw_data, preview_factor)
+
+        # keep the physical blur width and clipping threshold of the full resolution
+        c_s = c_s / preview_factor
+        dist_threshold = dist_threshold if dist_threshold is not None else max(scale.xy, scale.z) / 2
+        preview_offset = np.array([1, 1, 0]) * (preview_factor - 1) / 2 * scale.xy
+        scale = data.Scale(scale.xy * preview_factor, scale.z)
+
+    sparse = data.is_coordinates(raw_data)
+
+    if (len(raw_data) == 0) if sparse else not np.any(raw_data):
         logger.warning("Data is empty")
-        return PancakeOutput(0, np.array([0, 0, 0]), o3d.geometry.OrientedBoundingBox(), np.array([0, 0, 0]), None, np.array([0, 0, 0]), np.array([0, 0, 0]), np.array([0, 0, 0]))
+        filler = np.array([0, 0, 0])
+        return PancakeOutput(
+            0, filler, bounding_box.Obb.from_box(np.zeros(3), np.zeros(3), np.eye(3)),
+            filler if "points" in outputs else None, None, filler if "vector_fields" in outputs else None,
+            filler if "vector_fields" in outputs else None, filler, recorder.result()
+        )
 
-    logger.info(f"Starting processing pipeline. Scale: {scale}, c_s: {c_s}, dist_threshold: {dist_threshold}")
+    logger.info(f"Starting processing pipeline. Scale: {scale}, c_s: {c_s}, dist_threshold: {dist_threshold}, "
+                f"precision: {precision}")
     
     # Step A: load and format data
     logger.info("Formatting data")
-    formatted, cropping_translations = data.format_data(raw_data, scale)
+    with recorder.stage("format_data"):
+        if sparse:
+            coordinates, cropped_shape, cropping_translations = data.format_coordinates(raw_data, scale)
+        else:
+            formatted, cropping_translations = data.format_data(raw_data, scale)
+
+    # Step Aa: look up the steps that only depend on the cropped data. Only the distance map of the padded grid is
+    # cached
+    cached = None
+
+    if cache is not None:
+        with recorder.stage("cache_load"):
+            if sparse:
+                cache_key = cache.key(coordinates, scale, cropped_shape)
+            else:
+                cache_key = cache.key(formatted, scale)
+
+            cached = cache.load(cache_key, dtype, mmap=space.out_of_core)
+
+        recorder.count("cache_hits", int(cached is not None))
+        recorder.count("cache_misses", int(cached is None))
 
     # Step B: oriented bounding boxes
-    logger.info("Creating OBB")
-    obb = bounding_box.Obb(formatted, scale)
+    if cached is not None:
+        obb = cached.obb
+    else:
+        logger.info("Creating OBB")
+        with recorder.stage("obb"):
+            if sparse:
+                obb = bounding_box.Obb.from_voxels(coordinates, scale)
+            else:
+                obb = bounding_box.Obb(formatted, scale)
+
+        if cache is not None:
+            # padding moves the OBB, so a copy of it is stored
+            found_obb = bounding_box.Obb.from_box(obb.center, obb.extent, obb.rotation_matrix)
 
     # Step Ba: Expand the dataset so the OBB does not have values outside the dataset
     logger.info("Padding data")
-    formatted, padding_translations = obb.expand_data(scale, formatted)
+    with recorder.stage("expand_data"):
+        if sparse:
+            formatted, padding_translations = obb.expand_coordinates(scale, coordinates, cropped_shape)
+        else:
+            formatted, padding_translations = obb.expand_data(scale, formatted)
+
+    recorder.count("voxels", formatted.size)
 
     visualize_step(visualize, visualize_signal, "Step A: Formatted Data", formatted, scale, obb=obb)
 
     # Step C: distance map
-    logger.info("Creating distance map")
-    distance_map = dist.gen_dist_map(formatted, scale)
-    blurred = dist.blur(distance_map, c_s, scale)
-    
+    # None unless out of core, in which case the memory-mapped volumes are streamed in chunks of z layers
+    chunk_layers = space.chunk_layers(formatted.shape)
+
+    if cached is not None and cached.distance_map is not None:
+        distance_map = cached.distance_map
+    else:
+        logger.info("Creating distance map")
+        with recorder.stage("dist_map"):
+            distance_map = dist.gen_dist_map(
+                formatted, scale, dtype, out=space.empty(formatted.shape, dtype), allocate=space.empty
+            )
+
+    with recorder.stage("blur"):
+        blurred = dist.blur(
+            distance_map, c_s, scale, method=blur_method,
+            out=space.empty(formatted.shape, dtype) if space.out_of_core else None, chunk_layers=chunk_layers
+        )
+
     # don't show if it needs to be emitted to a signal since matplotlib doesn't play well with PyQt
     if visualize and not visualize_signal:
         logger.info("Visualizing distance map")
-        visualizer = visual.SliceViewer(distance_map)
+        visualizer = _visual().SliceViewer(distance_map)
         visualizer.visualize()
 
     # Step D: find the center
-    logger.info("Finding center")
-    center_point = center.geom_center(distance_map, scale)
+    if cached is not None and cached.center is not None:
+        center_point = cached.center
+    else:
+        logger.info("Finding center")
+        with recorder.stage("center"):
+            center_point = center.geom_center(distance_map, scale, chunk_layers)
 
-    # Step E: create the mesh
-    logger.info("Creating mesh")
-    psd_mesh = mesh.Mesh(obb, center_point, scale)
+    if cache is not None and cached is None:
+        with recorder.stage("cache_store"):
+            cache.store(cache_key, found_obb, distance_map, center_point)
 
-    visualize_step(visualize, visualize_signal, "Step E: Mesh", distance_map, scale, obb=obb,
-                   center_point=center_point, psd_mesh=psd_mesh)
+    # Step E: create the mesh. The adaptive mesh is created level by level while it is bent in step H
+    psd_mesh = None
 
-    # Step F: calculate gradient
-    logger.info("Calculating gradient")
-    gradient = vectors.gen_gradient(blurred, scale)
+    if not adaptive:
+        logger.info("Creating mesh")
+        with recorder.stage("mesh"):
+            psd_mesh = mesh.Mesh(obb, center_point, scale, mesh_spacing)
+
+        recorder.count("mesh_vertices", np.count_nonzero(psd_mesh.valid))
 
-    visualize_step(visualize, visualize_signal, "Step F: Gradient", distance_map, scale, obb=obb,
-                   center_point=center_point, psd_mesh=psd_mesh, vectors_arr=gradient)
+        visualize_step(visualize, visualize_signal, "Step E: Mesh", distance_map, scale, obb=obb,
+                       center_point=center_point, psd_mesh=psd_mesh)
 
+        # Step Ea: remove the vertices that are too far from the PSD to survive step I wherever they are bent to
+        if cull:
+            logger.info("Culling vertices")
+            with recorder.stage("cull"):
+                psd_mesh.cull(formatted, scale, dist_threshold)
+
+            recorder.count("culled_vertices", np.count_nonzero(psd_mesh.valid))
+
+    # Step F: calculate gradient
     # Step G: project gradient onto normal
-    logger.info("Projecting gradient onto normal")
+    # Bending only needs the derivative along the normal, so the full vector fields are only built to be visualized or
+    # returned
     normal = obb.get_normal()
-    projected_gradient = vectors.project_on_normal(gradient, normal)
+    gradient = None
+    projected_gradient = None
+
+    if visualize or visualize_unclipped or "vector_fields" in outputs:
+        logger.info("Calculating gradient")
+        with recorder.stage("gradient"):
+            gradient = vectors.gen_gradient(blurred, scale)
 
-    visualize_step(visualize, visualize_signal, "Step G: Projected Gradient", distance_map, scale, obb=obb,
-                   center_point=center_point, psd_mesh=psd_mesh, vectors_arr=projected_gradient)
+        visualize_step(visualize, visualize_signal, "Step F: Gradient", distance_map, scale, obb=obb,
+                       center_point=center_point, psd_mesh=psd_mesh, vectors_arr=gradient)
+
+        logger.info("Projecting gradient onto normal")
+        with recorder.stage("project_gradient"):
+            projected_gradient = vectors.project_on_normal(gradient, normal)
+
+        visualize_step(visualize, visualize_signal, "Step G: Projected Gradient", distance_map, scale,
+                       obb=obb, center_point=center_point, psd_mesh=psd_mesh, vectors_arr=projected_gradient)
+
+    logger.info("Calculating derivative along normal")
+    with recorder.stage("derivative"):
+        derivative = vectors.gen_directional_derivative(
+            blurred, scale, normal, out=space.empty(formatted.shape, dtype) if space.out_of_core else None,
+            chunk_layers=chunk_layers
+        )
+    del blurred
 
     # Step H: deform the mesh
-    logger.info("Deforming mesh")
-    psd_mesh.bend(projected_gradient, scale)
+    if adaptive:
+        logger.info("Creating and deforming adaptive mesh")
+        with recorder.stage("bend"):
+            psd_mesh = mesh.Mesh.adaptive(
+                obb, center_point, scale, derivative, distance_map, dist_threshold,
+                tolerance=mesh_tolerance, cull_data=formatted if cull else None
+            )
+
+        recorder.count("mesh_levels", len(psd_mesh.refinement_stats.spacings))
+        recorder.count("interpolated_vertices", psd_mesh.refinement_stats.interpolated_vertices)
+        logger.info(f"Adaptive mesh spacings: {psd_mesh.refinement_stats.spacings}, "
+                    f"areas: {psd_mesh.refinement_stats.areas}")
+
+        if not psd_mesh.refinement_stats.converged:
+            logger.warning(f"The adaptive mesh did not converge to within {mesh_tolerance} of its area before the "
+                           f"finest spacing. The estimated error is "
+                           f"{psd_mesh.refinement_stats.area_error / psd_mesh.refinement_stats.areas[-1]:.2%}")
+    else:
+        logger.info("Deforming mesh")
+        with recorder.stage("bend"):
+            psd_mesh.bend(derivative, scale)
+    del derivative
+
+    recorder.count("bend_iterations", psd_mesh.bend_stats.iterations)
+    recorder.count("bend_evaluations", psd_mesh.bend_stats.evaluations)
 
     visualize_step(visualize or visualize_unclipped, visualize_signal, "Step H: Deformed Mesh", distance_map,
-                   scale, obb=obb, center_point=center_point, psd_mesh=psd_mesh, vectors_arr=projected_gradient)
+                   scale, obb=obb, center_point=center_point, psd_mesh=psd_mesh,
+                   vectors_arr=projected_gradient)
 
     # Step I: move the vertices into the nearest OBB
     logger.info("Clipping vertices")
-    psd_mesh.clip_vertices(distance_map, scale, dist_threshold)
+    with recorder.stage("clip"):
+        psd_mesh.clip_vertices(distance_map, scale, dist_threshold)
+
+    recorder.count("final_vertices", np.count_nonzero(psd_mesh.valid))
 
     visualize_step(visualize or visualize_end, visualize_signal, "Step I: Clipped Vertices", distance_map,
                    scale, obb=obb, center_point=center_point, psd_mesh=psd_mesh)
 
+    with recorder.stage("area"):
+        area = psd_mesh.area()
+
+    points = None
+
+    if "points" in outputs:
+        with recorder.stage("points"):
+            points = np.argwhere(formatted)[:, ::-1] * scale.xyz()
+
     logger.info("Finished processing pipeline.")
 
     return PancakeOutput(
-        psd_mesh.area(),
+        area,
         center_point,
         obb,
-        np.argwhere(formatted)[:, ::-1] * scale.xyz(),
-        psd_mesh,
-        gradient,
-        projected_gradient,
-        cropping_translations + padding_translations
+        points,
+        psd_mesh if "psd_mesh" in outputs else None,
+        gradient if "vector_fields" in outputs else None,
+        projected_gradient if "vector_fields" in outputs else None,
+        cropping_translations + padding_translations - preview_offset,
+        recorder.result(),
+        psd_mesh.refinement_stats.area_error if adaptive else None
     )
-    
\ No newline at end of file
+    
+
+def get_area_sweep(
+        raw_data: np.ndarray, scale: data.Scale, c_s_values: Iterable[float],
+        dist_thresholds: Iterable[Optional[float]] = (None,), precision: str = "float64", blur_method: str = "direct"
+) -> SweepOutput:
+    """
+    Finds the surface area for every combination of c_s and dist_threshold. Gives the same areas as calling get_area
+    for each combination, but the steps that do not depend on c_s (formatting, OBB, padding, distance map, center and
+    the flat mesh) are only run once, and each c_s value only blurs and bends once for all distance thresholds.
+
+    :param raw_data: The raw data to find the surface area of. A 3D volume or the coordinates of its foreground voxels.
+                     See get_area
+    :param scale: The scale bar
+    :param c_s_values: The constants for the sigma formula to try
+    :param dist_thresholds: The distance thresholds to clip the vertices by. None is the default threshold. See get_area
+    :param precision: The floating point precision of every volumetric intermediate. See get_area
+    :param blur_method: How the distance map is blurred. See get_area
+    :return: A SweepOutput class with the area of every combination. The areas are all zero if the input data is empty
+    """
+
+    if precision not in ("float64", "float32"):
+        raise ValueError(f"precision must be 'float64' or 'float32', not {precision!r}")
+
+    if blur_method not in gaussian.METHODS:
+        raise ValueError(f"blur_method must be one of {', '.join(gaussian.METHODS)}, not {blur_method!r}")
+
+    dtype = np.dtype(precision)
+    c_s_values = np.array(list(c_s_values), dtype=np.float64)
+    dist_thresholds = list(dist_thresholds)
+    areas = np.zeros((len(c_s_values), len(dist_thresholds)))
+
+    sparse = data.is_coordinates(raw_data)
+
+    if (len(raw_data) == 0) if sparse else not np.any(raw_data):
+        logger.warning("Data is empty")
+        return SweepOutput(c_s_values, dist_thresholds, areas)
+
+    logger.info(f"Starting c_s sweep. Scale: {scale}, c_s values: {len(c_s_values)}, "
+                f"dist thresholds: {len(dist_thresholds)}, precision: {precision}")
+
+    # Steps A to E only depend on the data
+    if sparse:
+        coordinates, cropped_shape, _ = data.format_coordinates(raw_data, scale)
+        obb = bounding_box.Obb.from_voxels(coordinates, scale)
+        formatted, _ = obb.expand_coordinates(scale, coordinates, cropped_shape)
+    else:
+        formatted, _ = data.format_data(raw_data, scale)
+        obb = bounding_box.Obb(formatted, scale)
+        formatted, _ = obb.expand_data(scale, formatted)
+
+    distance_map = dist.gen_dist_map(formatted, scale, dtype)
+    distance_sampler = GridSampler(distance_map, scale)
+    center_point = center.geom_center(distance_map, scale)
+    flat_mesh = mesh.Mesh(obb, center_point, scale)
+    normal = obb.get_normal()
+
+    # cull by the largest threshold, so every vertex a threshold could keep is bent
+    if dist_thresholds:
+        default_threshold = max(scale.xy, scale.z) / 2
+        flat_mesh.cull(formatted, scale, max(t if t is not None else default_threshold for t in dist_thresholds))
+
+    for i, c_s in enumerate(c_s_values):
+        logger.info(f"Sweeping c_s = {c_s} ({i + 1}/{len(c_s_values)})")
+
+        # Steps C to H depend on c_s
+        blurred = dist.blur(distance_map, c_s, scale, method=blur_method)
+        derivative = vectors.gen_directional_derivative(blurred, scale, normal)
+        del blurred
+
+        bent_mesh = flat_mesh.copy()
+        bent_mesh.bend(derivative, scale)
+        del derivative
+
+        # Step I is the only step that depends on the distance threshold
+        for j, dist_threshold in enumerate(dist_thresholds):
+            clipped_mesh = bent_mesh.copy()
+            clipped_mesh.clip_vertices(distance_sampler, scale, dist_threshold)
+            areas[i, j] = clipped_mesh.area()
+
+    logger.info("Finished c_s sweep.")
+
+    return SweepOutput(c_s_values, dist_thresholds, areas)
@@ -0,0 +1,136 @@
+from dataclasses import dataclass
+from typing import Callable
+
+import numpy as np
+
+
+METHODS = ("bisection", "illinois")
+
+
+@dataclass(frozen=True)
+class RootStats:
+    """
+    Statistics about a call to find_roots
+    :param iterations: The number of iterations until every bracket converged
+    :param evaluations: The total number of points the function was evaluated at
+    """
+
+    iterations: int
+    evaluations: int
+
+
+def find_roots(
+        func: Callable[[np.ndarray, np.ndarray], np.ndarray], lower: np.ndarray, upper: np.ndarray, tolerance: float,
+        method: str = "illinois", max_iterations: int = 200, isolation_width: float = 0.0
+) -> tuple[np.ndarray, RootStats]:
+    """
+    Finds a root of func inside each of many brackets at once. Each bracket is dropped from the active set as soon as it
+    is narrower than the tolerance, so func is only evaluated for brackets that have not converged.
+
+    func must be non-negative at the lower end and negative at the upper end of each bracket. NaN values are treated as
+    non-negative. A bracket can hold several sign changes. Bisection then converges to the one its midpoints lead to,
+    and the Illinois method only starts once the bracket is narrower than isolation_width, so it converges to the same
+    one as long as the bracket holds a single sign change by then.
+
+    :param func: Called with (t, indices), where t are the points to evaluate and indices are the indices of the
+                 brackets that the points belong to. Returns the function values at t
+    :param lower: The lower ends of the brackets
+    :param upper: The upper ends of the brackets
+    :param tolerance: The bracket width at which a bracket is converged
+    :param method: "bisection" or "illinois". The Illinois method bisects down to isolation_width and then runs a
+                   modified regula falsi from the isolated bracket, evaluating its ends only if bisection hasn't. The
+                   bisection down to isolation_width dominates, so on the test dataset it takes about 30% fewer
+                   evaluations than bisection, not an order of magnitude fewer
+    :param max_iterations: The maximum number of iterations. Brackets that have not converged by then are returned as
+                           they are
+    :param isolation_width: With the Illinois method, brackets wider than this are bisected. Set it to the width below
+                            which func can only change sign once, e.g. a voxel for an interpolated volume
+    :return: (The midpoint of each final bracket, statistics about the search)
+    """
+
+    if method not in METHODS:
+        raise ValueError(f"method must be one of {METHODS}, not {method!r}")
+
+    lower = np.array(lower, dtype=np.float64)
+    upper = np.array(upper, dtype=np.float64)
+
+    active = np.nonzero(upper - lower > tolerance)[0]
+    evaluations = 0
+    iterations = 0
+
+    if method == "illinois":
+        # The values at the ends of the brackets. The ends are only evaluated once a bracket is isolated, and most of
+        # them have been evaluated by bisection by then
+        f_lower = np.full(len(lower), np.nan)
+        f_upper = np.full(len(upper), np.nan)
+        known_lower = np.zeros(len(lower), dtype=bool)
+        known_upper = np.zeros(len(upper), dtype=bool)
+
+        # which end of the bracket the last secant step moved. 1 = lower, -1 = upper, 0 = neither
+        last_side = np.zeros(len(lower), dtype=np.int8)
+
+    while len(active) > 0 and iterations < max_iterations:
+        iterations += 1
+
+        low = lower[active]
+        high = upper[active]
+        t = (low + high) / 2
+
+        if method == "illinois":
+            isolated = high - low <= isolation_width
+
+            for ends, known, end_values in ((lower, known_lower, f_lower), (upper, known_upper, f_upper)):
+                missing = active[isolated & ~known[active]]
+
+                if len(missing) > 0:
+                    end_values[missing] = func(ends[missing], missing)
+                    known[missing] = True
+                    evaluations += len(missing)
+
+            f_low = f_lower[active]
+            f_high = f_upper[active]
+
+            # Regula falsi where there is a valid sign change, bisection otherwise
+            with np.errstate(invalid="ignore", divide="ignore"):
+                t_secant = (low * f_high - high * f_low) / (f_high - f_low)
+
+            use_secant = isolated & (f_low > 0) & (f_high < 0) & (t_secant > low) & (t_secant < high)
+            t = np.where(use_secant, t_secant, t)
+
+        values = func(t, active)
+        evaluations += len(active)
+
+        # NaN values go to the lower end, matching the comparison below
+        is_upper = values < 0
+        is_lower = ~is_upper
+
+        lower[active[is_lower]] = t[is_lower]
+        upper[active[is_upper]] = t[is_upper]
+
+        if method == "illinois":
+            f_lower[active[is_lower]] = values[is_lower]
+            f_upper[active[is_upper]] = values[is_upper]
+            known_lower[active[is_lower]] = True
+            known_upper[active[is_upper]] = True
+
+            # Illinois modification: halve the value at the end that did not move twice in a row so the next point
+            # is pulled towards it, which makes sure both ends of the bracket converge
+            side = np.where(is_upper, -1, 1).astype(np.int8)
+            repeated = (last_side[active] == side) & use_secant
+            f_lower[active[repeated & is_upper]] /= 2
+            f_upper[active[repeated & is_lower]] /= 2
+            last_side[active] = np.where(use_secant, side, 0)
+
+        still_active = upper[active] - lower[active] > tolerance
+
+        if method == "illinois":
+            # An exact root collapses the bracket onto it. While bisecting, a zero is treated as non-negative like
+            # bisection does, since it can be a point where func touches zero without changing sign
+            exact = (values == 0) & use_secant
+            lower[active[exact]] = t[exact]
+            upper[active[exact]] = t[exact]
+            still_active &= ~exact
+
+        active = active[still_active]
+
+    return (lower + upper) / 2, RootStats(iterations, evaluations)
@@ -0,0 +1,90 @@
+import tempfile
+from typing import Iterator, Optional
+
+import numpy as np
+
+
+# the number of voxels of each chunk of z layers read at once when streaming a memory-mapped volume
+CHUNK_VOXELS = 2 ** 22
+
+
+class ScratchSpace:
+    """
+    Creates the volumes of the processing pipeline, either in memory or memory-mapped to scratch files so volumes
+    larger than the memory can be processed.
+
+    Each scratch file is an anonymous temporary file that is deleted as soon as the array mapping it is garbage
+    collected, so an intermediate is released by dropping the last reference to it and nothing is left behind if the
+    pipeline fails.
+    """
+
+    def __init__(self, directory: Optional[str] = None, chunk_voxels: int = CHUNK_VOXELS):
+        """
+        :param directory: The directory to create the scratch files in. If None, volumes are created in memory
+        :param chunk_voxels: The number of voxels of each chunk of z layers streamed by the chunked steps
+        """
+
+        if chunk_voxels < 1:
+            raise ValueError("chunk_voxels must be at least 1")
+
+        self.directory = directory
+        self.chunk_voxels = chunk_voxels
+
+    @property
+    def out_of_core(self) -> bool:
+        """
+        :return: Whether volumes are memory-mapped to scratch files
+        """
+
+        return self.directory is not None
+
+    def empty(self, shape: tuple[int, ...], dtype: np.dtype) -> np.ndarray:
+        """
+        :param shape: The shape of the volume
+        :param dtype: The dtype of the volume
+        :return: An uninitialized volume, memory-mapped if out of core. Memory-mapped volumes start zeroed
+        """
+
+        if not self.out_of_core or np.prod(shape) == 0:
+            return np.empty(shape, dtype=dtype)
+
+        # the map keeps its own handle to the file, so it outlives closing the file here
+        with tempfile.TemporaryFile(dir=self.directory) as f:
+            return np.memmap(f, dtype=dtype, mode="w+", shape=shape)
+
+    def chunk_layers(self, shape: tuple[int, ...]) -> Optional[int]:
+        """
+        :param shape: The ZYX shape of a volume
+        :return: The number of z layers of each chunk streamed by the chunked steps, or None if the volumes are in
+                 memory and are processed whole
+        """
+
+        if not self.out_of_core:
+            return None
+
+        return max(self.chunk_voxels // max(int(np.prod(shape[1:])), 1), 1)
+
+
+def z_chunks(depth: int, chunk_layers: int, halo: int = 0) -> Iterator[tuple[slice, slice, slice]]:
+    """
+    Splits z layers into chunks that are read with a halo of neighboring layers.
+
+    :param depth: The number of z layers
+    :param chunk_layers: The number of z layers of each chunk
+    :param halo: The number of layers read on each side of a chunk, clipped to the volume
+    :return: An iterator of (the layers of the chunk, the layers read, the layers of the chunk within the layers read)
+    """
+
+    if chunk_layers < 1:
+        raise ValueError("chunk_layers must be at least 1")
+
+    for z_start in range(0, depth, chunk_layers):
+        z_stop = min(z_start + chunk_layers, depth)
+        read_start = max(z_start - halo, 0)
+        read_stop = min(z_stop + halo, depth)
+
+        yield (
+            slice(z_start, z_stop),
+            slice(read_start, read_stop),
+            slice(z_start - read_start, z_stop - read_start)
+        )
@@ -1,5 +1,8 @@
+from typing import Optional
+
 import numpy as np
 
+from . import scratch
 from .data import meta
 
 
@@ -9,7 +12,7 @@ def gen_gradient(dist_map: np.ndarray, scale: meta.Scale) -> np.ndarray:
 
     :param dist_map: The data to find the gradient of
     :param scale: The scale of the data
-    :return: The gradient of the data
+    :return: The gradient of the data, with the same dtype as dist_map
     """
 
     gradient_z, gradient_y, gradient_x = np.gradient(dist_map, *scale.zyx())
@@ -22,8 +25,55 @@ def project_on_normal(gradient: np.array, normal: np.array) -> np.array:
 
     :param gradient: The gradient
     :param normal: The normal vector
-    :return: The projected gradient
+    :return: The projected gradient, with the same dtype as gradient
     """
 
+    normal = normal.astype(gradient.dtype)
     magnitudes = np.dot(gradient, normal)
     return normal * magnitudes[:, :, :, np.newaxis]
+
+
+def gen_directional_derivative(
+        dist_map: np.ndarray, scale: meta.Scale, direction: np.ndarray, out: Optional[np.ndarray] = None,
+        chunk_layers: Optional[int] = None
+) -> np.ndarray:
+    """
+    Generates the derivative of the data along a direction. Equivalent to the dot product of gen_gradient with the
+    direction, but only one gradient component is held in memory at a time instead of the full vector field.
+
+    :param dist_map: The data to find the derivative of
+    :param scale: The scale of the data
+    :param direction: The normalized direction as an XYZ vector
+    :param out: The array to write the derivative into, e.g. a memory-mapped one. Must have the shape and dtype of
+                dist_map. Requires chunk_layers
+    :param chunk_layers: If not None, the derivative is found in chunks of this many z layers, each read with one layer
+                         on each side for the central differences. Gives the same result
+    :return: The directional derivative of the data, with the same dtype as dist_map
+    """
+
+    if chunk_layers is not None:
+        if out is None:
+            out = np.empty(dist_map.shape, dtype=dist_map.dtype)
+        elif out.shape != dist_map.shape or out.dtype != dist_map.dtype:
+            raise ValueError(f"out must have shape {dist_map.shape} and dtype {dist_map.dtype}")
+
+        for chunk, read, core in scratch.z_chunks(dist_map.shape[0], chunk_layers, halo=1):
+            out[chunk] = gen_directional_derivative(np.asarray(dist_map[read]), scale, direction)[core]
+
+        return out
+
+    if out is not None:
+        raise ValueError("out requires chunk_layers")
+
+    derivative = np.zeros_like(dist_map)
+
+    # np.gradient's axes are in ZYX order
+    for axis, (spacing, component) in enumerate(zip(scale.zyx(), direction[::-1])):
+        if component == 0:
+            continue
+
+        partial = np.gradient(dist_map, spacing, axis=axis)
+        partial *= component
+        derivative += partial
+
+    return derivative
@@ -56,6 +56,50 @@ def algorithm_output(c_s=0.67, dist_threshold: Optional[float] = None, verbose=F
     return algorithm_output_dict
 
 
+def algorithm_output_sweep(c_s_values, dist_thresholds=(None,), verbose=False):
+    """
+    Calculates the algorithm's output for every combination of c_s and dist_threshold using processing.get_area_sweep,
+    which is much faster than calling algorithm_output for each combination.
+    :param c_s_values: The constants for the sigma formula
+    :param dist_thresholds: The distance thresholds to clip each vertex in the final step. None is the default threshold
+    :param verbose: Whether to print progress
+    :return: Dictionary: {(c_s, dist_threshold): {filename: {"area": algorithm_area, "time": time_taken}}}, the same
+             format as algorithm_output for each combination. The time is the file's sweep time split evenly across
+             the combinations
+    """
+
+    c_s_values = list(c_s_values)
+    dist_thresholds = list(dist_thresholds)
+    sweep_output_dict = {(c_s, dist_threshold): {} for c_s in c_s_values for dist_threshold in dist_thresholds}
+
+    files = [
+        file for file in os.listdir(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../data/test"))
+        if file.endswith(".npy")
+    ]
+
+    for i, file in enumerate(files):
+        if verbose:
+            print(f"Processing file {i + 1}/{len(files)}: {file}")
+
+        start = time.perf_counter()
+        output = processing.get_area_sweep(
+            np.load(os.path.join(os.path.dirname(os.path.abspath(__file__)), f"../data/test/{file}")),
+            meta.Scale(5.03, 42.017),
+            c_s_values,
+            dist_thresholds
+        )
+        end = time.perf_counter()
+
+        areas = output.area_microns()
+        time_per_combination = (end - start) / areas.size
+
+        for j, c_s in enumerate(c_s_values):
+            for k, dist_threshold in enumerate(dist_thresholds):
+                sweep_output_dict[(c_s, dist_threshold)][file] = {"area": areas[j, k], "time": time_per_combination}
+
+    return sweep_output_dict
+
+
 def summary_stats(alg_output, ground_truths, compare_column_name):
     """
     Calculate the total accuracy of the algorithm
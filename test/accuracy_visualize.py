@@ -52,8 +52,8 @@ class VisTester:
         output = self.outputs[index]
         
         vis.clear_geometries()
-        vis.add_geometry(output.obb.o3d_obb)
-        vis.add_geometry(output.psd_mesh.mesh)
+        vis.add_geometry(output.obb.to_o3d())
+        vis.add_geometry(output.psd_mesh.to_o3d())
         vis.add_geometry(o3d.geometry.PointCloud(o3d.utility.Vector3dVector(output.points)))
         
         vis.reset_view_point(True)
@@ -0,0 +1,99 @@
+"""
+Compares the blur methods of gaussian.gaussian_blur against the exact truncated Gaussian ("direct") over the test
+dataset. Shows the largest blur error as a percentage of the range of the blurred distance map, the blur time and the
+area difference for each c_s.
+"""
+
+import os
+import time
+
+import numpy as np
+import tabulate
+
+from processing import bounding_box
+from processing import data
+from processing import dist
+from processing import processing
+from processing.data import meta
+
+SCALE = meta.Scale(5.03, 42.017)
+C_S_VALUES = (0.2, 0.67)
+METHODS = ("box", "auto")
+
+
+def padded_dist_map(raw_data: np.ndarray) -> np.ndarray:
+    """
+    :param raw_data: The PSD
+    :return: The distance map the pipeline blurs
+    """
+
+    formatted, _ = data.format_data(raw_data, SCALE)
+    obb = bounding_box.Obb(formatted, SCALE)
+    formatted, _ = obb.expand_data(SCALE, formatted)
+
+    return dist.gen_dist_map(formatted, SCALE)
+
+
+def timed_blur(dist_map: np.ndarray, c_s: float, method: str) -> tuple[np.ndarray, float]:
+    """
+    :return: (the blurred distance map, time taken)
+    """
+
+    start = time.perf_counter()
+    blurred = dist.blur(dist_map, c_s, SCALE, method=method)
+    end = time.perf_counter()
+
+    return blurred, end - start
+
+
+def main():
+    test_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../data/test")
+    files = sorted(file for file in os.listdir(test_dir) if file.endswith(".npy"))
+
+    table_rows = []
+    area_diffs = {method: [] for method in METHODS}
+
+    for file in files:
+        raw_data = np.load(os.path.join(test_dir, file))
+        dist_map = padded_dist_map(raw_data)
+
+        for c_s in C_S_VALUES:
+            sigmas = dist.gen_sigmas(c_s, np.max(dist_map), SCALE)
+            direct, direct_time = timed_blur(dist_map, c_s, "direct")
+            direct_area = processing.get_area(raw_data, SCALE, c_s=c_s, blur_method="direct").area_microns()
+
+            for method in METHODS:
+                blurred, method_time = timed_blur(dist_map, c_s, method)
+                blur_error = np.max(np.abs(blurred - direct)) / np.ptp(direct) * 100
+
+                area = processing.get_area(raw_data, SCALE, c_s=c_s, blur_method=method).area_microns()
+                area_diff = (area - direct_area) / direct_area * 100 if direct_area != 0 else 0
+                area_diffs[method].append(abs(area_diff))
+
+                table_rows.append([
+                    file,
+                    c_s,
+                    ", ".join(f"{sigma:.1f}" for sigma in sigmas),
+                    method,
+                    f"{blur_error:.4f}%",
+                    f"{direct_time * 1000:.1f}ms",
+                    f"{method_time * 1000:.1f}ms",
+                    f"{direct_area:.6f} μm²",
+                    f"{area:.6f} μm²",
+                    f"{area_diff:.3f}%"
+                ])
+
+    table_header = [
+        "File", "c_s", "Sigmas (ZYX)", "Method", "Max Blur Error", "Direct Time", "Method Time", "Direct Area",
+        "Method Area", "% Difference"
+    ]
+    print(tabulate.tabulate(table_rows, headers=table_header, tablefmt="orgtbl"))
+
+    print("\n")
+    for method in METHODS:
+        print(f"{method}: max relative area difference {max(area_diffs[method]):.3f}%, "
+              f"mean {np.mean(area_diffs[method]):.3f}%")
+
+
+if __name__ == "__main__":
+    main()
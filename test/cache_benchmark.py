@@ -0,0 +1,89 @@
+"""
+Benchmarks the PipelineCache over the test dataset. Each PSD is processed once with an empty cache and again with the
+cache filled, with the default settings and with other blur and mesh settings that reuse the same entry. Shows the
+time of the cold and warm runs, the time of the OBB, distance map and center steps, and whether the areas are identical.
+"""
+
+import logging
+import os
+import tempfile
+import time
+
+import numpy as np
+import tabulate
+
+from log import logger
+from processing import processing
+from processing.cache import PipelineCache
+from processing.data import meta
+
+SCALE = meta.Scale(5.03, 42.017)
+SETTINGS = {
+    "default": dict(),
+    "c_s=0.3": dict(c_s=0.3),
+    "float32": dict(precision="float32")
+}
+CACHED_STAGES = ("obb", "dist_map", "center")
+
+
+def run(raw_data: np.ndarray, cache: PipelineCache, **kwargs) -> tuple[processing.PancakeOutput, float]:
+    start = time.perf_counter()
+    output = processing.get_area(raw_data, SCALE, cache=cache, collect_metrics=True, **kwargs)
+
+    return output, time.perf_counter() - start
+
+
+def cached_stage_time(output: processing.PancakeOutput) -> float:
+    return sum(stage.wall_time for stage in output.metrics.stages if stage.name in CACHED_STAGES)
+
+
+def main():
+    logger.setLevel(logging.WARNING)
+
+    test_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../data/test")
+    files = sorted(file for file in os.listdir(test_dir) if file.endswith(".npy"))
+
+    table_rows = []
+    speedups = []
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = PipelineCache(cache_dir)
+
+        for name, settings in SETTINGS.items():
+            cache.clear()
+
+            for file in files:
+                raw_data = np.load(os.path.join(test_dir, file))
+
+                cold, cold_time = run(raw_data, cache, **settings)
+                warm, warm_time = run(raw_data, cache, **settings)
+
+                speedups.append(cold_time / warm_time)
+
+                table_rows.append([
+                    file,
+                    name,
+                    f"{cold_time:.4f}s",
+                    f"{warm_time:.4f}s",
+                    f"{cached_stage_time(cold):.4f}s",
+                    f"{cached_stage_time(warm) + warm.metrics.stage('cache_load').wall_time:.4f}s",
+                    f"{cold.metrics.stage('cache_store').wall_time:.4f}s",
+                    warm.metrics.counters["cache_hits"],
+                    cold.area_nm == warm.area_nm
+                ])
+
+        stats = cache.stats()
+
+    table_header = [
+        "File", "Settings", "Cold Time", "Warm Time", "Cold OBB to Center", "Warm OBB to Center", "Store Time",
+        "Warm Hits", "Identical Area"
+    ]
+    print(tabulate.tabulate(table_rows, headers=table_header, tablefmt="orgtbl"))
+
+    print("\n")
+    print(f"mean speedup {np.mean(speedups):.2f}x, max {np.max(speedups):.2f}x")
+    print(stats)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Benchmarks culling the mesh before bending it (get_area(cull=True)) against bending every vertex, over the test dataset
+and a synthetic crescent-shaped PSD, which only covers a small part of its OBB. Shows the number of vertices bent, the
+number of derivative samples and the time of the bend step. The areas must be identical.
+"""
+
+import os
+
+import numpy as np
+import tabulate
+
+from processing import processing
+from processing.data import meta
+
+SCALE = meta.Scale(5.03, 42.017)
+
+
+def crescent(radius: float = 600, width: float = 120, thickness: float = 60) -> np.ndarray:
+    """
+    :param radius: The outer radius of the crescent in nm
+    :param width: The width of the crescent in nm
+    :param thickness: The thickness of the crescent along z in nm
+    :return: A flat crescent, the part of a disk outside a second disk shifted by width
+    """
+
+    size = int(2 * radius / SCALE.xy) + 4
+    layers = int(thickness / SCALE.z) + 1
+    y, x = (np.indices((size, size)) - size / 2) * SCALE.xy
+
+    outer = x ** 2 + y ** 2 < radius ** 2
+    inner = (x - width) ** 2 + y ** 2 < radius ** 2
+
+    return np.repeat((outer & ~inner)[np.newaxis], layers, axis=0)
+
+
+def run(raw_data: np.ndarray, cull: bool) -> processing.PancakeOutput:
+    return processing.get_area(raw_data, SCALE, c_s=0.2, cull=cull, collect_metrics=True)
+
+
+def main():
+    test_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../data/test")
+    files = sorted(file for file in os.listdir(test_dir) if file.endswith(".npy"))
+    psds = [(file, np.load(os.path.join(test_dir, file))) for file in files] + [("crescent", crescent())]
+
+    table_rows = []
+    all_equal = True
+
+    for name, raw_data in psds:
+        full = run(raw_data, cull=False)
+        culled = run(raw_data, cull=True)
+
+        all_equal &= full.area_nm == culled.area_nm
+
+        table_rows.append([
+            name,
+            f"{full.metrics.counters['mesh_vertices']:,}",
+            f"{culled.metrics.counters['culled_vertices']:,}",
+            f"{culled.metrics.counters['final_vertices']:,}",
+            f"{full.metrics.counters['bend_evaluations']:,}",
+            f"{culled.metrics.counters['bend_evaluations']:,}",
+            f"{full.metrics.stage('bend').wall_time:.4f}s",
+            f"{culled.metrics.stage('bend').wall_time + culled.metrics.stage('cull').wall_time:.4f}s",
+            f"{full.area_microns():.6f} μm²",
+            f"{culled.area_microns():.6f} μm²"
+        ])
+
+    table_header = [
+        "PSD", "Vertices", "After Cull", "After Clip", "Samples", "Culled Samples", "Bend Time", "Cull + Bend Time",
+        "Area", "Culled Area"
+    ]
+    print(tabulate.tabulate(table_rows, headers=table_header, tablefmt="orgtbl"))
+
+    print("\n")
+    print(f"Identical areas: {all_equal}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Benchmarks the adaptive mesh (get_area(mesh_spacing="auto")) against the mesh with a fixed spacing of the smallest voxel
+side, over the test dataset and a synthetic dome-shaped PSD. Shows the spacing of each level, the number of vertices bent
+and interpolated, the number of derivative samples, the time of the bend step, the area difference to the fixed mesh,
+the estimated discretisation error of the adaptive area and whether it met the tolerance before the finest spacing.
+"""
+
+import logging
+import os
+
+import numpy as np
+import tabulate
+
+from log import logger
+from processing import processing
+from processing.data import meta
+
+SCALE = meta.Scale(5.03, 42.017)
+TOLERANCES = (0.005, 0.02)
+
+
+def dome(radius: float = 600, curvature_radius: float = 900, thickness: float = 60) -> np.ndarray:
+    """
+    :param radius: The radius of the dome in nm, seen from above
+    :param curvature_radius: The radius of curvature of the dome in nm
+    :param thickness: The thickness of the dome along z in nm
+    :return: A curved disk, the part of a paraboloid shell inside a cylinder
+    """
+
+    size = int(2 * radius / SCALE.xy) + 4
+    layers = int((radius ** 2 / (2 * curvature_radius) + thickness) / SCALE.z) + 4
+    z, y, x = np.indices((layers, size, size)).astype(np.float64)
+
+    x = (x - size / 2) * SCALE.xy
+    y = (y - size / 2) * SCALE.xy
+    z *= SCALE.z
+
+    r_squared = x ** 2 + y ** 2
+    surface = r_squared / (2 * curvature_radius) + thickness
+
+    return (r_squared < radius ** 2) & (np.abs(z - surface) < thickness / 2)
+
+
+def run(raw_data: np.ndarray, **kwargs) -> processing.PancakeOutput:
+    return processing.get_area(raw_data, SCALE, c_s=0.2, collect_metrics=True, **kwargs)
+
+
+def main():
+    # whether the adaptive mesh converged is shown in the table instead of warned about
+    logger.setLevel(logging.ERROR)
+
+    test_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../data/test")
+    files = sorted(file for file in os.listdir(test_dir) if file.endswith(".npy"))
+    psds = [(file, np.load(os.path.join(test_dir, file))) for file in files] + [("dome", dome())]
+
+    table_rows = []
+    area_diffs = {tolerance: [] for tolerance in TOLERANCES}
+
+    for name, raw_data in psds:
+        fixed = run(raw_data)
+
+        for tolerance in TOLERANCES:
+            adaptive = run(raw_data, mesh_spacing="auto", mesh_tolerance=tolerance)
+            stats = adaptive.psd_mesh.refinement_stats
+
+            area_diff = (adaptive.area_nm - fixed.area_nm) / fixed.area_nm * 100 if fixed.area_nm != 0 else 0
+            area_diffs[tolerance].append(abs(area_diff))
+
+            table_rows.append([
+                name,
+                tolerance,
+                ", ".join(f"{spacing:g}" for spacing in stats.spacings),
+                f"{fixed.metrics.counters['culled_vertices']:,}",
+                f"{stats.bent_vertices:,}",
+                f"{stats.interpolated_vertices:,}",
+                f"{fixed.metrics.counters['bend_evaluations']:,}",
+                f"{adaptive.metrics.counters['bend_evaluations']:,}",
+                f"{fixed.metrics.stage('bend').wall_time + fixed.metrics.stage('cull').wall_time:.4f}s",
+                f"{adaptive.metrics.stage('bend').wall_time:.4f}s",
+                f"{fixed.area_microns():.6f} μm²",
+                f"{adaptive.area_microns():.6f} μm²",
+                f"{area_diff:.3f}%",
+                f"{adaptive.area_error_nm / adaptive.area_nm * 100:.3f}%",
+                stats.converged
+            ])
+
+    table_header = [
+        "PSD", "Tolerance", "Spacings (nm)", "Fixed Bent", "Adaptive Bent", "Interpolated", "Fixed Samples",
+        "Adaptive Samples", "Fixed Bend Time", "Adaptive Bend Time", "Fixed Area", "Adaptive Area", "% Difference",
+        "Estimated Error", "Converged"
+    ]
+    print(tabulate.tabulate(table_rows, headers=table_header, tablefmt="orgtbl"))
+
+    print("\n")
+    for tolerance in TOLERANCES:
+        print(f"tolerance {tolerance}: max relative area difference {max(area_diffs[tolerance]):.3f}%, "
+              f"mean {np.mean(area_diffs[tolerance]):.3f}%")
+
+
+if __name__ == "__main__":
+    main()
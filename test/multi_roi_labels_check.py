@@ -0,0 +1,96 @@
+"""
+Checks labels.iter_multi_roi_labels with a stand-in for a Dragonfly MultiROI, since ORS is only available inside
+Dragonfly. The PSDs of the test dataset are placed at different offsets in one label volume, with one more label than
+PSDs so the last label is empty. Shows, for each label, whether its cropped volume matches the PSD and whether its
+translations move it back to where it was placed. Exits with 1 if any label doesn't match or the label volume was read
+more than once.
+"""
+
+import os
+import sys
+
+import numpy as np
+import tabulate
+
+from processing import data
+from processing import labels
+
+SCALE = data.Scale(5.03, 42.017)
+
+# the empty voxels between two PSDs along x
+GAP = 3
+
+
+class FakeMultiROI:
+    """
+    Provides the methods of an ORS MultiROI that labels.iter_multi_roi_labels calls, and counts how often the label
+    volume is read
+    """
+
+    def __init__(self, label_data: np.ndarray, label_count: int):
+        self.label_data = label_data
+        self.label_count = label_count
+        self.reads = 0
+
+    def getAsNDArray(self) -> np.ndarray:
+        self.reads += 1
+
+        return self.label_data
+
+    def getLabelCount(self) -> int:
+        return self.label_count
+
+
+def main():
+    test_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../data/test")
+    files = sorted(file for file in os.listdir(test_dir) if file.endswith(".npy"))
+    psds = [data.format_data(np.load(os.path.join(test_dir, file)), SCALE)[0] for file in files]
+
+    # the ZYX index of the first voxel of each PSD in the label volume
+    offsets = []
+    x = GAP
+
+    for index, psd in enumerate(psds):
+        offsets.append(np.array([1 + index, 2 + index, x]))
+        x += psd.shape[2] + GAP
+
+    shape = np.max([offset + psd.shape for offset, psd in zip(offsets, psds)], axis=0) + GAP
+    label_data = np.zeros(shape, dtype=np.uint16)
+
+    for label, (offset, psd) in enumerate(zip(offsets, psds), start=1):
+        region = tuple(slice(start, start + size) for start, size in zip(offset, psd.shape))
+        label_data[region][psd] = label
+
+    multi_roi = FakeMultiROI(label_data, len(psds) + 1)
+
+    table_rows = []
+    passed = True
+
+    for label, cropped, translations in labels.iter_multi_roi_labels(multi_roi, SCALE):
+        if label <= len(psds):
+            name = files[label - 1]
+            same_volume = np.array_equal(cropped, psds[label - 1])
+            # the translations move the cropped volume back to its offset in the label volume
+            same_translations = np.allclose(translations, -offsets[label - 1][::-1] * SCALE.xyz())
+        else:
+            name = "(empty)"
+            same_volume = not np.any(cropped)
+            same_translations = np.array_equal(translations, np.zeros(3))
+
+        passed &= same_volume and same_translations
+
+        table_rows.append([label, name, cropped.shape, same_volume, same_translations])
+
+    table_header = ["Label", "PSD", "Cropped Shape", "Same Volume", "Same Translations"]
+    print(tabulate.tabulate(table_rows, headers=table_header, tablefmt="orgtbl"))
+
+    print("\n")
+    print(f"{len(table_rows)} labels of {multi_roi.getLabelCount()}, label volume read {multi_roi.reads} time(s)")
+
+    if len(table_rows) != multi_roi.getLabelCount() or multi_roi.reads != 1 or not passed:
+        print("FAILED")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
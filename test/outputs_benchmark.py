@@ -0,0 +1,73 @@
+"""
+Benchmarks the optional outputs of the processing pipeline (get_area(outputs)) over the test dataset. Each PSD is
+processed with the default outputs, with only the mesh as a batch worker does, and with only the area. Shows the time of
+the pipeline, the time of the points step and the pickled size of the PancakeOutput, as a measure of the memory it holds
+on to, and checks that the areas are the same.
+"""
+
+import logging
+import os
+import pickle
+import time
+
+import numpy as np
+import tabulate
+
+from log import logger
+from processing import processing
+from processing.data import meta
+
+SCALE = meta.Scale(5.03, 42.017)
+OUTPUTS = {
+    "default": None,
+    "mesh only": ("psd_mesh",),
+    "area only": ()
+}
+
+
+def main():
+    logger.setLevel(logging.WARNING)
+
+    test_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../data/test")
+    files = sorted(file for file in os.listdir(test_dir) if file.endswith(".npy"))
+
+    table_rows = []
+    size_ratios = []
+
+    for file in files:
+        raw_data = np.load(os.path.join(test_dir, file))
+        default_area = None
+        default_size = None
+
+        for name, outputs in OUTPUTS.items():
+            start = time.perf_counter()
+            output = processing.get_area(raw_data, SCALE, collect_metrics=True, outputs=outputs)
+            end = time.perf_counter()
+
+            points_stage = output.metrics.stage("points")
+            size = len(pickle.dumps(output))
+
+            if outputs is None:
+                default_area = output.area_nm
+                default_size = size
+            else:
+                size_ratios.append(default_size / size)
+
+            table_rows.append([
+                file,
+                name,
+                f"{end - start:.4f}s",
+                f"{points_stage.wall_time:.4f}s" if points_stage is not None else "-",
+                f"{size / 1e6:.3f} MB",
+                output.area_nm == default_area
+            ])
+
+    table_header = ["File", "Outputs", "Time", "Points Time", "Output Size", "Same Area"]
+    print(tabulate.tabulate(table_rows, headers=table_header, tablefmt="orgtbl"))
+
+    print("\n")
+    print(f"the outputs are {np.min(size_ratios):.1f} to {np.max(size_ratios):.1f} times smaller than the default")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Compares the float32 precision mode of the processing pipeline to the default float64 mode over the test dataset. Shows
+the area error paid for the peak memory savings of float32 and the time of both modes.
+"""
+
+import os
+import time
+
+import numpy as np
+import tabulate
+
+from processing import processing
+from processing.data import meta
+
+
+def precision_output(precision: str, c_s=0.67, verbose=False):
+    """
+    Runs the algorithm on every file in the test dataset with the given precision.
+
+    :param precision: The precision to pass to processing.get_area
+    :param c_s: The constant for the sigma formula
+    :param verbose: Whether to print progress
+    :return: Dictionary: {filename: {"area": algorithm_area, "time": time_taken}}
+    """
+
+    output_dict = {}
+
+    test_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../data/test")
+    files = sorted(file for file in os.listdir(test_dir) if file.endswith(".npy"))
+
+    for i, file in enumerate(files):
+        if verbose:
+            print(f"Processing file {i + 1}/{len(files)} ({precision}): {file}")
+
+        raw_data = np.load(os.path.join(test_dir, file))
+
+        start = time.perf_counter()
+        output = processing.get_area(raw_data, meta.Scale(5.03, 42.017), c_s=c_s, precision=precision)
+        end = time.perf_counter()
+
+        output_dict[file] = {"area": output.area_nm / 1e6, "time": end - start}
+
+    return output_dict
+
+
+def main():
+    float64_output = precision_output("float64", c_s=0.2, verbose=True)
+    float32_output = precision_output("float32", c_s=0.2, verbose=True)
+
+    table_rows = []
+    abs_diffs = []
+    rel_diffs = []
+
+    for file, reference in float64_output.items():
+        reduced = float32_output[file]
+
+        abs_diff = reduced["area"] - reference["area"]
+        rel_diff = abs_diff / reference["area"] * 100 if reference["area"] != 0 else 0
+
+        abs_diffs.append(abs(abs_diff))
+        rel_diffs.append(abs(rel_diff))
+
+        table_rows.append([
+            file,
+            f"{reference['area']:.6f} μm²",
+            f"{reduced['area']:.6f} μm²",
+            f"{abs_diff:.2e} μm²",
+            f"{rel_diff:.4f}%",
+            f"{reference['time']:.4f}s",
+            f"{reduced['time']:.4f}s"
+        ])
+
+    table_header = ["File", "float64 Area", "float32 Area", "Difference", "% Difference", "float64 Time", "float32 Time"]
+    print(tabulate.tabulate(table_rows, headers=table_header, tablefmt="orgtbl"))
+
+    print("\n")
+    print(f"Max absolute difference: {max(abs_diffs):.2e} μm²")
+    print(f"Max relative difference: {max(rel_diffs):.4f}%")
+    print(f"Mean relative difference: {np.mean(rel_diffs):.4f}%")
+    print(f"Total float64 time: {sum(output['time'] for output in float64_output.values()):.4f}s")
+    print(f"Total float32 time: {sum(output['time'] for output in float32_output.values()):.4f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Characterises the preview mode (get_area(preview_factor)) over the test dataset. Shows the area found on the PSD
+downsampled along x and y against the full resolution area, and how much faster the preview is, for several c_s and
+downsampling factors.
+"""
+
+import os
+import time
+
+import numpy as np
+import tabulate
+
+from processing import processing
+from processing.data import meta
+
+SCALE = meta.Scale(5.03, 42.017)
+C_S_VALUES = (0.2, 0.3, 0.67)
+FACTORS = (2, processing.PREVIEW_FACTOR, 8)
+
+
+def timed_area(raw_data: np.ndarray, c_s: float, preview_factor: int) -> tuple[float, float]:
+    """
+    :return: (the area in μm², time taken)
+    """
+
+    start = time.perf_counter()
+    area = processing.get_area(raw_data, SCALE, c_s=c_s, preview_factor=preview_factor).area_microns()
+    end = time.perf_counter()
+
+    return area, end - start
+
+
+def main():
+    test_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../data/test")
+    files = sorted(file for file in os.listdir(test_dir) if file.endswith(".npy"))
+
+    table_rows = []
+    area_diffs = {(factor, c_s): [] for factor in FACTORS for c_s in C_S_VALUES}
+    speedups = {factor: [] for factor in FACTORS}
+
+    for file in files:
+        raw_data = np.load(os.path.join(test_dir, file))
+
+        for c_s in C_S_VALUES:
+            full_area, full_time = timed_area(raw_data, c_s, 1)
+
+            for factor in FACTORS:
+                preview_area, preview_time = timed_area(raw_data, c_s, factor)
+
+                area_diff = (preview_area - full_area) / full_area * 100 if full_area != 0 else 0
+                area_diffs[factor, c_s].append(area_diff)
+                speedups[factor].append(full_time / preview_time)
+
+                table_rows.append([
+                    file,
+                    c_s,
+                    factor,
+                    f"{full_area:.6f} μm²",
+                    f"{preview_area:.6f} μm²",
+                    f"{area_diff:.2f}%",
+                    f"{full_time * 1000:.1f}ms",
+                    f"{preview_time * 1000:.1f}ms",
+                    f"{full_time / preview_time:.1f}x"
+                ])
+
+    table_header = [
+        "File", "c_s", "Factor", "Full Area", "Preview Area", "% Difference", "Full Time", "Preview Time", "Speedup"
+    ]
+    print(tabulate.tabulate(table_rows, headers=table_header, tablefmt="orgtbl"))
+
+    print("\n")
+    summary_rows = [
+        [
+            factor,
+            c_s,
+            f"{np.mean(area_diffs[factor, c_s]):.2f}%",
+            f"{np.max(np.abs(area_diffs[factor, c_s])):.2f}%",
+            f"{np.mean(speedups[factor]):.1f}x"
+        ]
+        for factor in FACTORS for c_s in C_S_VALUES
+    ]
+    print(tabulate.tabulate(
+        summary_rows, headers=["Factor", "c_s", "Mean Difference", "Max |Difference|", "Mean Speedup"],
+        tablefmt="orgtbl"
+    ))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Checks that bending the mesh with the Illinois method (the default of Mesh.bend) finds the same surface as bisection,
+over the test dataset and a stack of tiled copies of a PSD, whose rays cross several sheets of the surface. Shows the
+number of derivative samples of each method, the number of vertices whose heights differ by more than the smallest voxel
+side, and the area difference. Exits with 1 if any area differs by more than MAX_AREA_DIFF.
+"""
+
+import logging
+import os
+import sys
+
+import numpy as np
+import tabulate
+
+from log import logger
+from processing import center
+from processing import data
+from processing import dist
+from processing import mesh
+from processing import vectors
+from processing.bounding_box import Obb
+from processing.sampling import GridSampler
+
+SCALE = data.Scale(5.03, 42.017)
+C_S_VALUES = (0.2, 0.67)
+
+# the largest relative area difference allowed between the methods. Heights within the tolerance of each other can
+# still fall on different sides of the clipping threshold
+MAX_AREA_DIFF = 1e-3
+
+
+def bend_both(raw_data: np.ndarray, c_s: float) -> tuple[mesh.Mesh, mesh.Mesh]:
+    """
+    :return: The mesh of the PSD bent with bisection and with the Illinois method, before clipping
+    """
+
+    formatted, _ = data.format_data(raw_data, SCALE)
+    obb = Obb(formatted, SCALE)
+    formatted, _ = obb.expand_data(SCALE, formatted)
+
+    distance_map = dist.gen_dist_map(formatted, SCALE)
+    flat_mesh = mesh.Mesh(obb, center.geom_center(distance_map, SCALE), SCALE)
+    flat_mesh.cull(formatted, SCALE, max(SCALE.xy, SCALE.z) / 2)
+
+    derivative = vectors.gen_directional_derivative(dist.blur(distance_map, c_s, SCALE), SCALE, obb.get_normal())
+    distance_sampler = GridSampler(distance_map, SCALE)
+
+    meshes = []
+
+    for method in ("bisection", "illinois"):
+        bent_mesh = flat_mesh.copy()
+        bent_mesh.bend(derivative, SCALE, method=method)
+        meshes.append(bent_mesh)
+
+    for bent_mesh in meshes:
+        bent_mesh.clip_vertices(distance_sampler, SCALE)
+
+    return meshes[0], meshes[1]
+
+
+def main():
+    logger.setLevel(logging.WARNING)
+
+    test_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../data/test")
+    files = sorted(file for file in os.listdir(test_dir) if file.endswith(".npy"))
+    psds = [(file, np.load(os.path.join(test_dir, file)), C_S_VALUES) for file in files]
+
+    # rays through a stack of copies cross a sheet of the surface in every copy. At larger c_s, the blur is wider than
+    # the gaps between the copies and every vertex is clipped
+    tiled = np.pad(np.tile(np.load(os.path.join(test_dir, "synth2.npy")), (2, 3, 3)), 5)
+    psds.append(("synth2.npy tiled (2, 3, 3)", tiled, (0.2,)))
+
+    table_rows = []
+    max_area_diff = 0
+
+    for name, raw_data, c_s_values in psds:
+        for c_s in c_s_values:
+            bisection, illinois = bend_both(raw_data, c_s)
+
+            height_diffs = np.abs(bisection.heights - illinois.heights)[bisection.valid & illinois.valid]
+            area_diff = abs(illinois.area() - bisection.area()) / bisection.area()
+            max_area_diff = max(max_area_diff, area_diff)
+
+            table_rows.append([
+                name,
+                c_s,
+                f"{bisection.bend_stats.evaluations:,}",
+                f"{illinois.bend_stats.evaluations:,}",
+                np.count_nonzero(height_diffs > min(SCALE.xy, SCALE.z)),
+                f"{bisection.area():.2f} nm²",
+                f"{illinois.area():.2f} nm²",
+                f"{area_diff * 100:.5f}%"
+            ])
+
+    table_header = [
+        "PSD", "c_s", "Bisection Samples", "Illinois Samples", "Vertices Off By A Voxel", "Bisection Area",
+        "Illinois Area", "% Difference"
+    ]
+    print(tabulate.tabulate(table_rows, headers=table_header, tablefmt="orgtbl"))
+
+    print("\n")
+    print(f"max relative area difference {max_area_diff * 100:.5f}%")
+
+    if max_area_diff > MAX_AREA_DIFF:
+        print(f"FAILED: larger than {MAX_AREA_DIFF * 100:g}%")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Benchmarks processing.sampling.GridSampler against scipy's RegularGridInterpolator (which the mesh used to sample the
+distance map and gradient with) on the distance maps of the test dataset.
+"""
+
+import os
+import time
+
+import numpy as np
+import tabulate
+from scipy import interpolate
+
+from processing import bounding_box
+from processing import dist
+from processing import sampling
+from processing.data import meta
+from processing import data
+
+
+def get_rgi(volume: np.ndarray, scale: meta.Scale) -> interpolate.RegularGridInterpolator:
+    """
+    Builds a RegularGridInterpolator on the same grid as GridSampler.
+
+    :param volume: The volume to interpolate
+    :param scale: The voxel spacing
+    :return: The regular grid interpolator
+    """
+
+    x = np.linspace(0, volume.shape[2] * scale.xy, volume.shape[2]) - scale.xy / 2
+    y = np.linspace(0, volume.shape[1] * scale.xy, volume.shape[1]) - scale.xy / 2
+    z = np.linspace(0, volume.shape[0] * scale.z, volume.shape[0]) - scale.z / 2
+
+    return interpolate.RegularGridInterpolator(
+        (z, y, x), volume, bounds_error=False, fill_value=np.nan, method="linear"
+    )
+
+
+def benchmark(volume: np.ndarray, scale: meta.Scale, num_points: int, repeats: int):
+    """
+    Times both interpolators on the same random points, some of which are outside the grid.
+
+    :param volume: The volume to sample
+    :param scale: The voxel spacing
+    :param num_points: The number of points per call
+    :param repeats: The number of calls to time
+    :return: (RGI time per call, sampler time per call, max absolute difference)
+    """
+
+    rng = np.random.default_rng(0)
+    extent = np.array(volume.shape) * scale.zyx()
+    points = rng.uniform(-0.05, 1.05, size=(num_points, 3)) * extent
+
+    start = time.perf_counter()
+    rgi = get_rgi(volume, scale)
+    for _ in range(repeats):
+        expected = rgi(points)
+    rgi_time = (time.perf_counter() - start) / repeats
+
+    start = time.perf_counter()
+    sampler = sampling.GridSampler(volume, scale)
+    for _ in range(repeats):
+        actual = sampler(points)
+    sampler_time = (time.perf_counter() - start) / repeats
+
+    if not np.array_equal(np.isnan(expected), np.isnan(actual)):
+        raise ValueError("The interpolators disagree on which points are outside the grid")
+
+    return rgi_time, sampler_time, np.nanmax(np.abs(expected - actual))
+
+
+def main():
+    scale = meta.Scale(5.03, 42.017)
+    test_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../data/test")
+    files = sorted(file for file in os.listdir(test_dir) if file.endswith(".npy"))
+
+    table_rows = []
+
+    for file in files:
+        formatted, _ = data.format_data(np.load(os.path.join(test_dir, file)), scale)
+        obb = bounding_box.Obb(formatted, scale)
+        formatted, _ = obb.expand_data(scale, formatted)
+        distance_map = dist.gen_dist_map(formatted, scale)
+
+        for dtype in (np.float64, np.float32):
+            rgi_time, sampler_time, max_diff = benchmark(distance_map.astype(dtype), scale, 100_000, 20)
+
+            table_rows.append([
+                file,
+                np.dtype(dtype).name,
+                f"{distance_map.size:,}",
+                f"{rgi_time * 1000:.2f}ms",
+                f"{sampler_time * 1000:.2f}ms",
+                f"{rgi_time / sampler_time:.2f}x",
+                f"{max_diff:.2e}"
+            ])
+
+    table_header = ["File", "dtype", "Voxels", "RGI Time", "Sampler Time", "Speedup", "Max Difference (nm)"]
+    print(tabulate.tabulate(table_rows, headers=table_header, tablefmt="orgtbl"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""
+Profiles each step of the processing pipeline over the test dataset using the metrics recorded by
+processing.get_area(collect_metrics=True). Shows which step is the bottleneck for each PSD size.
+"""
+
+import os
+
+import numpy as np
+import tabulate
+
+from processing import metrics
+from processing import processing
+from processing.data import meta
+
+
+def main():
+    test_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../data/test")
+    files = sorted(file for file in os.listdir(test_dir) if file.endswith(".npy"))
+
+    outputs = []
+    table_rows = []
+
+    for file in files:
+        output = processing.get_area(
+            np.load(os.path.join(test_dir, file)), meta.Scale(5.03, 42.017), c_s=0.2, collect_metrics=True
+        )
+        outputs.append(output.metrics)
+
+        bottleneck = output.metrics.bottleneck()
+        stage_times = [f"{stage.name} {stage.wall_time * 1000:.1f}ms" for stage in output.metrics.stages]
+
+        table_rows.append([
+            file,
+            f"{output.metrics.counters['voxels']:,}",
+            f"{output.metrics.total_wall_time():.4f}s",
+            bottleneck.name,
+            ", ".join(stage_times)
+        ])
+
+    # sort by the size of the padded volume so the bottleneck can be read as a function of the PSD size
+    table_rows.sort(key=lambda row: int(row[1].replace(",", "")))
+
+    table_header = ["File", "Voxels", "Total Time", "Bottleneck", "Step Times"]
+    print(tabulate.tabulate(table_rows, headers=table_header, tablefmt="orgtbl"))
+
+    print("\n")
+    print(metrics.PipelineMetrics.aggregate(outputs).summary())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Measures how long importing the processing modules the plugin loads at startup takes, each in a fresh interpreter.
+Compares the lazy imports against also importing the modules that are now only loaded on first use (visualization,
+Open3D and skimage), which is what loading the plugin used to cost. Also shows which of those heavy modules got loaded.
+"""
+
+import os
+import statistics
+import subprocess
+import sys
+
+import tabulate
+
+# the modules that are only imported on first use
+DEFERRED_MODULES = ("visual", "open3d", "matplotlib.pyplot", "skimage.measure")
+
+STARTUP_MODULES = ("processing.processing", "processing.batch")
+
+REPEATS = 5
+
+_TIMING_CODE = """
+import sys
+import time
+
+start = time.perf_counter()
+for module in {modules!r}:
+    __import__(module)
+end = time.perf_counter()
+
+print(end - start)
+print(",".join(module for module in {deferred!r} if module in sys.modules))
+"""
+
+
+def time_import(modules: tuple[str, ...]) -> tuple[float, str]:
+    """
+    Imports modules in a fresh interpreter started in the repository root.
+
+    :param modules: The modules to import, in order
+    :return: (median import time in seconds over REPEATS runs, the deferred modules that were loaded)
+    """
+
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+    code = _TIMING_CODE.format(modules=modules, deferred=DEFERRED_MODULES)
+
+    times = []
+    loaded = ""
+
+    for _ in range(REPEATS):
+        result = subprocess.run([sys.executable, "-c", code], cwd=root, capture_output=True, text=True, check=True)
+        lines = result.stdout.strip().splitlines()
+        times.append(float(lines[0]))
+        loaded = lines[1] if len(lines) > 1 else ""
+
+    return statistics.median(times), loaded
+
+
+def main():
+    table_rows = []
+
+    for module in STARTUP_MODULES:
+        lazy_time, lazy_loaded = time_import((module,))
+        eager_time, _ = time_import((module,) + DEFERRED_MODULES)
+
+        table_rows.append([
+            module,
+            f"{lazy_time * 1000:.0f}ms",
+            f"{eager_time * 1000:.0f}ms",
+            f"{eager_time / lazy_time:.2f}x",
+            lazy_loaded or "none"
+        ])
+
+    table_header = ["Module", "Lazy Import", "Eager Import", "Speedup", "Heavy Modules Loaded"]
+    print(tabulate.tabulate(table_rows, headers=table_header, tablefmt="orgtbl"))
+
+
+if __name__ == "__main__":
+    main()
@@ -46,6 +46,18 @@ class Ui_MainFormPancake3D(object):
         self.line_edit_vertex_deletion_threshold.setObjectName("line_edit_vertex_deletion_threshold")
         self.horizontalLayout.addWidget(self.line_edit_vertex_deletion_threshold)
         self.verticalLayout.addLayout(self.horizontalLayout)
+        self.horizontalLayout_7 = QtWidgets.QHBoxLayout()
+        self.horizontalLayout_7.setObjectName("horizontalLayout_7")
+        self.label_workers = QtWidgets.QLabel(MainFormPancake3D)
+        self.label_workers.setObjectName("label_workers")
+        self.horizontalLayout_7.addWidget(self.label_workers)
+        self.spin_box_workers = QtWidgets.QSpinBox(MainFormPancake3D)
+        self.spin_box_workers.setMinimum(1)
+        self.spin_box_workers.setMaximum(64)
+        self.spin_box_workers.setProperty("value", 1)
+        self.spin_box_workers.setObjectName("spin_box_workers")
+        self.horizontalLayout_7.addWidget(self.spin_box_workers)
+        self.verticalLayout.addLayout(self.horizontalLayout_7)
         self.label = QtWidgets.QLabel(MainFormPancake3D)
         font = QtGui.QFont()
         font.setPointSize(14)
@@ -68,6 +80,9 @@ class Ui_MainFormPancake3D(object):
         self.chk_gen_dragonfly_mesh = QtWidgets.QCheckBox(MainFormPancake3D)
         self.chk_gen_dragonfly_mesh.setObjectName("chk_gen_dragonfly_mesh")
         self.verticalLayout.addWidget(self.chk_gen_dragonfly_mesh)
+        self.chk_preview = QtWidgets.QCheckBox(MainFormPancake3D)
+        self.chk_preview.setObjectName("chk_preview")
+        self.verticalLayout.addWidget(self.chk_preview)
         self.label_3 = QtWidgets.QLabel(MainFormPancake3D)
         font = QtGui.QFont()
         font.setPointSize(14)
@@ -129,12 +144,16 @@ class Ui_MainFormPancake3D(object):
         self.line_edit_c_s.setText(_translate("MainFormPancake3D", "0.3"))
         self.label_vertex_deletion_threshold.setText(_translate("MainFormPancake3D", "Vertex deletion threshold (nm)"))
         self.line_edit_vertex_deletion_threshold.setPlaceholderText(_translate("MainFormPancake3D", "Optional: Default Value = Z Spacing / 2"))
+        self.label_workers.setToolTip(_translate("MainFormPancake3D", "The number of processes used to process the PSDs of a MultiROI in parallel. 1 processes them one at a time in Dragonfly\'s process"))
+        self.label_workers.setText(_translate("MainFormPancake3D", "Worker processes (MultiROI)"))
         self.label.setText(_translate("MainFormPancake3D", "<html><head/><body><p><span style=\" font-size:12pt; font-weight:700;\">Output</span></p></body></html>"))
         self.line_edit_file.setPlaceholderText(_translate("MainFormPancake3D", "Optional: CSV File Name"))
         self.btn_file_select.setToolTip(_translate("MainFormPancake3D", "Select Folder"))
         self.btn_file_select.setText(_translate("MainFormPancake3D", "Select Output Folder"))
         self.line_edit_filepath.setPlaceholderText(_translate("MainFormPancake3D", "Optional: Output Filepath"))
         self.chk_gen_dragonfly_mesh.setText(_translate("MainFormPancake3D", "Generate a Dragonfly mesh"))
+        self.chk_preview.setToolTip(_translate("MainFormPancake3D", "Show an approximate area of a single PSD, found on a downsampled copy of it, while the full resolution area is calculated. Usually within 10%, often low. Only shown for cs up to 0.3"))
+        self.chk_preview.setText(_translate("MainFormPancake3D", "Show a quick preview area first"))
         self.label_3.setText(_translate("MainFormPancake3D", "<html><head/><body><p><span style=\" font-size:12pt; font-weight:700;\">Input</span></p></body></html>"))
         self.btn_select_multiroi.setText(_translate("MainFormPancake3D", "Select Multiple PSDs (MultiROI)"))
         self.btn_select_roi.setText(_translate("MainFormPancake3D", "Select Single PSD (ROI)"))
@@ -185,9 +185,11 @@ def vis_3d(
     pcd.points = o3d.utility.Vector3dVector(np.argwhere(dist_map > (-np.inf if show_dist_map else 0)).astype(float)[:, ::-1] * scale.xyz())
 
     if obb is not None:
-        obb.o3d_obb.color = (1, 0, 0)
+        o3d_obb = obb.to_o3d()
+        o3d_obb.color = (1, 0, 0)
     if psd_mesh is not None:
-        psd_mesh.mesh.paint_uniform_color((0.8, 0.8, 0.8))
+        o3d_mesh = psd_mesh.to_o3d()
+        o3d_mesh.paint_uniform_color((0.8, 0.8, 0.8))
 
     # get colors
     if show_dist_map:
@@ -200,10 +202,10 @@ def vis_3d(
     vis.add_geometry(pcd)
 
     if obb is not None:
-        vis.add_geometry(obb.o3d_obb)
+        vis.add_geometry(o3d_obb)
 
     if psd_mesh is not None:
-        vis.add_geometry(psd_mesh.mesh)
+        vis.add_geometry(o3d_mesh)
 
     if center is not None:
         # create a sphere to visualize the center